@@ -3,16 +3,44 @@
 # Requisitos pip:
 # pip install flask huobi-client apscheduler numpy
 
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, request, jsonify, Response, stream_with_context
 import sqlite3
 import os
+import sys
+import socket
+import uuid
+import signal
+import tempfile
+import json
 import time
+import itertools
+import hashlib
 import threading
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import math
+import re
 import statistics
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 
-app = Flask(__name__)
+from indicators import SymbolIndicators
+from stop_book import StopBook
+from symbol_index import SymbolIndex
+from order_netting import OrderBatch, OrderIntent
+from user_cache import UserStateCache
+from kline_store import KlineStore
+from wake_index import WakeIndex
+from history_archive import ColdArchive, HISTORY_FIELDS, ROLLUP_COLUMNS, partition_of, rollup_rows
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, Counter, Gauge, Histogram, CallbackMetric
+import metrics
+from sampling_profiler import SamplingProfiler
+from backends import SystemClock, Store, StaleUser, Exchange, MarketData
+import strategy
+from strategy import (PIRAMIDE_START, TRAILING_STOP_FACTOR, SignalSnapshot, StrategyEnv, UserUnitOfWork,
+                      build_signal_snapshot, parse_symbols, user_symbols)
+
+# routes live on a blueprint; create_app() builds the Flask app (nothing starts at import time)
+api = Blueprint("api", __name__)
 
 # Huobi SDK imports (assume huobi-client package)
 try:
@@ -26,6 +54,25 @@ except Exception:
     TradeClient = None
     OrderType = None
 
+# asyncio client (aiohttp) - used instead of the SDK when EXCHANGE_CLIENT=async
+try:
+    from huobi_async import (HuobiAsyncClient, AsyncBridge, HUOBI_REST_URL as DEFAULT_HUOBI_REST_URL,
+                             DUPLICATE_CLIENT_ORDER_ID, order_fill)
+except Exception:
+    HuobiAsyncClient = None
+    AsyncBridge = None
+    DUPLICATE_CLIENT_ORDER_ID = "order-duplicate-client-order-id"
+    order_fill = None
+    DEFAULT_HUOBI_REST_URL = None
+
+# WebSocket market data feed - used when MARKET_FEED=ws
+try:
+    from market_feed import CandleStore, HuobiMarketFeed, HUOBI_WS_URL as DEFAULT_HUOBI_WS_URL
+except Exception:
+    CandleStore = None
+    HuobiMarketFeed = None
+    DEFAULT_HUOBI_WS_URL = None
+
 # -------------------------
 # Config
 # -------------------------
@@ -33,54 +80,266 @@ DB_FILE = os.getenv("DB_FILE", "users.db")
 HUOBI_API_KEY = os.getenv("HUOBI_API_KEY")
 HUOBI_API_SECRET = os.getenv("HUOBI_API_SECRET")
 
+# "sdk" (blocking huobi SDK) or "async" (aiohttp client with pooling / rate limiting)
+EXCHANGE_CLIENT = os.getenv("EXCHANGE_CLIENT", "sdk")
+HUOBI_REST_URL = os.getenv("HUOBI_REST_URL", DEFAULT_HUOBI_REST_URL or "https://api.huobi.pro")
+# requests per second allowed to market data / order endpoints, and per-request timeout
+HUOBI_MARKET_RATE = float(os.getenv("HUOBI_MARKET_RATE", 10))
+HUOBI_ORDER_RATE = float(os.getenv("HUOBI_ORDER_RATE", 5))
+HUOBI_TIMEOUT_SECONDS = float(os.getenv("HUOBI_TIMEOUT_SECONDS", 10))
+
+# "ws": keep candles in memory from the Huobi WebSocket feed instead of polling REST,
+# and evaluate users as soon as a trade crosses one of their trailing stops
+MARKET_FEED = os.getenv("MARKET_FEED", "")
+HUOBI_WS_URL = os.getenv("HUOBI_WS_URL", DEFAULT_HUOBI_WS_URL or "wss://api.huobi.pro/ws")
+FEED_SYMBOLS = [s for s in os.getenv("FEED_SYMBOLS", "btcusdt").split(",") if s]
+
 # How often strategy loop checks (seconds)
 CHECK_INTERVAL_SECONDS = int(os.getenv("CHECK_INTERVAL_SECONDS", 60))  # default 60s
+# run a scheduler thread inside every web process created by create_app(); leader
+# election still lets only one of them evaluate users. Normally the scheduler is
+# its own process instead ("python app.py scheduler", see Procfile).
+EMBEDDED_SCHEDULER = os.getenv("EMBEDDED_SCHEDULER", "0") == "1"
+# a scheduler that stops renewing its lease is replaced after this many seconds
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", 3 * CHECK_INTERVAL_SECONDS))
 
 # initial virtual balance per user (when registering)
 DEFAULT_INITIAL_BALANCE = float(os.getenv("DEFAULT_INITIAL_BALANCE", "100.0"))
+# symbols traded by users that did not choose their own (register_user / set_symbols "symbols")
+strategy.DEFAULT_SYMBOLS = parse_symbols(os.getenv("DEFAULT_SYMBOLS", "btcusdt")) or strategy.DEFAULT_SYMBOLS
+
+# strategy parameters (pyramid lots, trailing/time/global stops, monthly deposit) live in strategy.py
+
+# SQLite: how long a connection waits on a locked database, and how many times a
+# statement is retried after that before giving up
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+DB_LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES", 3))
+
+# how long fetched klines are shared between callers (seconds); entries also
+# expire as soon as the latest candle closes
+KLINE_CACHE_TTL_SECONDS = float(os.getenv("KLINE_CACHE_TTL_SECONDS", 30))
+# candles downloaded from Huobi are kept in this SQLite file and only the newest
+# ones are fetched again ("" = always fetch full windows)
+KLINE_DB_FILE = os.getenv("KLINE_DB_FILE", "klines.db")
 
-# pyramid starting lot for altcoins vs btc-like can be configured per user if wanted
-PIRAMIDE_MULT = 1.3
-PIRAMIDE_START = 40.0  # USD
+# strategy loop: worker threads evaluating users in parallel
+STRATEGY_WORKERS = int(os.getenv("STRATEGY_WORKERS", 4))
+# a user write computed from a row that someone else wrote meanwhile is refused
+# and recomputed from the fresh row, up to this many attempts in all
+USER_COMMIT_ATTEMPTS = int(os.getenv("USER_COMMIT_ATTEMPTS", 5))
+# evaluate only the users whose wake plan (strategy.wake_plan) says something can
+# happen this tick; 0 = evaluate every user on every tick
+WAKE_SCHEDULING = os.getenv("WAKE_SCHEDULING", "1") == "1"
 
-# trailing stop base factor
-TRAILING_STOP_FACTOR = 0.90  # 10% below peak by default (adaptive via ATR later)
+# net the orders of one cycle per symbol into one exchange order; a net order
+# larger than ORDER_MAX_SLICE_QTY (base currency, 0 = no limit) is sent in slices
+ORDER_NETTING = os.getenv("ORDER_NETTING", "1") == "1"
+ORDER_MAX_SLICE_QTY = float(os.getenv("ORDER_MAX_SLICE_QTY", 0))
+# order outbox: evaluations only write their orders to order_outbox (in the same
+# transaction as the positions and history); the scheduler leader's executor
+# sends them in the background with retries and idempotent client order ids.
+# 0 = orders are sent by the evaluating thread (batched per cycle, or inline).
+ORDER_OUTBOX = os.getenv("ORDER_OUTBOX", "1") == "1"
+ORDER_EXECUTOR_WORKERS = int(os.getenv("ORDER_EXECUTOR_WORKERS", 4))
+ORDER_MAX_ATTEMPTS = int(os.getenv("ORDER_MAX_ATTEMPTS", 5))
+ORDER_RETRY_SECONDS = float(os.getenv("ORDER_RETRY_SECONDS", 2))  # doubles with every attempt
+ORDER_OUTBOX_POLL_SECONDS = float(os.getenv("ORDER_OUTBOX_POLL_SECONDS", 1))
 
-# stop time (days) to liquidate half if no +5%
-STOP_TIME_DAYS = 60
+# HTTP read cache of per-user responses (/balance, /history): users kept, and how
+# long a value is served; writes from this process drop it at once, writes from
+# the scheduler process show up after at most the TTL
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 5))
 
-# stop global percent from equity top
-STOP_GLOBAL_PCT = 0.25  # 25%
+# metrics: the scheduler process (no Flask) serves /metrics on this port (0 = off);
+# web processes serve it on the app. Cycle profiles (folded stacks) go to PROFILE_DIR.
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", tempfile.gettempdir())
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
 
-# Monthly deposit
-MONTHLY_DEPOSIT = 500.0
+# /history page sizes
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 100))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 1000))
+# batch endpoints: users per POST /balance and per POST /register_users
+BALANCE_BATCH_MAX = int(os.getenv("BALANCE_BATCH_MAX", 1000))
+REGISTER_BATCH_MAX = int(os.getenv("REGISTER_BATCH_MAX", 10000))
+# history upkeep, run by the scheduler leader every HISTORY_MAINTENANCE_SECONDS:
+# new rows are folded into the pnl_daily rollups, then rolled-up rows older than
+# HISTORY_HOT_DAYS (0 = never) move to gzip'd monthly files in HISTORY_ARCHIVE_DIR
+HISTORY_HOT_DAYS = int(os.getenv("HISTORY_HOT_DAYS", 0))
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "history_archive")
+HISTORY_MAINTENANCE_SECONDS = float(os.getenv("HISTORY_MAINTENANCE_SECONDS", 300))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 5000))
 
 # -------------------------
-# Init Huobi clients (if available)
+# Metrics (GET /metrics, Prometheus text format)
+# -------------------------
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+CYCLE_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 300.0, 600.0)
+
+KLINES_FETCH_SECONDS = Histogram("huobi_fetch_klines_seconds", "fetch_klines latency (feed, REST or simulated)", ["period"])
+KLINES_DOWNLOADED = Counter("huobi_klines_requested_total", "Candles requested from Huobi REST (size parameter sum)", ["period"])
+KLINES_FETCH_EMPTY = Counter("huobi_fetch_klines_empty_total", "fetch_klines calls that returned no candles (errors)", ["period"])
+ORDER_SECONDS = Histogram("huobi_order_seconds", "place_market_order_huobi latency", ["side"])
+ORDERS = Counter("huobi_orders_total", "Market orders by side and result status (ok, simulated, error)", ["side", "status"])
+USER_EVAL_SECONDS = Histogram("strategy_user_evaluation_seconds", "Time to evaluate one user")
+CYCLE_SECONDS = Histogram("strategy_cycle_seconds", "Duration of a full strategy cycle", buckets=CYCLE_BUCKETS)
+CYCLE_INTERVAL = Gauge("strategy_cycle_interval_seconds", "Configured CHECK_INTERVAL_SECONDS")
+CYCLE_UTILIZATION = Gauge("strategy_cycle_utilization", "Last cycle duration / interval (>1 means overrun)")
+CYCLE_OVERRUNS = Counter("strategy_cycle_overruns_total", "Cycles that ran past the next tick")
+USER_COMMIT_CONFLICTS = Counter("strategy_user_commit_conflicts_total", "Evaluations refused at commit because the user changed meanwhile")
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "db_execute latency by calling helper", ["helper"], buckets=DB_BUCKETS)
+DB_TRANSACTION_SECONDS = Histogram("db_transaction_seconds", "db_transaction duration (BEGIN..COMMIT) by calling helper",
+                                   ["helper"], buckets=DB_BUCKETS)
+
+# -------------------------
+# Init Huobi clients (if available) - lazily, on first exchange call
 # -------------------------
 market_client = None
 account_client = None
 trade_client = None
 huobi_account_id_cache = None
+async_client = None
+async_bridge = None
+candle_store = None  # set up with the market feed (MARKET_FEED=ws)
+market_feed = None
+_clients_ready = False
+_clients_lock = threading.Lock()
 
-if HUOBI_API_KEY and HUOBI_API_SECRET and MarketClient is not None:
-    try:
-        market_client = MarketClient()
-        account_client = AccountClient(api_key=HUOBI_API_KEY, secret_key=HUOBI_API_SECRET)
-        trade_client = TradeClient(api_key=HUOBI_API_KEY, secret_key=HUOBI_API_SECRET)
-    except Exception as e:
-        print("Warning: failed to init Huobi clients:", e)
-else:
-    print("Huobi SDK not configured or not installed - running strategy in simulation mode.")
+def init_exchange_clients():
+    """Build the Huobi clients once per process; web workers that never trade never build them."""
+    global market_client, account_client, trade_client, async_client, async_bridge, _clients_ready
+    if _clients_ready:
+        return
+    with _clients_lock:
+        if _clients_ready:
+            return
+        if EXCHANGE_CLIENT == "async" and HuobiAsyncClient is not None:
+            # market data is public; orders are only sent for real when keys are set
+            async_bridge = async_bridge or AsyncBridge()
+            async_client = HuobiAsyncClient(HUOBI_REST_URL, api_key=HUOBI_API_KEY, secret_key=HUOBI_API_SECRET,
+                                            rate=HUOBI_MARKET_RATE, order_rate=HUOBI_ORDER_RATE, timeout=HUOBI_TIMEOUT_SECONDS)
+            print("Using async Huobi client at", HUOBI_REST_URL,
+                  "" if HUOBI_API_KEY and HUOBI_API_SECRET else "(no keys: orders simulated)")
+        elif HUOBI_API_KEY and HUOBI_API_SECRET and MarketClient is not None:
+            try:
+                market_client = MarketClient()
+                account_client = AccountClient(api_key=HUOBI_API_KEY, secret_key=HUOBI_API_SECRET)
+                trade_client = TradeClient(api_key=HUOBI_API_KEY, secret_key=HUOBI_API_SECRET)
+            except Exception as e:
+                print("Warning: failed to init Huobi clients:", e)
+        else:
+            print("Huobi SDK not configured or not installed - running strategy in simulation mode.")
+        _clients_ready = True
 
 
 # -------------------------
 # DB helpers
 # -------------------------
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
+# one long-lived connection per thread (gunicorn worker, strategy loop, ...)
+_db_local = threading.local()
+
+def get_db():
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and _db_local.path == DB_FILE:
+        return conn
+    conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=256)
+    # WAL: readers never block the writer and vice versa
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-16000")  # ~16MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    _db_local.conn = conn
+    _db_local.path = DB_FILE
+    return conn
+
+def close_db():
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _db_local.conn = None
+
+# timestamps are stored as epoch seconds and shown as ISO strings
+clock = SystemClock()
+
+def now_ts():
+    return clock.now()
+
+def ts_to_iso(ts):
+    return datetime.utcfromtimestamp(ts).isoformat() if ts is not None else None
+
+
+# -------------------------
+# Utility: DB CRUD
+# -------------------------
+def _is_read_only(query):
+    return query.lstrip()[:6].upper() == "SELECT"
+
+def _is_locked_error(e):
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+def db_execute(query, params=(), fetch=False, helper="other"):
+    """
+    Run one statement on this thread's pooled connection.
+    SELECTs do not commit; writes commit immediately. If the database stays
+    locked past the busy timeout the statement is retried with backoff.
+    helper: the calling helper's name, the label of its latency in db_query_seconds.
+    """
+    conn = get_db()
+    read_only = _is_read_only(query)
+    started = time.perf_counter()
+    for attempt in range(DB_LOCK_RETRIES + 1):
+        try:
+            c = conn.execute(query, params)
+            rows = c.fetchall() if fetch else None
+            if not read_only:
+                conn.commit()
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, helper=helper)
+            return rows
+        except sqlite3.OperationalError as e:
+            if not _is_locked_error(e) or attempt == DB_LOCK_RETRIES:
+                raise
+            if conn.in_transaction:
+                conn.rollback()
+            time.sleep(0.05 * (2 ** attempt))
+
+@contextmanager
+def db_transaction(helper="other"):
+    """
+    Single write transaction on this thread's connection: commits on success,
+    rolls back on any exception. BEGIN IMMEDIATE takes the write lock up front
+    (retried like db_execute) so the body never fails half way on a lock.
+    helper labels its duration in db_transaction_seconds, like db_execute's.
+    """
+    conn = get_db()
+    started = time.perf_counter()
+    for attempt in range(DB_LOCK_RETRIES + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if not _is_locked_error(e) or attempt == DB_LOCK_RETRIES:
+                raise
+            time.sleep(0.05 * (2 ** attempt))
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        DB_TRANSACTION_SECONDS.observe(time.perf_counter() - started, helper=helper)
+
+# -------------------------
+# Schema migrations
+# -------------------------
+# Timestamps are stored as integer epoch seconds (UTC). Each migration runs in
+# its own transaction and is recorded in schema_version, so an existing
+# users.db is upgraded in place the next time the app starts.
+def _migration_base_tables(conn):
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id TEXT PRIMARY KEY,
             email TEXT,
@@ -91,7 +350,7 @@ def init_db():
             last_deposit TEXT
         )
     ''')
-    c.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS positions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id TEXT,
@@ -104,7 +363,7 @@ def init_db():
             last_checked TEXT
         )
     ''')
-    c.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id TEXT,
@@ -116,34 +375,208 @@ def init_db():
             timestamp TEXT
         )
     ''')
-    conn.commit()
-    conn.close()
 
-init_db()
+def _iso_to_epoch_sql(col):
+    return f"CAST(strftime('%s', {col}) AS INTEGER)"
+
+def _migration_epoch_timestamps(conn):
+    # SQLite cannot change a column type: rebuild each table with INTEGER time columns
+    conn.execute('''
+        CREATE TABLE users_new (
+            user_id TEXT PRIMARY KEY,
+            email TEXT,
+            balance REAL,
+            cash REAL,
+            next_lot REAL,
+            max_equity REAL,
+            last_deposit INTEGER
+        )
+    ''')
+    conn.execute(f"INSERT INTO users_new SELECT user_id, email, balance, cash, next_lot, max_equity, {_iso_to_epoch_sql('last_deposit')} FROM users")
+    conn.execute('''
+        CREATE TABLE positions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            symbol TEXT,
+            qty REAL,
+            avg_price REAL,
+            entry_time INTEGER,
+            trailing_stop REAL,
+            last_profit_check_price REAL,
+            last_checked INTEGER
+        )
+    ''')
+    conn.execute(f"""INSERT INTO positions_new SELECT id, user_id, symbol, qty, avg_price, {_iso_to_epoch_sql('entry_time')},
+                     trailing_stop, last_profit_check_price, {_iso_to_epoch_sql('last_checked')} FROM positions""")
+    conn.execute('''
+        CREATE TABLE history_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            action TEXT,
+            symbol TEXT,
+            qty REAL,
+            price REAL,
+            info TEXT,
+            timestamp INTEGER
+        )
+    ''')
+    conn.execute(f"INSERT INTO history_new SELECT id, user_id, action, symbol, qty, price, info, {_iso_to_epoch_sql('timestamp')} FROM history")
+    for table in ("users", "positions", "history"):
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _migration_hot_query_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_user_symbol ON positions(user_id, symbol)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_user_id ON history(user_id, id)")
+
+def _migration_scheduler_lease(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS scheduler_lease (name TEXT PRIMARY KEY, owner TEXT, expires_at INTEGER)")
+
+def _migration_user_symbols(conn):
+    # comma-separated universe per user; NULL = DEFAULT_SYMBOLS
+    conn.execute("ALTER TABLE users ADD COLUMN symbols TEXT")
+
+def _migration_order_outbox(conn):
+    # one row per user order; rows claimed together are netted and sent as one claim
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            history_id INTEGER,
+            user_id TEXT,
+            symbol TEXT,
+            side TEXT,
+            qty REAL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            claim_id TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER,
+            updated_at INTEGER
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_outbox_status ON order_outbox(status, symbol, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_outbox_claim ON order_outbox(claim_id)")
+
+def _migration_user_updated_at(conn):
+    # bumped by triggers on any write the wake plans depend on, from any process
+    now_sql = "CAST(strftime('%s','now') AS INTEGER)"
+    conn.execute("ALTER TABLE users ADD COLUMN updated_at INTEGER")
+    conn.execute(f"UPDATE users SET updated_at={now_sql}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at)")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS users_touch_insert AFTER INSERT ON users BEGIN
+                         UPDATE users SET updated_at={now_sql} WHERE user_id=NEW.user_id; END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS users_touch_update
+                         AFTER UPDATE OF cash, next_lot, max_equity, last_deposit, symbols ON users BEGIN
+                         UPDATE users SET updated_at={now_sql} WHERE user_id=NEW.user_id; END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS positions_touch_insert AFTER INSERT ON positions BEGIN
+                         UPDATE users SET updated_at={now_sql} WHERE user_id=NEW.user_id; END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS positions_touch_update
+                         AFTER UPDATE OF symbol, qty, avg_price, entry_time, trailing_stop, last_profit_check_price ON positions BEGIN
+                         UPDATE users SET updated_at={now_sql} WHERE user_id=NEW.user_id; END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS positions_touch_delete AFTER DELETE ON positions BEGIN
+                         UPDATE users SET updated_at={now_sql} WHERE user_id=OLD.user_id; END""")
+
+def _migration_pnl_rollups(conn):
+    # per-user daily and all-time rollups of history, the average cost they are
+    # computed with, and how far the rollup / archival got
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pnl_daily (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            deposits REAL NOT NULL DEFAULT 0,
+            buys INTEGER NOT NULL DEFAULT 0,
+            sells INTEGER NOT NULL DEFAULT 0,
+            bought REAL NOT NULL DEFAULT 0,
+            sold REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pnl_totals (
+            user_id TEXT PRIMARY KEY,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            deposits REAL NOT NULL DEFAULT 0,
+            buys INTEGER NOT NULL DEFAULT 0,
+            sells INTEGER NOT NULL DEFAULT 0,
+            bought REAL NOT NULL DEFAULT 0,
+            sold REAL NOT NULL DEFAULT 0,
+            first_day TEXT,
+            last_day TEXT
+        )
+    ''')
+    conn.execute("CREATE TABLE IF NOT EXISTS pnl_cost_basis (user_id TEXT NOT NULL, symbol TEXT NOT NULL, qty REAL, cost REAL, "
+                 "PRIMARY KEY (user_id, symbol)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS history_partitions (partition TEXT PRIMARY KEY, rows INTEGER, min_id INTEGER, "
+                 "max_id INTEGER, updated_at INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS maintenance_state (name TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_outbox_history ON order_outbox(history_id)")
+
+def _migration_user_version(conn):
+    # optimistic concurrency: bumped by the same triggers as updated_at, so a
+    # commit can tell whether the user changed (from any process) since it was loaded
+    now_sql = "CAST(strftime('%s','now') AS INTEGER)"
+    touch = f"UPDATE users SET updated_at={now_sql}, version=version+1"
+    conn.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    for trigger in ("users_touch_update", "positions_touch_insert", "positions_touch_update", "positions_touch_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute(f"""CREATE TRIGGER users_touch_update
+                         AFTER UPDATE OF cash, next_lot, max_equity, last_deposit, symbols ON users BEGIN
+                         {touch} WHERE user_id=NEW.user_id; END""")
+    conn.execute(f"""CREATE TRIGGER positions_touch_insert AFTER INSERT ON positions BEGIN
+                         {touch} WHERE user_id=NEW.user_id; END""")
+    conn.execute(f"""CREATE TRIGGER positions_touch_update
+                         AFTER UPDATE OF symbol, qty, avg_price, entry_time, trailing_stop, last_profit_check_price ON positions BEGIN
+                         {touch} WHERE user_id=NEW.user_id; END""")
+    conn.execute(f"""CREATE TRIGGER positions_touch_delete AFTER DELETE ON positions BEGIN
+                         {touch} WHERE user_id=OLD.user_id; END""")
+
+def _migration_outbox_positions(conn):
+    # the position each order opened or reduced (JSON, as committed), so its actual fill can be booked into it
+    conn.execute("ALTER TABLE order_outbox ADD COLUMN position TEXT")
+
+# (version, description, function) - append only, never edit an applied migration
+MIGRATIONS = [
+    (1, "base tables", _migration_base_tables),
+    (2, "integer epoch timestamps", _migration_epoch_timestamps),
+    (3, "indexes for positions/history by user", _migration_hot_query_indexes),
+    (4, "scheduler leader lease", _migration_scheduler_lease),
+    (5, "per-user symbol universe", _migration_user_symbols),
+    (6, "order outbox", _migration_order_outbox),
+    (7, "users.updated_at for wake scheduling", _migration_user_updated_at),
+    (8, "pnl rollups and history partitions", _migration_pnl_rollups),
+    (9, "users.version for optimistic commits", _migration_user_version),
+    (10, "order outbox positions for fill reconciliation", _migration_outbox_positions),
+]
+
+def get_schema_version():
+    rows = db_execute("SELECT MAX(version) FROM schema_version", fetch=True, helper="get_schema_version")
+    return rows[0][0] or 0
+
+def init_db(target_version=None):
+    """Create schema_version if needed and apply every pending migration (up to target_version)."""
+    db_execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at INTEGER)", helper="init_db")
+    current = get_schema_version()
+    for version, description, migrate in MIGRATIONS:
+        if version <= current or (target_version is not None and version > target_version):
+            continue
+        with db_transaction("init_db") as conn:
+            migrate(conn)
+            conn.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?,?,?)",
+                         (version, description, now_ts()))
+        print(f"DB migrated to schema version {version}: {description}")
 
 
 # -------------------------
-# Utility: DB CRUD
+# Users / positions / history
 # -------------------------
-def db_execute(query, params=(), fetch=False):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute(query, params)
-    if fetch:
-        rows = c.fetchall()
-        conn.commit()
-        conn.close()
-        return rows
-    conn.commit()
-    conn.close()
-    return None
+# per-user response cache for the HTTP reads; every write to a user invalidates it
+user_cache = UserStateCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
 
-# get user record
-def get_user(user_id):
-    rows = db_execute("SELECT user_id, email, balance, cash, next_lot, max_equity, last_deposit FROM users WHERE user_id=?", (user_id,), fetch=True)
-    if not rows:
-        return None
-    u = rows[0]
+USER_COLUMNS = "user_id, email, balance, cash, next_lot, max_equity, last_deposit, symbols, version"
+POSITION_COLUMNS = "id, symbol, qty, avg_price, entry_time, trailing_stop, last_profit_check_price"
+
+def _user_from_row(u):
     return {
         "user_id": u[0],
         "email": u[1],
@@ -151,17 +584,54 @@ def get_user(user_id):
         "cash": float(u[3]),
         "next_lot": float(u[4]),
         "max_equity": float(u[5]),
-        "last_deposit": u[6]
+        "last_deposit": u[6],
+        "symbols": u[7],
+        "version": u[8]
     }
 
-def create_user_db(user_id, email=None, initial_balance=DEFAULT_INITIAL_BALANCE):
+def _position_from_row(r):
+    return {"id": r[0], "symbol": r[1], "qty": float(r[2]), "avg_price": float(r[3]), "entry_time": r[4], "trailing_stop": float(r[5]),
+            "last_profit_check_price": float(r[6]) if r[6] is not None else None}
+
+# get user record
+def get_user(user_id):
+    rows = db_execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id=?", (user_id,), fetch=True, helper="get_user")
+    return _user_from_row(rows[0]) if rows else None
+
+def create_users_db(users, chunk=500):
+    """
+    Insert many users ({user_id, email, balance, symbols}) in one transaction;
+    ids that already exist are left untouched. Returns the set of those ids.
+    """
+    now = now_ts()
+    ids = [u["user_id"] for u in users]
+    existing = set()
+    with db_transaction("create_users_db") as conn:
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            existing.update(r[0] for r in conn.execute(
+                f"SELECT user_id FROM users WHERE user_id IN ({','.join('?' * len(part))})", part))
+        conn.executemany("INSERT OR IGNORE INTO users (user_id, email, balance, cash, next_lot, max_equity, last_deposit, symbols) VALUES (?,?,?,?,?,?,?,?)",
+                         [(u["user_id"], u.get("email"), u["balance"], u["balance"], PIRAMIDE_START, u["balance"], now, u.get("symbols"))
+                          for u in users if u["user_id"] not in existing])
+    return existing
+
+def create_user_db(user_id, email=None, initial_balance=DEFAULT_INITIAL_BALANCE, symbols=None):
     existing = get_user(user_id)
     if existing:
         return existing
-    db_execute("INSERT INTO users (user_id, email, balance, cash, next_lot, max_equity, last_deposit) VALUES (?,?,?,?,?,?,?)",
-               (user_id, email, initial_balance, initial_balance, PIRAMIDE_START, initial_balance, datetime.utcnow().isoformat()))
+    db_execute("INSERT INTO users (user_id, email, balance, cash, next_lot, max_equity, last_deposit, symbols) VALUES (?,?,?,?,?,?,?,?)",
+               (user_id, email, initial_balance, initial_balance, PIRAMIDE_START, initial_balance, now_ts(), symbols), helper="create_user_db")
     return get_user(user_id)
 
+def set_user_symbols(user_id, symbols):
+    """symbols: "a,b" (or None to fall back to DEFAULT_SYMBOLS); False if the user does not exist."""
+    if not get_user(user_id):
+        return False
+    db_execute("UPDATE users SET symbols=? WHERE user_id=?", (symbols, user_id), helper="set_user_symbols")
+    user_cache.invalidate(user_id)
+    return True
+
 def update_user_balance_and_lot(user_id, new_balance, new_cash, next_lot=None, max_equity=None):
     user = get_user(user_id)
     if not user:
@@ -169,111 +639,196 @@ def update_user_balance_and_lot(user_id, new_balance, new_cash, next_lot=None, m
     nl = next_lot if next_lot is not None else user["next_lot"]
     me = max_equity if max_equity is not None else user["max_equity"]
     db_execute("UPDATE users SET balance=?, cash=?, next_lot=?, max_equity=?, last_deposit=? WHERE user_id=?",
-               (new_balance, new_cash, nl, me, user["last_deposit"], user_id))
+               (new_balance, new_cash, nl, me, user["last_deposit"], user_id), helper="update_user_balance_and_lot")
+    user_cache.invalidate(user_id)
     return get_user(user_id)
 
 def save_history(user_id, action, symbol, qty, price, info=""):
     db_execute("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) VALUES (?,?,?,?,?,?,?)",
-               (user_id, action, symbol, qty, price, info, datetime.utcnow().isoformat()))
+               (user_id, action, symbol, qty, price, info, now_ts()), helper="save_history")
+    user_cache.invalidate(user_id)
 
-def get_history(user_id):
-    rows = db_execute("SELECT action, symbol, qty, price, info, timestamp FROM history WHERE user_id=? ORDER BY id DESC", (user_id,), fetch=True)
-    return [{"action": r[0], "symbol": r[1], "qty": r[2], "price": r[3], "info": r[4], "time": r[5]} for r in rows]
+def get_history(user_id, limit=None, before_id=None, action=None, symbol=None, since=None, until=None):
+    """
+    History rows newest first. Keyset pagination: pass the last "id" seen as
+    before_id to get the next page (served by the (user_id, id) index).
+    since/until are epoch seconds (inclusive / exclusive).
+    """
+    query = "SELECT id, action, symbol, qty, price, info, timestamp FROM history WHERE user_id=?"
+    params = [user_id]
+    if before_id is not None:
+        query += " AND id<?"
+        params.append(before_id)
+    if action:
+        query += " AND action=?"
+        params.append(action)
+    if symbol:
+        query += " AND symbol=?"
+        params.append(symbol)
+    if since is not None:
+        query += " AND timestamp>=?"
+        params.append(since)
+    if until is not None:
+        query += " AND timestamp<?"
+        params.append(until)
+    query += " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    rows = db_execute(query, params, fetch=True, helper="get_history")
+    return [_history_from_row(r) for r in rows]
+
+def _history_from_row(r):
+    return {"id": r[0], "action": r[1], "symbol": r[2], "qty": r[3], "price": r[4], "info": r[5], "time": ts_to_iso(r[6])}
+
+def get_latest_history_many(user_ids, limit=20, chunk=200):
+    """
+    {user_id: latest `limit` history rows, newest first} in one query per `chunk`
+    users: a UNION ALL of one (user_id, id) index range per user.
+    """
+    out = {uid: [] for uid in user_ids}
+    user_ids = list(out)
+    branch = ("SELECT * FROM (SELECT user_id, id, action, symbol, qty, price, info, timestamp FROM history "
+              f"WHERE user_id=? ORDER BY id DESC LIMIT {int(limit)})")
+    for i in range(0, len(user_ids), chunk):
+        ids = user_ids[i:i + chunk]
+        for r in db_execute(" UNION ALL ".join([branch] * len(ids)), ids, fetch=True, helper="get_latest_history_many"):
+            out[r[0]].append(_history_from_row(r[1:]))
+    for rows in out.values():
+        rows.sort(key=lambda h: h["id"], reverse=True)
+    return out
 
 def add_position(user_id, symbol, qty, avg_price, trailing_stop):
     db_execute("INSERT INTO positions (user_id, symbol, qty, avg_price, entry_time, trailing_stop, last_profit_check_price, last_checked) VALUES (?,?,?,?,?,?,?,?)",
-               (user_id, symbol, qty, avg_price, datetime.utcnow().isoformat(), trailing_stop, avg_price, datetime.utcnow().isoformat()))
+               (user_id, symbol, qty, avg_price, now_ts(), trailing_stop, avg_price, now_ts()), helper="add_position")
+    user_cache.invalidate(user_id)
 
 def get_positions(user_id):
-    rows = db_execute("SELECT id, symbol, qty, avg_price, entry_time, trailing_stop FROM positions WHERE user_id=?", (user_id,), fetch=True)
-    return [{"id": r[0], "symbol": r[1], "qty": float(r[2]), "avg_price": float(r[3]), "entry_time": r[4], "trailing_stop": float(r[5])} for r in rows]
+    rows = db_execute(f"SELECT {POSITION_COLUMNS} FROM positions WHERE user_id=?", (user_id,), fetch=True, helper="get_positions")
+    return [_position_from_row(r) for r in rows]
 
-def update_position_qty_and_stop(pos_id, new_qty, new_stop):
+def load_users_with_positions(user_ids=None, chunk=500):
+    """{user_id: (user, positions)} for `user_ids` (every user if None), in a few set-based queries."""
+    if user_ids is None:
+        out = {u[0]: (_user_from_row(u), []) for u in db_execute(f"SELECT {USER_COLUMNS} FROM users", fetch=True, helper="load_users_with_positions")}
+        for r in db_execute(f"SELECT user_id, {POSITION_COLUMNS} FROM positions", fetch=True, helper="load_users_with_positions"):
+            if r[0] in out:
+                out[r[0]][1].append(_position_from_row(r[1:]))
+        return out
+    out = {}
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), chunk):
+        ids = user_ids[i:i + chunk]
+        marks = ",".join("?" * len(ids))
+        for u in db_execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id IN ({marks})", ids, fetch=True, helper="load_users_with_positions"):
+            out[u[0]] = (_user_from_row(u), [])
+        for r in db_execute(f"SELECT user_id, {POSITION_COLUMNS} FROM positions WHERE user_id IN ({marks})", ids, fetch=True, helper="load_users_with_positions"):
+            if r[0] in out:
+                out[r[0]][1].append(_position_from_row(r[1:]))
+    return out
+
+def users_updated_since(ts):
+    return [r[0] for r in db_execute("SELECT user_id FROM users WHERE updated_at>=?", (ts,), fetch=True, helper="users_updated_since")]
+
+def update_position_qty_and_stop(pos_id, new_qty, new_stop, last_profit_check_price=None):
     if new_qty <= 0:
-        db_execute("DELETE FROM positions WHERE id=?", (pos_id,))
+        db_execute("DELETE FROM positions WHERE id=?", (pos_id,), helper="update_position_qty_and_stop")
+        return
+    if last_profit_check_price is not None:
+        db_execute("UPDATE positions SET qty=?, trailing_stop=?, last_profit_check_price=?, last_checked=? WHERE id=?",
+                   (new_qty, new_stop, last_profit_check_price, now_ts(), pos_id), helper="update_position_qty_and_stop")
         return
-    db_execute("UPDATE positions SET qty=?, trailing_stop=?, last_checked=? WHERE id=?", (new_qty, new_stop, datetime.utcnow().isoformat(), pos_id))
+    db_execute("UPDATE positions SET qty=?, trailing_stop=?, last_checked=? WHERE id=?", (new_qty, new_stop, now_ts(), pos_id),
+               helper="update_position_qty_and_stop")
 
 def delete_position(pos_id):
-    db_execute("DELETE FROM positions WHERE id=?", (pos_id,))
+    db_execute("DELETE FROM positions WHERE id=?", (pos_id,), helper="delete_position")
 
 # -------------------------
-# Technical indicators helpers
+# Store (SQLite) for the strategy core
 # -------------------------
-# candles: list of dicts with keys: timestamp, open, high, low, close, volume
-def sma(values, period):
-    if len(values) < period:
-        return None
-    return sum(values[-period:]) / period
+class SQLiteStore(Store):
+    """backends.Store on the app's database; commit() is one write transaction."""
+
+    def get_user(self, user_id):
+        return get_user(user_id)
+
+    def get_positions(self, user_id):
+        return get_positions(user_id)
+
+    def create_user(self, user_id, email, initial_balance, next_lot, now, symbols=None):
+        db_execute("INSERT OR IGNORE INTO users (user_id, email, balance, cash, next_lot, max_equity, last_deposit, symbols) VALUES (?,?,?,?,?,?,?,?)",
+                   (user_id, email, initial_balance, initial_balance, next_lot, initial_balance, now, symbols), helper="SQLiteStore.create_user")
+        return get_user(user_id)
+
+    def user_ids(self):
+        return [r[0] for r in db_execute("SELECT user_id FROM users", fetch=True, helper="SQLiteStore.user_ids")]
+
+    def all_positions(self):
+        return db_execute("SELECT id, user_id, symbol, avg_price, trailing_stop FROM positions", fetch=True, helper="SQLiteStore.all_positions")
+
+    def commit(self, user_id, user=None, deleted=(), updated=(), new=(), history=(), order_history=(), orders=(),
+               now=None, version=None):
+        now = now if now is not None else now_ts()
+        with db_transaction("SQLiteStore.commit") as conn:
+            # BEGIN IMMEDIATE holds the write lock: nobody can write the user between this check and the commit
+            row = conn.execute("SELECT version FROM users WHERE user_id=?", (user_id,)).fetchone()
+            if version is not None and (row is None or row[0] != version):
+                raise StaleUser(user_id)
+            if user is not None:
+                conn.execute("UPDATE users SET balance=?, cash=?, next_lot=?, max_equity=?, last_deposit=? WHERE user_id=?",
+                             (user["balance"], user["cash"], user["next_lot"], user["max_equity"], user["last_deposit"], user_id))
+            if deleted:
+                conn.executemany("DELETE FROM positions WHERE id=?", [(pid,) for pid in deleted])
+            if updated:
+                conn.executemany("UPDATE positions SET qty=?, trailing_stop=?, last_profit_check_price=?, entry_time=?, last_checked=? WHERE id=?",
+                                 [(p["qty"], p["trailing_stop"], p["last_profit_check_price"], p["entry_time"], now, p["id"])
+                                  for p in updated])
+            for p in new:
+                # one by one: the stop book needs the new ids
+                cur = conn.execute("INSERT INTO positions (user_id, symbol, qty, avg_price, entry_time, trailing_stop, last_profit_check_price, last_checked) VALUES (?,?,?,?,?,?,?,?)",
+                                   (user_id, p["symbol"], p["qty"], p["avg_price"], p["entry_time"], p["trailing_stop"],
+                                    p["last_profit_check_price"], now))
+                p["id"] = cur.lastrowid
+            if history:
+                conn.executemany("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) VALUES (?,?,?,?,?,?,?)",
+                                 history)
+            # one by one as well: order rows are filled in once the batch is sent
+            history_ids = [conn.execute("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) VALUES (?,?,?,?,?,?,?)",
+                                        row).lastrowid for row in order_history]
+            if ORDER_OUTBOX and orders:
+                conn.executemany("INSERT INTO order_outbox (history_id, user_id, symbol, side, qty, position, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?)",
+                                 [(hid, user_id, symbol, side, qty, json.dumps(p) if p else None, now, now)
+                                  for hid, (symbol, side, qty, p) in zip(history_ids, orders)])
+            row = conn.execute("SELECT version FROM users WHERE user_id=?", (user_id,)).fetchone()
+        user_cache.invalidate(user_id)
+        return history_ids, row[0] if row else None
+
+    def update_history_info(self, rows):
+        if rows:
+            with db_transaction("SQLiteStore.update_history_info") as conn:
+                conn.executemany("UPDATE history SET info=? WHERE id=?", rows)
+
+    def raise_stops(self, changes):
+        if changes:
+            with db_transaction("SQLiteStore.raise_stops") as conn:
+                conn.executemany("UPDATE positions SET trailing_stop=? WHERE id=? AND trailing_stop<?",
+                                 [(stop, pid, stop) for stop, pid in changes])
+
+store = SQLiteStore()
+
+# -------------------------
+# Stop index (trailing stops of every open position, by symbol)
+# -------------------------
+stop_book = StopBook(TRAILING_STOP_FACTOR)
+
+def flush_stop_ratchets(symbol=None):
+    """Persist the ratchets the stop book applied lazily since the last flush, in one batch."""
+    changes = stop_book.flush(symbol)
+    store.raise_stops(changes)
+    user_cache.invalidate_many(stop_book.user_of(pid) for _, pid in changes)
+    return len(changes)
 
-def ema(values, period):
-    if len(values) < period:
-        return None
-    k = 2 / (period + 1)
-    ema_prev = values[0]
-    for v in values[1:]:
-        ema_prev = v * k + ema_prev * (1 - k)
-    return ema_prev
-
-def compute_sma_list(values, period):
-    return [ (sum(values[i-period+1:i+1]) / period) if i+1 >= period else None for i in range(len(values)) ]
-
-def macd_line(values, fast=12, slow=26, signal=9):
-    # compute EMA fast and slow, then macd and signal
-    if len(values) < slow + signal:
-        return None, None
-    # compute EMA arrays
-    ema_fast = []
-    ema_slow = []
-    k_fast = 2/(fast+1)
-    k_slow = 2/(slow+1)
-    # seed with first value
-    ema_f = values[0]
-    ema_s = values[0]
-    for v in values:
-        ema_f = v*k_fast + ema_f*(1-k_fast)
-        ema_s = v*k_slow + ema_s*(1-k_slow)
-        ema_fast.append(ema_f)
-        ema_slow.append(ema_s)
-    macd = [f - s for f,s in zip(ema_fast, ema_slow)]
-    # signal as EMA of macd
-    sig = macd[0]
-    for m in macd:
-        sig = m*(2/(signal+1)) + sig*(1-2/(signal+1))
-    hist = macd[-1] - sig
-    return macd[-1], sig  # return macd last and signal
-
-def rsi(values, period=14):
-    if len(values) < period+1:
-        return None
-    gains = []
-    losses = []
-    for i in range(1, period+1):
-        delta = values[-i] - values[-i-1]
-        if delta > 0:
-            gains.append(delta)
-        else:
-            losses.append(abs(delta))
-    avg_gain = sum(gains)/period if gains else 0.0
-    avg_loss = sum(losses)/period if losses else 0.0
-    if avg_loss == 0:
-        return 100
-    rs = avg_gain/avg_loss
-    return 100 - (100/(1+rs))
-
-def atr(candles, period=14):
-    # candles list with high, low, close
-    if len(candles) < period+1:
-        return None
-    trs = []
-    for i in range(1, len(candles)):
-        high = candles[i]["high"]
-        low = candles[i]["low"]
-        prev_close = candles[i-1]["close"]
-        tr = max(high-low, abs(high-prev_close), abs(low-prev_close))
-        trs.append(tr)
-    # ATR is SMA of TRs last 'period'
-    return sum(trs[-period:]) / period
 
 # -------------------------
 # Market data from Huobi
@@ -283,7 +838,19 @@ def fetch_klines(symbol, period="1day", size=200):
     Returns list of candles dict {timestamp, open, high, low, close, vol}
     period examples: '1min','5min','15min','30min','60min','4hour','1day','1week'
     """
-    if market_client is None:
+    with KLINES_FETCH_SECONDS.time(period=period):
+        candles = _fetch_klines(symbol, period, size)
+    if not candles:
+        KLINES_FETCH_EMPTY.inc(period=period)
+    return candles
+
+def _fetch_klines(symbol, period, size):
+    if candle_store is not None:
+        candles = candle_store.window(symbol, period, size)
+        if candles is not None:
+            return candles
+    init_exchange_clients()
+    if async_client is None and market_client is None:
         # simulation: return synthetic candles (very rough)
         now = int(time.time())
         candles = []
@@ -303,6 +870,20 @@ def fetch_klines(symbol, period="1day", size=200):
             })
             price = close
         return candles
+    kstore = get_kline_store()
+    if kstore is not None and period in PERIOD_SECONDS:
+        return kstore.window(symbol, period, size, PERIOD_SECONDS[period],
+                            lambda n: _fetch_klines_remote(symbol, period, n), now_ts())
+    return _fetch_klines_remote(symbol, period, size)
+
+def _fetch_klines_remote(symbol, period, size):
+    KLINES_DOWNLOADED.inc(size, period=period)
+    if async_client is not None:
+        try:
+            return async_bridge.run(async_client.get_klines(symbol, period, size))
+        except Exception as e:
+            print("Error fetching klines:", e)
+            return []
     try:
         # huobi python SDK MarketClient has get_candlestick(symbol, period, size)
         klines = market_client.get_candlestick(symbol, period, size)
@@ -316,11 +897,248 @@ def fetch_klines(symbol, period="1day", size=200):
                 "close": float(k.close),
                 "vol": float(k.vol)
             })
+        # the REST API answers newest first; everything downstream expects oldest first
+        candles.sort(key=lambda c: c["id"])
         return candles
     except Exception as e:
         print("Error fetching klines:", e)
         return []
 
+def fetch_klines_many(requests):
+    """requests: [(symbol, period, size)] -> candle lists; concurrent with the async client."""
+    init_exchange_clients()
+    if async_client is None:
+        return [fetch_klines(*r) for r in requests]
+    kstore = get_kline_store()
+    if kstore is None or candle_store is not None or not all(r[1] in PERIOD_SECONDS for r in requests):
+        try:
+            return async_bridge.run(async_client.get_klines_many(requests))
+        except Exception as e:
+            print("Error fetching klines:", e)
+            return [[] for _ in requests]
+    # one concurrent round of gap-only fetches; a series that does not join up is refetched in full
+    now = now_ts()
+    plans = [kstore.plan(symbol, period, size, PERIOD_SECONDS[period], now) for symbol, period, size in requests]
+    gaps = [(symbol, period, n) for (symbol, period, _), (_, n) in zip(requests, plans)]
+    for _, period, n in gaps:
+        KLINES_DOWNLOADED.inc(n, period=period)
+    try:
+        fresh = async_bridge.run(async_client.get_klines_many(gaps))
+    except Exception as e:
+        print("Error fetching klines:", e)
+        return [[] for _ in requests]
+    out = []
+    for (symbol, period, size), (stored, n), candles in zip(requests, plans, fresh):
+        window = kstore.merge(symbol, period, size, PERIOD_SECONDS[period], stored, n, candles)
+        if window is None:
+            window = kstore.merge(symbol, period, size, PERIOD_SECONDS[period], [], size,
+                                 _fetch_klines_remote(symbol, period, size))
+        out.append(window)
+    return out
+
+kline_store = None
+_kline_store_lock = threading.Lock()
+
+def get_kline_store():
+    """The on-disk candle store (KLINE_DB_FILE), opened on first use; None when disabled."""
+    global kline_store
+    if not KLINE_DB_FILE:
+        return None
+    if kline_store is None:
+        with _kline_store_lock:
+            if kline_store is None:
+                kline_store = KlineStore(KLINE_DB_FILE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS)
+    return kline_store
+
+# seconds per Huobi kline period, used to know when the last candle closes
+PERIOD_SECONDS = {
+    "1min": 60,
+    "5min": 300,
+    "15min": 900,
+    "30min": 1800,
+    "60min": 3600,
+    "4hour": 14400,
+    "1day": 86400,
+    "1week": 604800,
+}
+
+class MarketDataCache:
+    """
+    Shared kline cache keyed by (symbol, period, size).
+    - an entry lives KLINE_CACHE_TTL_SECONDS, or less if the latest candle closes before that
+    - concurrent callers asking for the same key wait for a single in-flight fetch
+    - empty results (fetch errors) are never cached
+    Returned candle lists are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, fetcher, ttl=KLINE_CACHE_TTL_SECONDS, many_fetcher=None):
+        self.fetcher = fetcher
+        self.many_fetcher = many_fetcher
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> (expires_at, candles)
+        self._inflight = {}  # key -> threading.Event
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _expiry(self, period, candles, now):
+        expires = now + self.ttl
+        period_s = PERIOD_SECONDS.get(period)
+        if period_s and candles:
+            # candle "id" is its open time; once it closes the cached close is stale
+            candle_close = candles[-1]["id"] + period_s
+            if now < candle_close < expires:
+                expires = candle_close
+        return expires
+
+    def get(self, symbol, period="1day", size=200):
+        return self._get((symbol, period, size), waited=False)
+
+    def _get(self, key, waited):
+        symbol, period, size = key
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.time():
+                    if not waited:
+                        self.hits += 1
+                    return entry[1]
+                event = self._inflight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    self.misses += 1
+                    break
+                if not waited:
+                    self.coalesced += 1
+                    waited = True
+            # another caller is already fetching this key: wait and re-check
+            event.wait()
+        try:
+            candles = self.fetcher(symbol, period, size)
+            with self._lock:
+                if candles:
+                    self._entries[key] = (self._expiry(period, candles, time.time()), candles)
+            return candles
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def get_many(self, keys):
+        """Several (symbol, period, size) keys at once; misses are fetched together (concurrently with the async client)."""
+        results = {}
+        to_fetch = []
+        waits = []
+        with self._lock:
+            now = time.time()
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and entry[0] > now:
+                    self.hits += 1
+                    results[key] = entry[1]
+                elif key in self._inflight:
+                    self.coalesced += 1
+                    waits.append(key)
+                else:
+                    self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    to_fetch.append(key)
+        if to_fetch:
+            try:
+                if self.many_fetcher is not None:
+                    fetched = self.many_fetcher(to_fetch)
+                else:
+                    fetched = [self.fetcher(*key) for key in to_fetch]
+                with self._lock:
+                    now = time.time()
+                    for key, candles in zip(to_fetch, fetched):
+                        results[key] = candles
+                        if candles:
+                            self._entries[key] = (self._expiry(key[1], candles, now), candles)
+            finally:
+                with self._lock:
+                    events = [self._inflight.pop(key) for key in to_fetch]
+                for event in events:
+                    event.set()
+        for key in waits:
+            results[key] = self._get(key, waited=True)
+        return [results[key] for key in keys]
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == symbol]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_ratio": ((self.hits + self.coalesced) / lookups) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+kline_cache = MarketDataCache(fetch_klines, many_fetcher=fetch_klines_many)
+
+def get_klines(symbol, period="1day", size=200):
+    """Cached fetch_klines: use this from strategy code and endpoints."""
+    return kline_cache.get(symbol, period, size)
+
+def fetch_tickers():
+    """{symbol: last close} of every symbol on the exchange, in one request (GET /market/tickers)."""
+    init_exchange_clients()
+    try:
+        if async_client is not None:
+            return async_bridge.run(async_client.get_tickers())
+        if market_client is not None:
+            return {t.symbol: float(t.close) for t in market_client.get_market_tickers()}
+    except Exception as e:
+        print("Error fetching tickers:", e)
+    return {}
+
+_tickers = (float("-inf"), {})  # (monotonic fetch time, {symbol: close})
+_tickers_lock = threading.Lock()
+
+def get_prices(symbols):
+    """
+    {symbol: price} from one whole-market ticker snapshot, shared for
+    KLINE_CACHE_TTL_SECONDS; symbols it lacks (simulation mode) fall back to the
+    close of the cached daily candles.
+    """
+    global _tickers
+    with _tickers_lock:
+        fetched_at, tickers = _tickers
+        if time.monotonic() - fetched_at > KLINE_CACHE_TTL_SECONDS:
+            tickers = fetch_tickers()
+            _tickers = (time.monotonic(), tickers)
+    prices = {}
+    for symbol in symbols:
+        if symbol in tickers:
+            prices[symbol] = tickers[symbol]
+            continue
+        candles = get_klines(symbol, "1day", 200)
+        if candles:
+            prices[symbol] = candles[-1]["close"]
+    return prices
+
+CallbackMetric("kline_cache_lookups_total", "kline cache lookups by result",
+               lambda: {(k,): v for k, v in kline_cache.stats().items() if k in ("hits", "misses", "coalesced")},
+               type="counter", labelnames=["result"])
+CallbackMetric("kline_cache_hit_ratio", "kline cache (hits + coalesced) / lookups", lambda: kline_cache.stats()["hit_ratio"])
+CallbackMetric("user_cache_lookups_total", "user response cache lookups by result",
+               lambda: {(k,): v for k, v in user_cache.stats().items() if k in ("hits", "misses")},
+               type="counter", labelnames=["result"])
+CallbackMetric("order_outbox_rows", "order_outbox rows by status (pending, claimed, done, failed, unsettled)",
+               lambda: {(k,): v for k, v in outbox_counts().items()}, labelnames=["status"])
+CallbackMetric("user_cache_hit_ratio", "user response cache hits / lookups", lambda: user_cache.stats()["hit_ratio"])
+
 # -------------------------
 # Huobi order helper (real execution)
 # -------------------------
@@ -328,6 +1146,7 @@ def get_huobi_account_id():
     global huobi_account_id_cache
     if huobi_account_id_cache:
         return huobi_account_id_cache
+    init_exchange_clients()
     if account_client is None:
         return None
     try:
@@ -340,294 +1159,1363 @@ def get_huobi_account_id():
         print("Error getting huobi account id:", e)
         return None
 
-def place_market_order_huobi(symbol, side, amount):
+def place_market_order_huobi(symbol, side, amount, client_order_id=None):
     """
     place market order on Huobi.
     amount here is quantity in base currency for market orders for some SDKs could be in quote.
     You must adapt amount/params to your integration / account type.
+    client_order_id makes a resend idempotent: Huobi rejects an id it has already seen,
+    and the order an earlier attempt placed under it is reported instead ("duplicate").
+    The response carries the fill (filled_qty, avg_price) once Huobi reports the
+    order finished; without it the fill is not known yet.
     """
+    with ORDER_SECONDS.time(side=side.lower()):
+        resp = _place_market_order_huobi(symbol, side, amount, client_order_id)
+    ORDERS.inc(side=side.lower(), status=resp.get("status"))
+    return resp
+
+def _huobi_order_response(order_id, get_order, order=None, **extra):
+    """An "ok" response for order_id, with its fill if the order (read with get_order(order_id) if not given) is final."""
+    resp = dict({"status": "ok", "order_id": order_id}, **extra)
+    try:
+        if order is None:
+            order = get_order(order_id)
+    except Exception as e:
+        print("Error reading huobi order", order_id, e)
+        return resp
+    fill = order_fill(order) if order_fill is not None else None
+    if fill is not None:
+        resp["filled_qty"], resp["avg_price"] = fill
+    return resp
+
+def _async_get_order(order_id):
+    return async_bridge.run(async_client.get_order(order_id))
+
+# the SDK raises HuobiApiException("[Executing] <err-code>: <err-msg>") for an error response
+_SDK_ERR_CODE = re.compile(r"^\[Executing\]\s*([^:\s]+):")
+
+def _sdk_err_code(e):
+    m = _SDK_ERR_CODE.match(getattr(e, "error_message", None) or str(e))
+    return m.group(1) if m else None
+
+def _sdk_order(order):
+    """The SDK's Order object as the REST dict order_fill() reads."""
+    return {"id": order.id, "state": order.state, "filled-amount": order.filled_amount,
+            "filled-cash-amount": order.filled_cash_amount}
+
+def _sdk_get_order(order_id):
+    return _sdk_order(trade_client.get_order(order_id))
+
+def _place_market_order_huobi(symbol, side, amount, client_order_id=None):
+    init_exchange_clients()
+    if async_client is not None and async_client.api_key:
+        try:
+            order_id = async_bridge.run(async_client.place_market_order(symbol, side, amount, client_order_id=client_order_id))
+        except Exception as e:
+            # a duplicate, or a timeout after Huobi took the order: either way it is known under client_order_id
+            order = None
+            if client_order_id:
+                try:
+                    order = async_bridge.run(async_client.get_order_by_client_id(client_order_id))
+                except Exception as lookup_error:
+                    print("Error looking up huobi order", client_order_id, lookup_error)
+            if order is None:
+                print("Error placing huobi order:", e)
+                return {"status": "error", "message": str(e), "err_code": getattr(e, "err_code", None)}
+            return _huobi_order_response(str(order["id"]), _async_get_order, order, client_order_id=client_order_id, duplicate=True)
+        return _huobi_order_response(order_id, _async_get_order)
     if trade_client is None:
         return {"status": "simulated", "message": "Huobi client not configured", "symbol": symbol, "side": side, "amount": amount}
     try:
         account_id = get_huobi_account_id()
         # Many Huobi SDKs accept create_order with order_type=OrderType.BUY_MARKET or SELL_MARKET and amount as string
-        if side.lower() == "buy":
-            order_id = trade_client.create_order(symbol=symbol, account_id=account_id, order_type=OrderType.BUY_MARKET, source="api", amount=str(amount))
-        else:
-            order_id = trade_client.create_order(symbol=symbol, account_id=account_id, order_type=OrderType.SELL_MARKET, source="api", amount=str(amount))
-        return {"status": "ok", "order_id": order_id}
+        order_type = OrderType.BUY_MARKET if side.lower() == "buy" else OrderType.SELL_MARKET
+        order_id = trade_client.create_order(symbol=symbol, account_id=account_id, order_type=order_type, source="api",
+                                             amount=str(amount), client_order_id=client_order_id)
     except Exception as e:
+        err_code = _sdk_err_code(e)
+        if client_order_id and err_code == DUPLICATE_CLIENT_ORDER_ID:
+            # placed by an earlier attempt that we never heard back from
+            try:
+                order = _sdk_order(trade_client.get_order_by_client_order_id(client_order_id))
+            except Exception as lookup_error:
+                print("Error looking up huobi order", client_order_id, lookup_error)
+                return {"status": "ok", "order_id": None, "client_order_id": client_order_id, "duplicate": True}
+            return _huobi_order_response(str(order["id"]), _sdk_get_order, order, client_order_id=client_order_id, duplicate=True)
         print("Error placing huobi order:", e)
-        return {"status": "error", "message": str(e)}
+        return {"status": "error", "message": str(e), "err_code": err_code}
+    return _huobi_order_response(order_id, _sdk_get_order)
+
+class HuobiExchange(Exchange):
+    """backends.Exchange over place_market_order_huobi (async client, SDK or simulation)."""
+
+    def place_market_order(self, symbol, side, qty, client_order_id=None):
+        return place_market_order_huobi(symbol, side, qty, client_order_id)
+
+exchange = HuobiExchange()
+
+class OutboxBatch:
+    """The orders of one cycle when they go through the outbox: already stored, only counted here."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.intents = []
+
+    def __len__(self):
+        return len(self.intents)
+
+    def extend(self, intents):
+        with self._lock:
+            self.intents.extend(intents)
+
+def new_order_batch():
+    if ORDER_OUTBOX:
+        return OutboxBatch()
+    return OrderBatch(max_slice_qty=ORDER_MAX_SLICE_QTY or None) if ORDER_NETTING else None
+
+def execute_order_batch(batch):
+    """
+    Send the netted orders of a batch and write each user's allocated share into
+    the history rows that recorded their orders. Returns the number of exchange orders sent.
+    """
+    if not batch:
+        return 0
+    if isinstance(batch, OutboxBatch):
+        # written to order_outbox with the users' changes; the executor sends them
+        if order_executor is not None:
+            order_executor.notify()
+        return 0
+    intents = list(batch.intents)
+    sent = batch.execute(exchange.place_market_order)
+    store.update_history_info([(json.dumps(it.result), it.history_id) for it in intents])
+    user_cache.invalidate_many(it.user_id for it in intents)
+    return sent
 
 # -------------------------
-# Strategy Core
+# Order outbox executor (runs in the scheduler leader)
 # -------------------------
-def evaluate_user_strategy(user_id, symbol="btcusdt"):
+class RateLimiter:
+    """Token bucket shared by the executor threads: `rate` orders per second, bursts of `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def outbox_counts():
+    return {status: n for status, n in db_execute("SELECT status, COUNT(*) FROM order_outbox GROUP BY status", fetch=True, helper="outbox_counts")}
+
+class OrderExecutor:
     """
-    Main strategy evaluator for a single user.
-    - fetch candles weekly and daily
-    - check conditions
-    - place buys according to pyramid if conditions ok
-    - check partial sells based on profit thresholds
-    - trailing stop checks
-    - stop-time (60 days) check: if position older than STOP_TIME_DAYS and no +5% -> sell 50%
-    - stop-global handled separately within run loop (via max_equity)
+    Sends the orders written to order_outbox. Pending rows are claimed per symbol
+    (per row without ORDER_NETTING) under a new claim id; a claim is netted with
+    OrderBatch and its k-th exchange order gets client order id "<claim id>-<k>".
+    A claim with a failed exchange order is retried as a whole, with backoff: the
+    orders of it that did go through are resent under the same ids and rejected
+    as duplicates instead of placed twice. Claims interrupted by a crash are
+    picked up the same way. A claim with an exchange order whose fill is not known
+    yet (not final when read back) is retried the same way, so the duplicate lookup
+    reads it again. Once a claim is done, or out of attempts, each user's
+    share is written into the history row of their order, and what did not go as
+    the strategy booked it (the whole qty at the history row's price) is
+    reconciled in the same transaction: see _reconcile. A claim whose fill is
+    still unknown after its last attempt is left as booked, with status
+    "unsettled", for an operator to check against the exchange.
     """
-    user = get_user(user_id)
-    if not user:
-        return {"status": "error", "message": "user not found"}
-
-    # fetch weekly candles for MACD/RSI weekly
-    weekly = fetch_klines(symbol, period="1week", size=100)
-    daily = fetch_klines(symbol, period="1day", size=200)
-
-    # compute indicators
-    closes_week = [c["close"] for c in weekly]
-    closes_daily = [c["close"] for c in daily]
-
-    # MM200/50 using daily
-    mm200 = sma(closes_daily, 200) if len(closes_daily) >= 200 else sma(closes_daily, 50)  # fallback
-    mm50 = sma(closes_daily, 50) if len(closes_daily) >= 50 else sma(closes_daily, 10)
-    macd_val, macd_signal = macd_line(closes_week) if len(closes_week) >= 35 else (None, None)
-    rsi_week = rsi(closes_week, period=14) if len(closes_week) >= 15 else None
-
-    # latest price
-    price = closes_daily[-1] if closes_daily else (weekly[-1]["close"] if weekly else None)
-    if price is None:
-        return {"status": "error", "message": "no price data"}
-
-    # compute ATR for volatility (daily)
-    atr_val = atr(daily, period=14) if len(daily) >= 15 else None
-
-    # conditions
-    cond_price_above_mm200 = (mm200 is not None and price > mm200)
-    cond_mm50_gt_mm200 = (mm50 is not None and mm200 is not None and mm50 > mm200)
-    cond_macd_pos = (macd_val is not None and macd_val > 0)
-    cond_rsi_week = (rsi_week is not None and 50 <= rsi_week <= 70)
-
-    can_buy = all([cond_price_above_mm200, cond_mm50_gt_mm200, cond_macd_pos, cond_rsi_week])
-
-    actions = []
-
-    # update equity and max_equity for stop global
-    positions = get_positions(user_id)
-    equity = user["cash"]  # cash is free usd for new buys
-    for p in positions:
-        equity += p["qty"] * price
-    if equity > user["max_equity"]:
-        # update max equity
-        update_user_balance_and_lot(user_id, user["balance"], user["cash"], next_lot=user["next_lot"], max_equity=equity)
-        user = get_user(user_id)  # refresh
-    # STOP GLOBAL
-    if user["max_equity"] and equity < user["max_equity"] * (1 - STOP_GLOBAL_PCT):
-        # liquidate all positions
-        for p in positions:
-            # sell all via huobi (or simulate)
-            sell_qty = p["qty"]
-            huobi_resp = place_market_order_huobi(p["symbol"], "sell", sell_qty)
-            user = get_user(user_id)
-            user_cash = user["cash"] + sell_qty * price
-            update_user_balance_and_lot(user_id, user["balance"], user_cash, next_lot=PIRAMIDE_START, max_equity=user["max_equity"])
-            save_history(user_id, "stop_global_sell", p["symbol"], sell_qty, price, str(huobi_resp))
-            delete_position(p["id"])
-            actions.append("stop_global_liquidated")
-        return {"status": "stop_global", "actions": actions}
-
-    # BUY logic: if conditions met, try to buy next_lot USD (pirâmide)
-    if can_buy:
-        # fetch current user next_lot and cash
-        next_lot = user["next_lot"]
-        cash = user["cash"]
-        # But adapt lot if RSI>75 reduce or RSI<40 increase
-        adj_lot = next_lot
-        if rsi_week is not None:
-            if rsi_week > 75:
-                adj_lot = next_lot * 0.7
-            elif rsi_week < 40:
-                adj_lot = next_lot * 1.2
-        # also adapt by volatility: if ATR high relative to price, increase trailing and possibly reduce lot size
-        if atr_val:
-            atr_ratio = atr_val / price
-            if atr_ratio > 0.03:  # arbitrary threshold
-                # high volatility => reduce lot by 20%
-                adj_lot = adj_lot * 0.8
-
-        adj_lot = round(adj_lot, 2)
-        if cash >= adj_lot and adj_lot >= 1:  # minimum 1 USD guard
-            qty = adj_lot / price
-            # place market buy in huobi with amount = qty or cost param depending on API (we use qty)
-            huobi_resp = place_market_order_huobi(symbol, "buy", qty)
-            # save position
-            trailing_stop = price * TRAILING_STOP_FACTOR
-            add_position(user_id, symbol, qty, price, trailing_stop)
-            # deduct cash
-            new_cash = cash - adj_lot
-            # update next_lot
-            new_next = round(next_pyramid_lot(next_lot), 2)
-            update_user_balance_and_lot(user_id, user["balance"], new_cash, next_lot=new_next)
-            save_history(user_id, "buy", symbol, qty, price, str(huobi_resp))
-            actions.append(f"buy:{adj_lot}")
-        else:
-            actions.append("not_enough_cash_or_lot_too_small")
-
-    # SELL logic: iterate positions and check profit thresholds and trailing stops
-    positions = get_positions(user_id)
-    for p in positions:
-        buy_price = p["avg_price"]
-        qty = p["qty"]
-        profit_pct = (price - buy_price) / buy_price * 100
-        sell_pct = sell_portion(profit_pct)
-        if sell_pct > 0:
-            sell_qty = qty * sell_pct
-            huobi_resp = place_market_order_huobi(p["symbol"], "sell", sell_qty)
-            # credit cash
-            user = get_user(user_id)
-            new_cash = user["cash"] + sell_qty * price
-            # update DB position qty and trailing stop
-            new_qty = qty - sell_qty
-            # if sold entire portion, trailing_stop reset handled in update
-            update_position_qty_and_stop(p["id"], new_qty, p["trailing_stop"])
-            update_user_balance_and_lot(user_id, user["balance"], new_cash)
-            save_history(user_id, "partial_sell", p["symbol"], sell_qty, price, str(huobi_resp))
-            actions.append(f"partial_sell:{sell_qty}")
 
-        else:
-            # trailing stop update
-            user = get_user(user_id)
-            new_stop = p["trailing_stop"]
-            if price > buy_price:
-                candidate_stop = price * TRAILING_STOP_FACTOR
-                if candidate_stop > new_stop:
-                    new_stop = candidate_stop
-            # if price below stop => sell all
-            if price < new_stop:
-                huobi_resp = place_market_order_huobi(p["symbol"], "sell", qty)
-                user = get_user(user_id)
-                new_cash = user["cash"] + qty * price
-                update_user_balance_and_lot(user_id, user["balance"], new_cash)
-                save_history(user_id, "trailing_stop_sell", p["symbol"], qty, price, str(huobi_resp))
-                delete_position(p["id"])
-                actions.append("trailing_stop_executed")
+    CLAIM_HOLD_SECONDS = 60  # a running claim is not due again before this
+
+    def __init__(self, workers=ORDER_EXECUTOR_WORKERS, rate=HUOBI_ORDER_RATE, poll=ORDER_OUTBOX_POLL_SECONDS,
+                 max_attempts=ORDER_MAX_ATTEMPTS, retry_seconds=ORDER_RETRY_SECONDS, is_active=None):
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.is_active = is_active  # () -> bool; the executor idles while False
+        self.limiter = RateLimiter(rate)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="order-executor")
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._running = set()  # claim ids being executed by this process
+        self.stats = {"claims": 0, "orders_sent": 0, "retries": 0, "failed_claims": 0, "unsettled_claims": 0, "errors": 0}
+
+    def notify(self):
+        self._wake.set()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def run_forever(self):
+        while True:
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            if self.is_active is not None and not self.is_active():
+                continue
+            try:
+                self.dispatch()
+            except Exception as e:
+                self._count("errors")
+                print("Error dispatching order outbox:", e)
+
+    def claim_pending(self):
+        """Give every pending row a claim id; returns the number of new claims."""
+        now = now_ts()
+        with db_transaction("OrderExecutor.claim_pending") as conn:
+            claims = {}
+            for oid, symbol in conn.execute("SELECT id, symbol FROM order_outbox WHERE status='pending' ORDER BY id"):
+                claims.setdefault(symbol if ORDER_NETTING else oid, []).append(oid)
+            for ids in claims.values():
+                claim_id = uuid.uuid4().hex[:24]
+                conn.executemany("UPDATE order_outbox SET status='claimed', claim_id=?, updated_at=? WHERE id=?",
+                                 [(claim_id, now, oid) for oid in ids])
+        return len(claims)
+
+    def dispatch(self):
+        """Claim the pending rows and start every due claim on the pool; returns their futures."""
+        self.claim_pending()
+        due = db_execute("SELECT DISTINCT claim_id FROM order_outbox WHERE status='claimed' AND next_attempt_at<=?",
+                         (now_ts(),), fetch=True, helper="OrderExecutor.dispatch")
+        futures = []
+        for (claim_id,) in due:
+            with self._lock:
+                if claim_id in self._running:
+                    continue
+                self._running.add(claim_id)
+            futures.append(self.pool.submit(self._run_claim, claim_id))
+        return futures
+
+    def drain(self):
+        """Dispatch until nothing is due (tests, benchmarks, shutdown)."""
+        while True:
+            futures = self.dispatch()
+            if not futures:
+                return
+            wait(futures)
+
+    def _run_claim(self, claim_id):
+        try:
+            self.execute_claim(claim_id)
+        except Exception as e:
+            self._count("errors")
+            print("Error executing order claim", claim_id, e)
+        finally:
+            with self._lock:
+                self._running.discard(claim_id)
+
+    def execute_claim(self, claim_id):
+        now = now_ts()
+        with db_transaction("OrderExecutor.execute_claim") as conn:
+            rows = conn.execute("""SELECT o.id, o.history_id, o.user_id, o.symbol, o.side, o.qty, o.attempts, o.position, h.price
+                                   FROM order_outbox o LEFT JOIN history h ON h.id=o.history_id
+                                   WHERE o.claim_id=? AND o.status='claimed' AND o.next_attempt_at<=? ORDER BY o.id""",
+                                (claim_id, now)).fetchall()
+            if not rows:
+                return
+            # keep other schedulers (a leader handover) off this claim while it runs
+            conn.execute("UPDATE order_outbox SET next_attempt_at=? WHERE claim_id=?", (now + self.CLAIM_HOLD_SECONDS, claim_id))
+        attempts = rows[0][6] + 1
+
+        intents = []
+        for _, history_id, user_id, symbol, side, qty, _, _, _ in rows:
+            it = OrderIntent(user_id, symbol, side, qty)
+            it.history_id = history_id
+            intents.append(it)
+        batch = OrderBatch(max_slice_qty=ORDER_MAX_SLICE_QTY or None)
+        batch.extend(intents)
+        seq = itertools.count()
+
+        def place(symbol, side, qty):
+            # same rows, same netting, same ids on every attempt
+            self.limiter.acquire()
+            return exchange.place_market_order(symbol, side, qty, client_order_id=f"{claim_id}-{next(seq)}")
+
+        self._count("orders_sent", batch.execute(place))
+        self._count("claims")
+        failed = any(it.result["status"] == "error" for it in intents)
+        unsettled = any(q is None for it in intents for q, _ in it.result["fills"])
+        for it in intents:
+            it.result["attempts"] = attempts
+
+        now = now_ts()
+        reindex = []
+        with db_transaction("OrderExecutor.execute_claim") as conn:
+            if (failed or unsettled) and attempts < self.max_attempts:
+                retry_at = now + int(math.ceil(self.retry_seconds * 2 ** (attempts - 1)))
+                conn.execute("UPDATE order_outbox SET attempts=?, next_attempt_at=?, updated_at=? WHERE claim_id=?",
+                             (attempts, retry_at, now, claim_id))
+                conn.executemany("UPDATE history SET info=? WHERE id=?",
+                                 [(json.dumps(dict(it.result, status="retrying")), it.history_id) for it in intents])
+                self._count("retries")
+            elif unsettled:
+                # what the exchange filled is unknown: nothing to reconcile against
+                conn.execute("UPDATE order_outbox SET status='unsettled', attempts=?, updated_at=? WHERE claim_id=?",
+                             (attempts, now, claim_id))
+                conn.executemany("UPDATE history SET info=? WHERE id=?",
+                                 [(json.dumps(dict(it.result, status="unsettled")), it.history_id) for it in intents])
+                self._count("unsettled_claims")
+                print(f"Order claim {claim_id} unsettled after {attempts} attempts: orders {intents[0].result['order_ids']}")
+            else:
+                conn.execute("UPDATE order_outbox SET status=?, attempts=?, updated_at=? WHERE claim_id=?",
+                             ("failed" if failed else "done", attempts, now, claim_id))
+                for it, row in zip(intents, rows):
+                    moved = self._reconcile(conn, it, row[8], json.loads(row[7]) if row[7] else None, now)
+                    if moved is not None:
+                        reindex.append(moved)
+                conn.executemany("UPDATE history SET info=? WHERE id=?",
+                                 [(json.dumps(it.result), it.history_id) for it in intents])
+                if failed:
+                    self._count("failed_claims")
+                    print(f"Order claim {claim_id} failed after {attempts} attempts: {intents[0].result.get('errors')}")
+        for pid, user_id, symbol, avg_price, stop in reindex:
+            if avg_price is None:
+                stop_book.remove(pid)
             else:
-                # update trailing stop if increased
-                update_position_qty_and_stop(p["id"], qty, new_stop)
-
-        # stop time: if position older than STOP_TIME_DAYS and never reached +5% then sell 50%
-        entry_time = datetime.fromisoformat(p["entry_time"])
-        age_days = (datetime.utcnow() - entry_time).days
-        if age_days >= STOP_TIME_DAYS:
-            # check if max profit achieved since entry - for simplicity use current profit_pct
-            if profit_pct < 5:
-                sell_qty = p["qty"] * 0.5
-                huobi_resp = place_market_order_huobi(p["symbol"], "sell", sell_qty)
-                user = get_user(user_id)
-                new_cash = user["cash"] + sell_qty * price
-                update_user_balance_and_lot(user_id, user["balance"], new_cash)
-                update_position_qty_and_stop(p["id"], p["qty"]-sell_qty, p["trailing_stop"])
-                save_history(user_id, "time_stop_partial_sell", p["symbol"], sell_qty, price, str(huobi_resp))
-                actions.append("time_stop_partial")
-
-    # monthly deposit: if last_deposit more than 30 days ago, add monthly deposit to cash
-    last_dep = user["last_deposit"]
-    if last_dep:
-        last_dt = datetime.fromisoformat(last_dep)
-        if datetime.utcnow() - last_dt >= timedelta(days=30):
-            # add deposit
-            user = get_user(user_id)
-            new_cash = user["cash"] + MONTHLY_DEPOSIT
-            update_user_balance_and_lot(user_id, user["balance"], new_cash)
-            db_execute("UPDATE users SET last_deposit=? WHERE user_id=?", (datetime.utcnow().isoformat(), user_id))
-            save_history(user_id, "monthly_deposit", symbol, 0, 0, f"deposit {MONTHLY_DEPOSIT}")
-            actions.append("monthly_deposit")
-
-    return {"status": "ok", "actions": actions, "equity": equity, "cash": get_user(user_id)["cash"]}
+                stop_book.upsert(pid, user_id, symbol, avg_price, stop)
+        user_cache.invalidate_many(it.user_id for it in intents)
+
+    def _reconcile(self, conn, it, price, position, now):
+        """
+        Book a finished intent's actual fill (internal share plus its share of each
+        exchange order's fill, unknown prices taken as `price`) where the strategy
+        booked it.qty at `price`: the history row gets the filled qty and average
+        price, cash moves by the difference, the unfilled qty of a buy is taken
+        off its position and that of a sell goes back into it (reopened if it was
+        closed). A failed exchange order filled nothing, so this reverses it.
+        Returns the stop book entry (pos_id, user_id, symbol, avg_price, stop) to
+        apply, avg_price None to drop it, or None.
+        """
+        if price is None:
+            return None
+        fills = it.result.get("fills") or []
+        filled = it.result["internal_qty"] + sum(q for q, _ in fills)
+        cost = it.result["internal_qty"] * price + sum(q * (p if p is not None else price) for q, p in fills)
+        booked = it.qty * price
+        if math.isclose(filled, it.qty, rel_tol=1e-9) and math.isclose(cost, booked, rel_tol=1e-9):
+            return None
+        fill_price = cost / filled if filled > 0 else price
+        it.result.update(filled_qty=filled, fill_price=fill_price, booked_qty=it.qty, booked_price=price)
+        conn.execute("UPDATE history SET qty=?, price=? WHERE id=?", (filled, fill_price, it.history_id))
+        buy = it.side == "buy"
+        conn.execute("UPDATE users SET cash=cash+? WHERE user_id=?", (booked - cost if buy else cost - booked, it.user_id))
+        if position is None:
+            return None
+        unfilled = it.qty - filled
+        pid = position["id"]
+        row = conn.execute("SELECT qty, trailing_stop FROM positions WHERE id=?", (pid,)).fetchone()
+        if buy:
+            if row is None:
+                return None  # already sold in full: nothing left to correct
+            qty = row[0] - unfilled
+            if qty <= 1e-12:
+                conn.execute("DELETE FROM positions WHERE id=?", (pid,))
+                return pid, it.user_id, it.symbol, None, None
+            conn.execute("UPDATE positions SET qty=?, avg_price=? WHERE id=?", (qty, fill_price, pid))
+            return pid, it.user_id, it.symbol, fill_price, row[1]
+        if unfilled <= 1e-12:
+            return None
+        if row is not None:
+            conn.execute("UPDATE positions SET qty=qty+? WHERE id=?", (unfilled, pid))
+            return None
+        cur = conn.execute("INSERT INTO positions (user_id, symbol, qty, avg_price, entry_time, trailing_stop, last_profit_check_price, last_checked) VALUES (?,?,?,?,?,?,?,?)",
+                           (it.user_id, it.symbol, unfilled, position["avg_price"], position["entry_time"], position["trailing_stop"],
+                            position["last_profit_check_price"], now))
+        return cur.lastrowid, it.user_id, it.symbol, position["avg_price"], position["trailing_stop"]
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, running=len(self._running))
 
+order_executor = None  # this process's executor, once start_order_executor() ran
+_order_executor_lock = threading.Lock()
+
+def start_order_executor():
+    """Start the outbox executor thread once; it only sends while this process leads the scheduler."""
+    global order_executor
+    if not ORDER_OUTBOX:
+        return None
+    with _order_executor_lock:
+        if order_executor is None:
+            order_executor = OrderExecutor(is_active=lambda: scheduler is not None and scheduler.leader)
+            threading.Thread(target=order_executor.run_forever, name="order-outbox", daemon=True).start()
+    return order_executor
 
 # -------------------------
-# Background loop (runs strategy for every user periodically)
+# History upkeep: PnL rollups and the cold archive
 # -------------------------
-def strategy_loop():
+cold_archive = ColdArchive(HISTORY_ARCHIVE_DIR)
+
+def _get_state(conn, name):
+    row = conn.execute("SELECT value FROM maintenance_state WHERE name=?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def _set_state(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO maintenance_state (name, value) VALUES (?,?)", (name, value))
+
+def rollup_history(batch=HISTORY_BATCH_SIZE):
+    """
+    Fold the history rows added since the last run into pnl_daily and pnl_totals,
+    `batch` rows per transaction (rows, rollups and cursor move together, so a
+    row is never counted twice). Rows stop at the first order still in the
+    outbox, whose actual fill is yet to be written in. Returns the number of rows folded.
+    """
+    total = 0
+    cols = ", ".join(ROLLUP_COLUMNS)
+    marks = ",".join("?" * len(ROLLUP_COLUMNS))
+    added = ", ".join(f"{c}={c}+excluded.{c}" for c in ROLLUP_COLUMNS)
     while True:
+        with db_transaction("rollup_history") as conn:
+            cursor = _get_state(conn, "rollup_history_id")
+            in_flight = conn.execute("SELECT MIN(history_id) FROM order_outbox WHERE status IN ('pending', 'claimed')").fetchone()[0]
+            rows = conn.execute(f"SELECT {', '.join(HISTORY_FIELDS)} FROM history WHERE id>? AND id<? ORDER BY id LIMIT ?",
+                                (cursor, in_flight or 2 ** 62, batch)).fetchall()
+            if not rows:
+                return total
+            keys = {(r[1], r[3]) for r in rows}
+            users = sorted({uid for uid, _ in keys})
+            basis = {}
+            for i in range(0, len(users), 500):
+                ids = users[i:i + 500]
+                for uid, symbol, qty, cost in conn.execute(
+                        f"SELECT user_id, symbol, qty, cost FROM pnl_cost_basis WHERE user_id IN ({','.join('?' * len(ids))})", ids):
+                    basis[(uid, symbol)] = [qty, cost]
+            days = rollup_rows(rows, basis)
+            conn.executemany(f"INSERT INTO pnl_daily (user_id, day, {cols}) VALUES (?,?,{marks}) "
+                             f"ON CONFLICT(user_id, day) DO UPDATE SET {added}",
+                             [(uid, day) + tuple(v[c] for c in ROLLUP_COLUMNS) for (uid, day), v in days.items()])
+            conn.executemany(f"INSERT INTO pnl_totals (user_id, {cols}, first_day, last_day) VALUES (?,{marks},?,?) "
+                             f"ON CONFLICT(user_id) DO UPDATE SET {added}, "
+                             "first_day=MIN(COALESCE(first_day, excluded.first_day), excluded.first_day), "
+                             "last_day=MAX(COALESCE(last_day, excluded.last_day), excluded.last_day)",
+                             [(uid,) + tuple(v[c] for c in ROLLUP_COLUMNS) + (day, day) for (uid, day), v in days.items()])
+            conn.executemany("INSERT OR REPLACE INTO pnl_cost_basis (user_id, symbol, qty, cost) VALUES (?,?,?,?)",
+                             [(uid, symbol, basis[(uid, symbol)][0], basis[(uid, symbol)][1])
+                              for uid, symbol in keys if (uid, symbol) in basis])
+            _set_state(conn, "rollup_history_id", rows[-1][0])
+        total += len(rows)
+        if len(rows) < batch:
+            return total
+
+def archive_history(hot_days=HISTORY_HOT_DAYS, batch=HISTORY_BATCH_SIZE):
+    """
+    Move history rows older than `hot_days` to the cold archive, oldest first.
+    Only rows already rolled up, and whose order is no longer in flight in the
+    outbox (its result is still to be written into the row), are moved. Rows are
+    written (and fsync'ed) to their month file before they are deleted here.
+    Returns the number of rows moved.
+    """
+    if hot_days <= 0:
+        return 0
+    horizon = now_ts() - hot_days * 86400
+    moved = 0
+    while True:
+        rolled_up = db_execute("SELECT value FROM maintenance_state WHERE name='rollup_history_id'", fetch=True, helper="archive_history")
+        rows = db_execute(f"SELECT {', '.join(HISTORY_FIELDS)} FROM history WHERE id<=? ORDER BY id LIMIT ?",
+                          (rolled_up[0][0] if rolled_up else 0, batch), fetch=True, helper="archive_history")
+        in_flight = {r[0] for r in db_execute("SELECT history_id FROM order_outbox WHERE status IN ('pending', 'claimed')",
+                                              fetch=True, helper="archive_history")}
+        # ids grow with time: the scan stops at the first row inside the horizon
+        old = list(itertools.takewhile(lambda r: r[7] < horizon, rows))
+        done = len(old) < len(rows) or len(rows) < batch
+        old = [dict(zip(HISTORY_FIELDS, r)) for r in old if r[0] not in in_flight]
+        if not old:
+            return moved
+        counts = cold_archive.append(old)
+        with db_transaction("archive_history") as conn:
+            conn.executemany("DELETE FROM history WHERE id=?", [(r["id"],) for r in old])
+            for partition in counts:
+                ids = [r["id"] for r in old if partition_of(r["timestamp"]) == partition]
+                conn.execute("""INSERT INTO history_partitions (partition, rows, min_id, max_id, updated_at) VALUES (?,?,?,?,?)
+                                ON CONFLICT(partition) DO UPDATE SET rows=rows+excluded.rows, min_id=MIN(min_id, excluded.min_id),
+                                max_id=MAX(max_id, excluded.max_id), updated_at=excluded.updated_at""",
+                             (partition, len(ids), min(ids), max(ids), now_ts()))
+        user_cache.invalidate_many({r["user_id"] for r in old})
+        moved += len(old)
+        if done:
+            return moved
+
+class HistoryMaintenance:
+    """Rollup then archival, every `interval` seconds, while is_active() (the scheduler leader)."""
+
+    def __init__(self, interval=HISTORY_MAINTENANCE_SECONDS, is_active=None):
+        self.interval = interval
+        self.is_active = is_active
+        self._lock = threading.Lock()
+        self.stats = {"runs": 0, "rows_rolled_up": 0, "rows_archived": 0, "errors": 0, "last_run": None}
+
+    def run_once(self):
+        rolled = rollup_history()
+        archived = archive_history()
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["rows_rolled_up"] += rolled
+            self.stats["rows_archived"] += archived
+            self.stats["last_run"] = now_ts()
+        return rolled, archived
+
+    def run_forever(self):
+        while True:
+            time.sleep(self.interval)
+            if self.is_active is not None and not self.is_active():
+                continue
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self.stats["errors"] += 1
+                print("Error in history maintenance:", e)
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats)
+
+history_maintenance = None  # started by the scheduler leader
+_history_maintenance_lock = threading.Lock()
+
+def start_history_maintenance():
+    global history_maintenance
+    with _history_maintenance_lock:
+        if history_maintenance is None:
+            history_maintenance = HistoryMaintenance(is_active=lambda: scheduler is not None and scheduler.leader)
+            threading.Thread(target=history_maintenance.run_forever, name="history-maintenance", daemon=True).start()
+    return history_maintenance
+
+def pnl_report(user_id, since_day=None, until_day=None):
+    """The user's all-time totals and daily rollups for [since_day, until_day) ("YYYY-MM-DD"); None if never rolled up."""
+    row = db_execute(f"SELECT {', '.join(ROLLUP_COLUMNS)}, first_day, last_day FROM pnl_totals WHERE user_id=?",
+                     (user_id,), fetch=True, helper="pnl_report")
+    if not row:
+        return None
+    totals = dict(zip(ROLLUP_COLUMNS + ("first_day", "last_day"), row[0]))
+    query = f"SELECT day, {', '.join(ROLLUP_COLUMNS)} FROM pnl_daily WHERE user_id=?"
+    params = [user_id]
+    if since_day:
+        query += " AND day>=?"
+        params.append(since_day)
+    if until_day:
+        query += " AND day<?"
+        params.append(until_day)
+    days = [dict(zip(("day",) + ROLLUP_COLUMNS, r)) for r in db_execute(query + " ORDER BY day", params, fetch=True, helper="pnl_report")]
+    return {"totals": totals, "days": days}
+
+# -------------------------
+# Strategy Core (strategy.py) wired to the app's backends
+# -------------------------
+# per-symbol streaming indicator state, shared by the loop and /run_strategy
+_indicator_engines = {}
+_indicator_engines_lock = threading.Lock()
+
+def _get_indicator_engine(symbol):
+    with _indicator_engines_lock:
+        engine = _indicator_engines.get(symbol)
+        if engine is None:
+            engine = SymbolIndicators()
+            _indicator_engines[symbol] = engine
+        return engine
+
+def compute_signal_snapshots(symbols):
+    """
+    Indicator stage, run once per symbol per tick:
+    - fetch candles weekly and daily
+    - update MM50/MM200 (daily), MACD/RSI (weekly), ATR (daily) incrementally
+    - evaluate the buy conditions
+    Returns {symbol: SignalSnapshot, or None when there is no price data}.
+    """
+    symbols = list(symbols)
+    # weekly candles for MACD/RSI weekly, and daily, of every symbol in one batch (one round trip with the async client)
+    candles = kline_cache.get_many([(s, period, size) for s in symbols for period, size in (("1week", 100), ("1day", 200))])
+    now = now_ts()
+    return {s: build_signal_snapshot(s, candles[2 * i], candles[2 * i + 1], _get_indicator_engine(s), now)
+            for i, s in enumerate(symbols)}
+
+def compute_signal_snapshot(symbol):
+    return compute_signal_snapshots([symbol])[symbol]
+
+class HuobiMarketData(MarketData):
+    def snapshot(self, symbol):
+        return compute_signal_snapshot(symbol)
+
+    def prices(self, symbols):
+        return get_prices(symbols)
+
+strategy_env = StrategyEnv(clock, store, exchange, HuobiMarketData(), stop_book)
+
+def evaluate_user_strategy(user_id, symbol=None, snapshot=None, orders=None, snapshots=None, prices=None):
+    """
+    strategy.evaluate_user_strategy against the live backends (SQLite, Huobi, wall clock).
+    Two evaluations of one user (scheduler workers, /run_strategy in any process,
+    /deposit) are not locked against each other: the one committing second is
+    refused (StaleUser) and evaluated again on the fresh row, up to
+    USER_COMMIT_ATTEMPTS times before StaleUser propagates. Orders only leave
+    once their evaluation committed: queued in `orders`, or without a batch sent
+    right after the commit.
+    """
+    # an empty batch is falsy: only ever test it against None
+    batch = orders
+    if batch is None:
+        batch = new_order_batch()
+        if batch is None:
+            batch = OrderBatch()
+    for attempt in range(USER_COMMIT_ATTEMPTS):
+        try:
+            with USER_EVAL_SECONDS.time():
+                res = strategy.evaluate_user_strategy(strategy_env, user_id, symbol, snapshot=snapshot, orders=batch,
+                                                      snapshots=snapshots, prices=prices)
+            break
+        except StaleUser:
+            USER_COMMIT_CONFLICTS.inc()
+            if attempt == USER_COMMIT_ATTEMPTS - 1:
+                raise
+    if orders is None:
+        execute_order_batch(batch)
+    return res
+
+
+# -------------------------
+# Background loop (runs strategy for every user periodically)
+# -------------------------
+
+class SchedulerLease:
+    """
+    Leader election on a lock row (scheduler_lease): only the process holding the
+    unexpired lease evaluates users, however many schedulers are running. The
+    holder renews it every tick; if it dies, another one takes over after `ttl` seconds.
+    """
+
+    def __init__(self, name="strategy", ttl=SCHEDULER_LEASE_SECONDS, owner=None):
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self):
+        """Take or renew the lease; True if this process is the leader until now + ttl."""
+        now = now_ts()
+        with db_transaction("SchedulerLease.acquire") as conn:
+            row = conn.execute("SELECT owner, expires_at FROM scheduler_lease WHERE name=?", (self.name,)).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO scheduler_lease (name, owner, expires_at) VALUES (?,?,?)",
+                         (self.name, self.owner, now + self.ttl))
+        return True
+
+    def release(self):
+        db_execute("UPDATE scheduler_lease SET expires_at=0 WHERE name=? AND owner=?", (self.name, self.owner), helper="SchedulerLease.release")
+
+    def holder(self):
+        rows = db_execute("SELECT owner, expires_at FROM scheduler_lease WHERE name=?", (self.name,), fetch=True, helper="SchedulerLease.holder")
+        if not rows or rows[0][1] <= now_ts():
+            return None
+        return {"owner": rows[0][0], "expires_at": ts_to_iso(rows[0][1])}
+
+class StrategyScheduler:
+    """
+    Runs one cycle every `interval` seconds: a signal snapshot is computed once
+    per symbol traded by any user, and positions held outside every universe
+    are priced from one ticker lookup; then users are evaluated on a bounded
+    thread pool against those shared snapshots and prices, so a cycle costs
+    O(symbols + users), not O(symbols x users). A user written
+    meanwhile (e.g. by /run_strategy) is evaluated again on the fresh row, and
+    left to the next tick if that keeps happening. Orders of
+    the cycle are netted per symbol and sent once every user is evaluated. A cycle
+    that runs past the next tick makes the scheduler skip the missed ticks
+    instead of queueing them, and is counted as an overrun.
+    With WAKE_SCHEDULING, only the users whose wake plan the tick's prices, buy
+    signals or clock satisfy are evaluated (see strategy.wake_plan); plans are
+    rebuilt for the users written to since the last tick (users.updated_at, set
+    by triggers, so writes from other processes count) and for those evaluated.
+    The stop book and the set of symbols to snapshot and price are kept in sync
+    the same way: only the users written since the last tick are re-read, all of
+    them on the first tick and after leadership is gained.
+    With a `lease`, ticks only run while this process holds it (the others stand
+    by); `on_leader` is called every time leadership is gained.
+    request_profile() runs the next cycle under the sampling profiler and writes
+    its folded stacks to PROFILE_DIR.
+    """
+
+    def __init__(self, interval=CHECK_INTERVAL_SECONDS, workers=STRATEGY_WORKERS, lease=None, on_leader=None):
+        self.interval = interval
+        self.workers = workers
+        self.lease = lease
+        self.on_leader = on_leader
+        self.leader = lease is None
+        self.last_snapshots = {}
+        self.last_prices = {}
+        self.wake_index = WakeIndex() if WAKE_SCHEDULING else None
+        self.symbol_index = SymbolIndex()
+        self._scanned_at = None  # last scan for written users; None: reload everything next tick
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="strategy")
+        self._profile_next = False
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "cycles": 0,
+            "overruns": 0,
+            "skipped_ticks": 0,
+            "standby_ticks": 0,
+            "last_cycle_started": None,
+            "last_cycle_duration": None,
+            "last_cycle_lag": None,
+            "last_cycle_users": 0,
+            "users_evaluated": 0,
+            "users_conflicted": 0,
+            "users_idle": 0,
+            "stop_triggers": 0,
+            "order_intents": 0,
+            "orders_sent": 0,
+            "errors": 0,
+            "last_profile": None,
+        }
+        CYCLE_INTERVAL.set(interval)
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _evaluate(self, uid, snapshots, prices, orders=None):
+        try:
+            res = evaluate_user_strategy(uid, snapshots=snapshots, prices=prices, orders=orders)
+            self._count("users_evaluated")
+            if res and res.get("actions"):
+                print(f"[{datetime.utcnow().isoformat()}] user {uid} actions: {res['actions']}")
+        except StaleUser:
+            # written by others on every attempt; the next tick picks it up
+            self._count("users_conflicted")
+        except Exception as e:
+            self._count("errors")
+            print("Error evaluating strategy for", uid, e)
+
+    def _execute_orders(self, batch):
+        if not batch:
+            return
+        self._count("order_intents", len(batch))
         try:
+            self._count("orders_sent", execute_order_batch(batch))
+        except Exception as e:
+            self._count("errors")
+            print("Error executing order batch:", e)
+
+    # users written this long before the last scan are re-read as well: a
+    # transaction still open in another process during the scan commits later
+    SCAN_SLACK_SECONDS = 30
+
+    def _scan_changes(self):
+        """
+        ({user_id: (user, positions)}, user_ids) for the users written since the
+        last scan, from any process; every user, with user_ids None, on the first
+        scan and after leadership is gained.
+        """
+        scanned_at = now_ts()
+        user_ids = None
+        if self._scanned_at is not None:
+            user_ids = users_updated_since(self._scanned_at - self.SCAN_SLACK_SECONDS)
+        states = load_users_with_positions(user_ids)
+        self._scanned_at = scanned_at
+        return states, user_ids
+
+    def _sync_stop_book(self, states, user_ids):
+        rows = [(p["id"], uid, p["symbol"], p["avg_price"], p["trailing_stop"])
+                for uid, (_, positions) in states.items() for p in positions]
+        if user_ids is None:
+            stop_book.load(rows)
+        else:
+            stop_book.replace_users(user_ids, rows)
+
+    def _sync_symbols(self, states, user_ids):
+        symbols = {uid: (user_symbols(user), {p["symbol"] for p in positions})
+                   for uid, (user, positions) in states.items()}
+        if user_ids is None:
+            self.symbol_index.load(symbols)
+            return
+        for uid, (universe, held) in symbols.items():
+            self.symbol_index.update(uid, universe, held)
+        for uid in set(user_ids) - set(states):
+            self.symbol_index.remove(uid)
+
+    def _replan(self, user_ids=None, states=None):
+        now = now_ts()
+        if states is None:
+            states = load_users_with_positions(user_ids)
+        for uid, (user, positions) in states.items():
+            self.wake_index.update(uid, strategy.wake_plan(user, positions, now))
+        for uid in set(user_ids or ()) - set(states):
+            self.wake_index.remove(uid)
+
+    def _due_users(self, snapshots, prices):
+        buy_symbols = [s for s, snap in snapshots.items() if snap is not None and snap.can_buy]
+        due = self.wake_index.due(now_ts(), prices, buy_symbols)
+        self._count("users_idle", len(self.wake_index) - len(due))
+        return sorted(due)
+
+    def run_cycle(self):
+        # stops ratcheted by the feed since the last cycle are written first, so users see them
+        # (and the re-read below sees them); then what web workers and other processes wrote
+        # since the last scan is re-read into the stop book and the wake plans
+        flush_stop_ratchets()
+        states, changed = self._scan_changes()
+        self._sync_stop_book(states, changed)
+        self._sync_symbols(states, changed)
+        if self.wake_index is not None:
+            self._replan(changed, states)
+        if self.wake_index is None:
             # fetch all users
-            rows = db_execute("SELECT user_id FROM users", fetch=True)
-            user_ids = [r[0] for r in rows]
+            user_ids = store.user_ids()
+            if not user_ids:
+                return 0
+        # indicators depend only on the symbol: compute them once per symbol and share with every user
+        universes, held = self.symbol_index.symbols()
+        if not universes:
+            return 0  # no users
+        snapshots = compute_signal_snapshots(sorted(universes))
+        missing = sorted(s for s, snap in snapshots.items() if snap is None)
+        if len(missing) == len(snapshots):
+            print(f"No price data for {missing}, skipping cycle")
+            return 0
+        if missing:
+            print(f"No price data for {missing}")
+        prices = {s: snap.price for s, snap in snapshots.items() if snap is not None}
+        unpriced = held - set(prices)
+        if unpriced:
+            prices.update(get_prices(sorted(unpriced)))
+        self.last_snapshots, self.last_prices = snapshots, prices
+        if self.wake_index is not None:
+            user_ids = self._due_users(snapshots, prices)
+        batch = new_order_batch()
+        wait([self.pool.submit(self._evaluate, uid, snapshots, prices, batch) for uid in user_ids])
+        self._execute_orders(batch)
+        if self.wake_index is not None and user_ids:
+            # their time wake-ups were consumed, whether or not the evaluation wrote anything
+            self._replan(user_ids)
+        return len(user_ids)
+
+    def run_stop_check(self, symbol, price, user_ids):
+        """
+        Between ticks: evaluate only `user_ids`, the owners of the positions whose
+        stop `price` crossed (from the stop book), using the last snapshots and
+        prices with the live price for `symbol`. Buys are disabled here since the
+        buy signals were computed for the tick prices.
+        """
+        try:
+            snapshots = dict(self.last_snapshots)
+            if snapshots.get(symbol) is None:
+                snapshots[symbol] = compute_signal_snapshot(symbol)
+            if snapshots[symbol] is None:
+                return
+            snapshots = {s: snap._replace(can_buy=False) if snap is not None else None for s, snap in snapshots.items()}
+            snapshots[symbol] = snapshots[symbol]._replace(price=price)
+            prices = dict(self.last_prices, **{symbol: price})
+            flush_stop_ratchets(symbol)
+            self._count("stop_triggers")
+            batch = new_order_batch()
             for uid in user_ids:
-                try:
-                    res = evaluate_user_strategy(uid)
-                    if res and res.get("actions"):
-                        print(f"[{datetime.utcnow().isoformat()}] user {uid} actions: {res['actions']}")
-                except Exception as e:
-                    print("Error evaluating strategy for", uid, e)
+                self._evaluate(uid, snapshots, prices, batch)
+            self._execute_orders(batch)
+        finally:
+            _stop_checks_running.discard(symbol)
+
+    def _check_leader(self):
+        if self.lease is None:
+            return True
+        try:
+            leader = self.lease.acquire()
         except Exception as e:
-            print("Error in strategy loop:", e)
-        time.sleep(CHECK_INTERVAL_SECONDS)
+            print("Error renewing scheduler lease:", e)
+            leader = False
+        if leader and not self.leader:
+            print("Scheduler lease acquired by", self.lease.owner)
+            # whatever was written while standing by is unknown: reload it all on the next tick
+            self._scanned_at = None
+            if self.on_leader is not None:
+                self.on_leader()
+        elif self.leader and not leader:
+            print("Scheduler lease lost by", self.lease.owner)
+        self.leader = leader
+        return leader
+
+    def run_forever(self):
+        next_tick = time.monotonic()
+        while True:
+            if not self._check_leader():
+                self._count("standby_ticks")
+                next_tick += self.interval
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+                continue
+            started = time.monotonic()
+            started_ts = now_ts()
+            lag = started - next_tick  # how late this cycle started
+            profiler = None
+            if self._profile_next:
+                self._profile_next = False
+                profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000.0,
+                                            include_thread=lambda name: name.startswith("strategy") or name == "MainThread")
+                profiler.start()
+            n_users = 0
+            try:
+                n_users = self.run_cycle()
+            except Exception as e:
+                self._count("errors")
+                print("Error in strategy loop:", e)
+            duration = time.monotonic() - started
+            if profiler is not None:
+                profiler.stop()
+                self._save_profile(profiler, started_ts)
+            CYCLE_SECONDS.observe(duration)
+            CYCLE_UTILIZATION.set(duration / self.interval)
+            with self._stats_lock:
+                self.stats["cycles"] += 1
+                self.stats["last_cycle_started"] = started_ts
+                self.stats["last_cycle_duration"] = duration
+                self.stats["last_cycle_lag"] = lag
+                self.stats["last_cycle_users"] = n_users
+
+            next_tick += self.interval
+            now = time.monotonic()
+            if now > next_tick:
+                missed = int((now - next_tick) // self.interval) + 1
+                next_tick += missed * self.interval
+                with self._stats_lock:
+                    self.stats["overruns"] += 1
+                    self.stats["skipped_ticks"] += missed
+                CYCLE_OVERRUNS.inc()
+                print(f"Strategy cycle overran: {duration:.1f}s for {n_users} users "
+                      f"(interval {self.interval}s), skipping {missed} tick(s)")
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    def request_profile(self):
+        self._profile_next = True
+
+    def _save_profile(self, profiler, started_ts):
+        path = os.path.join(PROFILE_DIR, f"strategy-cycle-{started_ts}.folded")
+        try:
+            profiler.write_folded(path)
+        except OSError as e:
+            print("Error writing cycle profile:", e)
+            return
+        with self._stats_lock:
+            self.stats["last_profile"] = path
+        print(f"Cycle profile ({profiler.samples} samples) written to {path}")
+
+    def status(self):
+        with self._stats_lock:
+            stats = dict(self.stats, interval=self.interval, workers=self.workers, leader=self.leader,
+                         profile_pending=self._profile_next)
+        if self.wake_index is not None:
+            stats["wake_index"] = self.wake_index.stats()
+        return stats
+
+scheduler = None  # this process's scheduler, once start_scheduler() ran
+_scheduler_lock = threading.Lock()
+
+def _on_scheduler_leader():
+    # the leader owns the stop index (loaded by its first tick), the market feed, the order outbox and history upkeep
+    start_market_feed()
+    start_order_executor()
+    start_history_maintenance()
+
+def start_scheduler(background=True):
+    """
+    Create this process's (leader-elected) scheduler and run it on a daemon
+    thread, or in the calling thread with background=False. Idempotent.
+    """
+    global scheduler
+    with _scheduler_lock:
+        if scheduler is not None:
+            return scheduler
+        init_db()
+        strategy_env.stop_book = stop_book
+        scheduler = StrategyScheduler(lease=SchedulerLease(), on_leader=_on_scheduler_leader)
+    if background:
+        threading.Thread(target=scheduler.run_forever, name="strategy-loop", daemon=True).start()
+    else:
+        # `kill -USR1 <pid>` profiles the next cycle
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: scheduler.request_profile())
+        try:
+            scheduler.run_forever()
+        finally:
+            scheduler.lease.release()
+    return scheduler
+
+def strategy_loop():
+    start_scheduler(background=False)
+
+# -------------------------
+# Streaming market data (MARKET_FEED=ws)
+# -------------------------
+_stop_checks_running = set()
+
+def on_price_update(symbol, price):
+    # called on the feed's event loop for every trade: O(log n + crossed stops), real work goes to the pool
+    hits = stop_book.on_price(symbol, price)
+    if not hits or symbol in _stop_checks_running or not scheduler.leader:
+        return
+    _stop_checks_running.add(symbol)
+    scheduler.pool.submit(scheduler.run_stop_check, symbol, price, sorted({uid for _, uid in hits}))
 
-# start background thread
-threading.Thread(target=strategy_loop, daemon=True).start()
+def start_market_feed():
+    """Start the WebSocket feed (MARKET_FEED=ws) once, in the scheduler process."""
+    global async_bridge, candle_store, market_feed
+    if MARKET_FEED != "ws" or HuobiMarketFeed is None or market_feed is not None:
+        return
+    init_exchange_clients()
+    if async_bridge is None:
+        async_bridge = AsyncBridge()
+    # REST client used to backfill the buffers after every (re)connect
+    feed_rest_client = async_client or HuobiAsyncClient(HUOBI_REST_URL, rate=HUOBI_MARKET_RATE, timeout=HUOBI_TIMEOUT_SECONDS)
+    candle_store = CandleStore(capacity=500)
+    market_feed = HuobiMarketFeed(candle_store, FEED_SYMBOLS, periods=("1day", "1week"), url=HUOBI_WS_URL,
+                                  backfill=feed_rest_client.get_klines, backfill_size=200)
+    market_feed.add_price_listener(on_price_update)
+    async_bridge.loop.call_soon_threadsafe(async_bridge.loop.create_task, market_feed.run())
+    print("Market data feed:", HUOBI_WS_URL, FEED_SYMBOLS)
 
 # -------------------------
 # Flask endpoints for Bubble
 # -------------------------
-@app.route("/register_user", methods=["POST"])
+# responses keep ISO timestamps even though the DB stores epochs
+def user_to_json(u):
+    out = dict(u, last_deposit=ts_to_iso(u["last_deposit"]), symbols=list(user_symbols(u)))
+    out.pop("version", None)
+    return out
+
+def position_to_json(p):
+    return dict(p, entry_time=ts_to_iso(p["entry_time"]))
+
+@api.route("/register_user", methods=["POST"])
 def http_register_user():
     payload = request.json or {}
     user_id = payload.get("user_id")
     email = payload.get("email")
     balance = float(payload.get("balance", DEFAULT_INITIAL_BALANCE))
+    symbols = parse_symbols(payload.get("symbols"))  # list or "a,b"; none = DEFAULT_SYMBOLS
     if not user_id:
         return jsonify({"status": "error", "message": "user_id required"}), 400
-    u = create_user_db(user_id, email=email, initial_balance=balance)
-    return jsonify({"status": "ok", "user": u})
+    u = create_user_db(user_id, email=email, initial_balance=balance, symbols=",".join(symbols) or None)
+    return jsonify({"status": "ok", "user": user_to_json(u)})
 
-@app.route("/balance", methods=["GET"])
-def http_balance():
-    user_id = request.args.get("user_id")
+@api.route("/register_users", methods=["POST"])
+def http_register_users():
+    """
+    Bulk register / import: {"users": [{"user_id", "email", "balance", "symbols"}, ...]}
+    (up to REGISTER_BATCH_MAX), all inserted in one transaction. Users that already
+    exist are left as they are and listed in "existing". Any invalid entry rejects
+    the whole request.
+    """
+    payload = request.json or {}
+    entries = payload.get("users")
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"status": "error", "message": "users (a non-empty list) required"}), 400
+    if len(entries) > REGISTER_BATCH_MAX:
+        return jsonify({"status": "error", "message": f"at most {REGISTER_BATCH_MAX} users per request"}), 400
+    users, errors, seen = [], [], set()
+    for i, entry in enumerate(entries):
+        user_id = entry.get("user_id") if isinstance(entry, dict) else None
+        if not user_id:
+            errors.append({"index": i, "message": "user_id required"})
+            continue
+        if user_id in seen:
+            errors.append({"index": i, "message": f"duplicate user_id {user_id}"})
+            continue
+        seen.add(user_id)
+        try:
+            balance = float(entry.get("balance", DEFAULT_INITIAL_BALANCE))
+        except (TypeError, ValueError):
+            errors.append({"index": i, "message": "balance must be a number"})
+            continue
+        symbols = parse_symbols(entry.get("symbols"))
+        users.append({"user_id": user_id, "email": entry.get("email"), "balance": balance,
+                      "symbols": ",".join(symbols) or None})
+    if errors:
+        return jsonify({"status": "error", "message": "invalid users", "errors": errors}), 400
+    existing = create_users_db(users)
+    return jsonify({"status": "ok", "created": len(users) - len(existing),
+                    "existing": [u["user_id"] for u in users if u["user_id"] in existing]})
+
+@api.route("/set_symbols", methods=["POST"])
+def http_set_symbols():
+    # open positions in symbols dropped from the universe are still managed (sells and stops), never bought
+    payload = request.json or {}
+    user_id = payload.get("user_id")
     if not user_id:
         return jsonify({"status": "error", "message": "user_id required"}), 400
-    u = get_user(user_id)
-    if not u:
+    symbols = parse_symbols(payload.get("symbols"))
+    if not set_user_symbols(user_id, ",".join(symbols) or None):
         return jsonify({"status": "error", "message": "user not found"}), 404
-    positions = get_positions(user_id)
-    history = get_history(user_id)[:20]
-    return jsonify({"status": "ok", "user": u, "positions": positions, "history": history})
+    return jsonify({"status": "ok", "symbols": list(symbols or strategy.DEFAULT_SYMBOLS)})
 
-@app.route("/run_strategy", methods=["POST"])
+def cached_json_response(user_id, key, build):
+    """
+    JSON response for `key` of a user, served from user_cache when possible, with
+    an ETag (hash of the body). If-None-Match on a cached body answers 304 without
+    touching the database. build() returns the payload, or None for a 404.
+    """
+    entry, gen = user_cache.get(user_id, key)
+    if entry is None:
+        payload = build()
+        if payload is None:
+            return jsonify({"status": "error", "message": "user not found"}), 404
+        body = jsonify(payload).get_data()
+        entry = (hashlib.sha1(body).hexdigest(), body)
+        user_cache.put(user_id, key, entry, gen)
+    etag, body = entry
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    return resp
+
+def balances_many(user_ids):
+    """/balance payloads of many users from a constant number of set-based queries, and the ids not found."""
+    states = load_users_with_positions(user_ids)
+    history = get_latest_history_many(list(states), limit=20)
+    users = {uid: {"user": user_to_json(u), "positions": [position_to_json(p) for p in positions], "history": history[uid]}
+             for uid, (u, positions) in states.items()}
+    return users, [uid for uid in user_ids if uid not in states]
+
+@api.route("/balance", methods=["GET", "POST"])
+def http_balance():
+    """
+    One user: GET ?user_id= (cached, with an ETag). Many users: GET ?user_ids=a,b,c
+    or POST {"user_ids": [...]} (up to BALANCE_BATCH_MAX) answers {"users": {id: balance}, "missing": [...]}.
+    """
+    payload = (request.get_json(silent=True) or {}) if request.method == "POST" else {}
+    user_ids = payload.get("user_ids") or [u for u in request.args.get("user_ids", "").split(",") if u]
+    if user_ids:
+        if not isinstance(user_ids, list) or not all(isinstance(u, str) for u in user_ids):
+            return jsonify({"status": "error", "message": "user_ids must be a list of ids"}), 400
+        user_ids = list(dict.fromkeys(user_ids))
+        if len(user_ids) > BALANCE_BATCH_MAX:
+            return jsonify({"status": "error", "message": f"at most {BALANCE_BATCH_MAX} user_ids per request"}), 400
+        users, missing = balances_many(user_ids)
+        return jsonify({"status": "ok", "users": users, "missing": missing})
+
+    user_id = request.args.get("user_id") or payload.get("user_id")
+    if not user_id:
+        return jsonify({"status": "error", "message": "user_id or user_ids required"}), 400
+
+    def build():
+        u = get_user(user_id)
+        if not u:
+            return None
+        positions = get_positions(user_id)
+        history = get_history(user_id, limit=20)
+        return {"status": "ok", "user": user_to_json(u), "positions": [position_to_json(p) for p in positions], "history": history}
+    return cached_json_response(user_id, "balance", build)
+
+@api.route("/run_strategy", methods=["POST"])
 def http_run_strategy():
     payload = request.json or {}
     user_id = payload.get("user_id")
-    symbol = payload.get("symbol", "btcusdt")
+    symbol = payload.get("symbol")  # default: every symbol of the user's universe
     if not user_id:
         return jsonify({"status": "error", "message": "user_id required"}), 400
-    res = evaluate_user_strategy(user_id, symbol)
+    # with the outbox the orders are only recorded here; the scheduler leader sends them
+    try:
+        res = evaluate_user_strategy(user_id, symbol)
+    except StaleUser:
+        return jsonify({"status": "error", "message": "user busy (written concurrently), nothing applied; retry"}), 409
     return jsonify(res)
 
-@app.route("/history", methods=["GET"])
+def _parse_time_arg(value):
+    # epoch seconds or ISO 8601 (UTC unless it has an offset)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+def _int_arg(name, default=None):
+    # strict, unlike request.args.get(type=int), which falls back to the default on garbage
+    value = request.args.get(name)
+    return int(value) if value not in (None, "") else default
+
+@api.route("/history", methods=["GET"])
 def http_history():
+    """
+    Keyset-paginated history: ?user_id=&cursor=<last id>&limit=&action=&symbol=&since=&until=
+    Returns next_cursor (null on the last page). With format=jsonl (or
+    Accept: application/x-ndjson) every matching row is streamed as JSON lines instead.
+    """
     user_id = request.args.get("user_id")
     if not user_id:
         return jsonify({"status": "error", "message": "user_id required"}), 400
-    return jsonify({"status": "ok", "history": get_history(user_id)})
+    try:
+        cursor = _int_arg("cursor")
+        limit = _int_arg("limit", HISTORY_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"status": "error", "message": "cursor and limit must be integers"}), 400
+    try:
+        filters = {
+            "action": request.args.get("action"),
+            "symbol": request.args.get("symbol"),
+            "since": _parse_time_arg(request.args.get("since")),
+            "until": _parse_time_arg(request.args.get("until")),
+        }
+    except ValueError:
+        return jsonify({"status": "error", "message": "since/until must be epoch seconds or ISO dates"}), 400
+    if limit <= 0:
+        return jsonify({"status": "error", "message": "limit must be a positive integer"}), 400
+    if cursor is not None and cursor <= 0:
+        return jsonify({"status": "error", "message": "cursor must be a positive integer"}), 400
+
+    if request.args.get("format") == "jsonl" or request.accept_mimetypes.best == "application/x-ndjson":
+        def stream(before_id):
+            while True:
+                page = get_history(user_id, limit=HISTORY_MAX_PAGE_SIZE, before_id=before_id, **filters)
+                for row in page:
+                    yield json.dumps(row) + "\n"
+                if len(page) < HISTORY_MAX_PAGE_SIZE:
+                    return
+                before_id = page[-1]["id"]
+        return Response(stream_with_context(stream(cursor)), mimetype="application/x-ndjson")
+
+    limit = min(limit, HISTORY_MAX_PAGE_SIZE)
+
+    def build():
+        page = get_history(user_id, limit=limit, before_id=cursor, **filters)
+        next_cursor = page[-1]["id"] if len(page) == limit else None
+        return {"status": "ok", "history": page, "next_cursor": next_cursor}
+    key = ("history", cursor, limit) + tuple(filters.values())
+    return cached_json_response(user_id, key, build)
+
+@api.route("/scheduler_status", methods=["GET"])
+def http_scheduler_status():
+    # the leader is usually another process: report the lease, plus this process's scheduler if it runs one
+    return jsonify({"status": "ok", "leader": SchedulerLease().holder(),
+                    "scheduler": scheduler.status() if scheduler is not None else None,
+                    "order_outbox": outbox_counts() if ORDER_OUTBOX else None,
+                    "order_executor": order_executor.status() if order_executor is not None else None,
+                    "history_maintenance": history_maintenance.status() if history_maintenance is not None else None})
+
+@api.route("/pnl_report", methods=["GET"])
+def http_pnl_report():
+    """
+    ?user_id=&since=&until= (YYYY-MM-DD, until exclusive): realized PnL, deposits and
+    trade counts from the rollups, all-time and per day, without reading history.
+    Covers history up to the last rollup (rolled_up_to_id).
+    """
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"status": "error", "message": "user_id required"}), 400
+    since, until = request.args.get("since"), request.args.get("until")
+    try:
+        for value in (since, until):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"status": "error", "message": "since/until must be YYYY-MM-DD"}), 400
+    if not get_user(user_id):
+        return jsonify({"status": "error", "message": "user not found"}), 404
+    report = pnl_report(user_id, since, until) or {"totals": None, "days": []}
+    rolled_up = db_execute("SELECT value FROM maintenance_state WHERE name='rollup_history_id'", fetch=True, helper="http_pnl_report")
+    return jsonify(dict(report, status="ok", user_id=user_id, rolled_up_to_id=rolled_up[0][0] if rolled_up else 0))
+
+@api.route("/history_archive", methods=["GET"])
+def http_history_archive():
+    """?user_id=&month=YYYY-MM: the user's archived history rows of that month; without month, the archived months."""
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"status": "error", "message": "user_id required"}), 400
+    month = request.args.get("month")
+    if not month:
+        return jsonify({"status": "ok", "months": cold_archive.partitions()})
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        return jsonify({"status": "error", "message": "month must be YYYY-MM"}), 400
+    rows = [{"id": r["id"], "action": r["action"], "symbol": r["symbol"], "qty": r["qty"], "price": r["price"],
+             "info": r["info"], "time": ts_to_iso(r["timestamp"])} for r in reversed(cold_archive.read(month, user_id))]
+    return jsonify({"status": "ok", "month": month, "history": rows})
+
+@api.route("/market_data_stats", methods=["GET"])
+def http_market_data_stats():
+    feed = None
+    if market_feed is not None:
+        feed = {"connected": market_feed.connected, "reconnects": market_feed.reconnects, "messages": market_feed.messages}
+    return jsonify({"status": "ok", "kline_cache": kline_cache.stats(), "market_feed": feed,
+                    "kline_store": kline_store.stats() if kline_store is not None else None})
+
+@api.route("/user_cache_stats", methods=["GET"])
+def http_user_cache_stats():
+    return jsonify({"status": "ok", "user_cache": user_cache.stats()})
+
+@api.route("/metrics", methods=["GET"])
+def http_metrics():
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+@api.route("/profile_cycle", methods=["POST"])
+def http_profile_cycle():
+    # only reaches a scheduler running in this process; the worker process takes SIGUSR1
+    if scheduler is None:
+        return jsonify({"status": "error", "message": "no scheduler in this process (send SIGUSR1 to the worker)"}), 409
+    scheduler.request_profile()
+    return jsonify({"status": "ok", "profile_dir": PROFILE_DIR, "last_profile": scheduler.status()["last_profile"]})
 
 # quick endpoint to force deposit (for testing)
-@app.route("/deposit", methods=["POST"])
+@api.route("/deposit", methods=["POST"])
 def http_deposit():
     payload = request.json or {}
     user_id = payload.get("user_id")
     amount = float(payload.get("amount", 0))
     if not user_id or amount <= 0:
         return jsonify({"status": "error", "message": "user_id and positive amount required"}), 400
-    user = get_user(user_id)
-    if not user:
-        return jsonify({"status": "error", "message": "user not found"}), 404
-    update_user_balance_and_lot(user_id, user["balance"], user["cash"] + amount)
-    save_history(user_id, "manual_deposit", "", 0, 0, f"deposit {amount}")
-    return jsonify({"status": "ok", "new_cash": get_user(user_id)["cash"]})
+    for attempt in range(USER_COMMIT_ATTEMPTS):
+        uow = UserUnitOfWork(strategy_env, user_id)
+        if not uow.user:
+            return jsonify({"status": "error", "message": "user not found"}), 404
+        uow.add_cash(amount)
+        uow.add_history("manual_deposit", "", 0, 0, f"deposit {amount}")
+        try:
+            uow.flush()
+        except StaleUser:
+            # written meanwhile (an evaluation, another deposit): add to the fresh cash instead
+            continue
+        return jsonify({"status": "ok", "new_cash": uow.user["cash"]})
+    return jsonify({"status": "error", "message": "user busy, deposit not applied; retry"}), 409
 
 # -------------------------
-# Run
+# App factory / run
 # -------------------------
+def create_app():
+    """
+    WSGI entry point (gunicorn "app:create_app()"). Applies pending migrations;
+    exchange clients are built on first use and the scheduler only starts here
+    with EMBEDDED_SCHEDULER=1.
+    """
+    init_db()
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(api)
+    if EMBEDDED_SCHEDULER:
+        start_scheduler()
+    return flask_app
+
 if __name__ == "__main__":
-    print("Starting Flask app with Strategy PRO. Huobi configured:", bool(trade_client))
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
+    if sys.argv[1:] == ["scheduler"]:
+        # the single scheduler process (Procfile "worker")
+        print("Starting strategy scheduler")
+        if METRICS_PORT:
+            metrics.start_http_server(METRICS_PORT)
+            print("Metrics on port", METRICS_PORT)
+        strategy_loop()
+    else:
+        # development: web server and scheduler in one process
+        flask_app = create_app()
+        start_scheduler()
+        print("Starting Flask app with Strategy PRO")
+        flask_app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
@@ -0,0 +1,223 @@
+# backends.py
+# What the strategy core (strategy.py) needs from the outside world, as small
+# interfaces: Clock, Store, Exchange and MarketData. app.py plugs in the
+# SQLite / Huobi implementations; the in-memory ones below let simulations,
+# load tests and backtests run the same core without disk I/O or network.
+
+import threading
+import time
+
+
+# -------------------------
+# Clock
+# -------------------------
+class Clock:
+    def now(self):
+        """Epoch seconds (int)."""
+        raise NotImplementedError
+
+
+class SystemClock(Clock):
+    def now(self):
+        return int(time.time())
+
+
+class ManualClock(Clock):
+    """Simulated time: only moves when set() / advance() are called."""
+
+    def __init__(self, start=0):
+        self.ts = int(start)
+
+    def now(self):
+        return self.ts
+
+    def set(self, ts):
+        self.ts = int(ts)
+
+    def advance(self, seconds):
+        self.ts += int(seconds)
+
+
+# -------------------------
+# Store
+# -------------------------
+class StaleUser(Exception):
+    """Store.commit refused: the user (or their positions) changed since they were loaded."""
+
+
+class Store:
+    """
+    Users, positions and history. Users and positions are plain dicts (see
+    app.get_user / app.get_positions for the fields); timestamps are epoch seconds.
+    A user's "version" goes up with every write to the user or their positions.
+    """
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def get_positions(self, user_id):
+        raise NotImplementedError
+
+    def create_user(self, user_id, email, initial_balance, next_lot, now, symbols=None):
+        """Insert a user unless it exists; returns the user. symbols: "a,b" universe, None for the defaults."""
+        raise NotImplementedError
+
+    def user_ids(self):
+        raise NotImplementedError
+
+    def all_positions(self):
+        """[(pos_id, user_id, symbol, avg_price, trailing_stop)] of every open position."""
+        raise NotImplementedError
+
+    def commit(self, user_id, user=None, deleted=(), updated=(), new=(), history=(), order_history=(), orders=(),
+               now=None, version=None):
+        """
+        Apply one user's changes atomically: `user` (row to write, or None),
+        `deleted` position ids, `updated` and `new` position dicts (new ones get
+        their "id" set), `history` rows and `order_history` rows
+        (user_id, action, symbol, qty, price, info, timestamp). `orders` are the
+        (symbol, side, qty, position) behind each order_history row, for stores that
+        keep an order outbox in the same transaction; position is the dict of the
+        position the order opened or reduced (or None), as committed. `version` is the user's version the
+        changes were computed from: if the user has been written since, nothing
+        is applied and StaleUser is raised (None: no check). Returns the ids of
+        the order_history rows, in order, and the user's new version.
+        """
+        raise NotImplementedError
+
+    def update_history_info(self, rows):
+        """rows: [(info, history_id)]"""
+        raise NotImplementedError
+
+    def raise_stops(self, changes):
+        """changes: [(stop, pos_id)]; a stop is only ever raised, never lowered."""
+        raise NotImplementedError
+
+
+class MemoryStore(Store):
+    """Dict-backed Store for simulations and tests. Returns copies, like a database would."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.users = {}
+        self.positions = {}  # pos_id -> dict (with "user_id")
+        self.history = []    # dicts with id, user_id, action, symbol, qty, price, info, timestamp
+        self._next_pos_id = 1
+
+    def get_user(self, user_id):
+        with self._lock:
+            u = self.users.get(user_id)
+            return dict(u) if u else None
+
+    def get_positions(self, user_id):
+        with self._lock:
+            return [{k: v for k, v in p.items() if k != "user_id"}
+                    for p in self.positions.values() if p["user_id"] == user_id]
+
+    def create_user(self, user_id, email, initial_balance, next_lot, now, symbols=None):
+        with self._lock:
+            if user_id not in self.users:
+                self.users[user_id] = {"user_id": user_id, "email": email, "balance": initial_balance,
+                                       "cash": initial_balance, "next_lot": next_lot,
+                                       "max_equity": initial_balance, "last_deposit": now, "symbols": symbols,
+                                       "version": 0}
+            return dict(self.users[user_id])
+
+    def user_ids(self):
+        with self._lock:
+            return list(self.users)
+
+    def all_positions(self):
+        with self._lock:
+            return [(pid, p["user_id"], p["symbol"], p["avg_price"], p["trailing_stop"])
+                    for pid, p in self.positions.items()]
+
+    def _add_history(self, row):
+        user_id, action, symbol, qty, price, info, ts = row
+        hid = len(self.history) + 1
+        self.history.append({"id": hid, "user_id": user_id, "action": action, "symbol": symbol, "qty": qty,
+                             "price": price, "info": info, "timestamp": ts})
+        return hid
+
+    def commit(self, user_id, user=None, deleted=(), updated=(), new=(), history=(), order_history=(), orders=(),
+               now=None, version=None):
+        with self._lock:
+            current = self.users[user_id]["version"]
+            if version is not None and version != current:
+                raise StaleUser(user_id)
+            if user is not None or deleted or updated or new:
+                current += 1
+            self.users[user_id] = dict(user if user is not None else self.users[user_id], version=current)
+            for pid in deleted:
+                self.positions.pop(pid, None)
+            for p in updated:
+                self.positions[p["id"]] = dict(p, user_id=user_id)
+            for p in new:
+                p["id"] = self._next_pos_id
+                self._next_pos_id += 1
+                self.positions[p["id"]] = dict(p, user_id=user_id)
+            for row in history:
+                self._add_history(row)
+            return [self._add_history(row) for row in order_history], current
+
+    def update_history_info(self, rows):
+        with self._lock:
+            for info, hid in rows:
+                self.history[hid - 1]["info"] = info
+
+    def raise_stops(self, changes):
+        with self._lock:
+            for stop, pid in changes:
+                p = self.positions.get(pid)
+                if p is not None and p["trailing_stop"] < stop:
+                    p["trailing_stop"] = stop
+                    self.users[p["user_id"]]["version"] += 1
+
+
+# -------------------------
+# Exchange
+# -------------------------
+class Exchange:
+    def place_market_order(self, symbol, side, qty, client_order_id=None):
+        """
+        Returns a response dict with "status" ("ok", "simulated" or "error") and "order_id" when placed.
+        Resending a client_order_id must not place a second order.
+        """
+        raise NotImplementedError
+
+
+class SimulatedExchange(Exchange):
+    """Fills nothing, records every order (the strategy prices fills at the snapshot price)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.orders = []
+        self._client_ids = {}  # client order id -> order id
+
+    def place_market_order(self, symbol, side, qty, client_order_id=None):
+        with self._lock:
+            if client_order_id is not None and client_order_id in self._client_ids:
+                return {"status": "simulated", "order_id": self._client_ids[client_order_id], "duplicate": True}
+            self.orders.append((symbol, side, qty))
+            n = len(self.orders)
+            if client_order_id is not None:
+                self._client_ids[client_order_id] = n
+        return {"status": "simulated", "order_id": n, "symbol": symbol, "side": side, "amount": qty}
+
+
+# -------------------------
+# Market data
+# -------------------------
+class MarketData:
+    def snapshot(self, symbol):
+        """strategy.SignalSnapshot for the symbol now, or None without price data."""
+        raise NotImplementedError
+
+    def prices(self, symbols):
+        """{symbol: last price} for the symbols that have one. Override with a single batched lookup."""
+        out = {}
+        for symbol in symbols:
+            snap = self.snapshot(symbol)
+            if snap is not None:
+                out[symbol] = snap.price
+        return out
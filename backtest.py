@@ -0,0 +1,289 @@
+# backtest.py
+# Replays historical candles through the real strategy (strategy.evaluate_user_strategy)
+# on simulated time: a ManualClock, a MemoryStore and simulated fills at the
+# candle close (see backends.py); app.py is never imported. Parameter sweeps
+# run on a process pool.
+# Usage:
+#   python backtest.py --data btcusdt_1min.csv [--step 60] [--balance 100]
+#   python backtest.py --synthetic-days 730 --sweep TRAILING_STOP_FACTOR=0.85,0.9 --sweep STOP_GLOBAL_PCT=0.2,0.25
+#
+# CSV/Parquet columns: timestamp (epoch s or ms; "id"/"time" also accepted),
+# open, high, low, close and optionally vol/volume. Rows may be any bar size
+# up to one day; they are aggregated into the daily and weekly candles the
+# strategy reads.
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import strategy
+from backends import ManualClock, MarketData, MemoryStore, SimulatedExchange
+from indicators import SymbolIndicators
+
+try:
+    import pyarrow.parquet as pq
+except Exception:
+    pq = None
+
+# strategy settings a sweep may override (module globals of strategy.py)
+PARAMS = ("PIRAMIDE_START", "PIRAMIDE_MULT", "TRAILING_STOP_FACTOR", "STOP_TIME_DAYS",
+          "STOP_GLOBAL_PCT", "MONTHLY_DEPOSIT")
+
+DAY_SECONDS = 86400
+WEEK_SECONDS = 7 * DAY_SECONDS
+
+
+# -------------------------
+# Candle sources
+# -------------------------
+def _pick(columns, *names):
+    for name in names:
+        if name in columns:
+            return name
+    raise ValueError(f"missing column, expected one of {names}")
+
+
+def _rows_from_columns(cols):
+    ts_col = _pick(cols, "timestamp", "id", "time", "ts")
+    vol_col = next((c for c in ("vol", "volume") if c in cols), None)
+    ts = [float(t) for t in cols[ts_col]]
+    scale = 0.001 if ts and ts[0] > 1e12 else 1  # milliseconds
+    vols = cols[vol_col] if vol_col else [0.0] * len(ts)
+    rows = [(int(t * scale), float(o), float(h), float(l), float(c), float(v))
+            for t, o, h, l, c, v in zip(ts, cols["open"], cols["high"], cols["low"], cols["close"], vols)]
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+
+def load_candles(path):
+    """[(ts, open, high, low, close, vol)] oldest first, from a CSV or Parquet file."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise RuntimeError("reading Parquet needs pyarrow")
+        return _rows_from_columns(pq.read_table(path).to_pydict())
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        cols = {name.strip().lower(): [] for name in reader.fieldnames}
+        for row in reader:
+            for k, v in row.items():
+                cols[k.strip().lower()].append(v)
+    return _rows_from_columns(cols)
+
+
+def synthetic_candles(days, bar_seconds=60, start_ts=1577836800, price=10000.0, seed=1):
+    """Geometric random walk bars, for trying the engine without data."""
+    rng = random.Random(seed)
+    n = int(days * DAY_SECONDS / bar_seconds)
+    vol = 0.6 * math.sqrt(bar_seconds / (365 * 86400))  # ~60% annualized
+    drift = 0.3 * bar_seconds / (365 * 86400)
+    rows = []
+    for i in range(n):
+        openp = price
+        price = price * math.exp(rng.gauss(drift, vol))
+        wiggle = abs(rng.gauss(0, vol)) * price
+        rows.append((start_ts + i * bar_seconds, openp, max(openp, price) + wiggle, min(openp, price) - wiggle,
+                     price, 1.0))
+    return rows
+
+
+class CandleAggregator:
+    """Folds bars into bounded daily/weekly candle windows; the last candle of each stays open."""
+
+    def __init__(self, periods):
+        self.periods = periods  # {period: (seconds, window size)}
+        self.windows = {p: [] for p in periods}
+
+    def add(self, ts, o, h, l, c, v):
+        for period, (seconds, size) in self.periods.items():
+            window = self.windows[period]
+            cid = ts - ts % seconds
+            last = window[-1] if window else None
+            if last is None or last["id"] != cid:
+                window.append({"id": cid, "open": o, "high": h, "low": l, "close": c, "vol": v})
+                if len(window) > size:
+                    del window[0]
+            else:
+                last["high"] = max(last["high"], h)
+                last["low"] = min(last["low"], l)
+                last["close"] = c
+                last["vol"] += v
+
+
+class ReplayMarketData(MarketData):
+    """backends.MarketData over the aggregator's windows, as of the last bar added."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.candles = CandleAggregator({"1day": (DAY_SECONDS, 200), "1week": (WEEK_SECONDS, 100)})
+        self.engine = SymbolIndicators()
+
+    def snapshot(self, symbol):
+        windows = self.candles.windows
+        return strategy.build_signal_snapshot(symbol, windows["1week"], windows["1day"], self.engine, self.clock.now())
+
+
+# -------------------------
+# Engine
+# -------------------------
+def max_drawdown(curve):
+    peak, worst = None, 0.0
+    for _, equity in curve:
+        peak = equity if peak is None or equity > peak else peak
+        if peak > 0:
+            worst = max(worst, (peak - equity) / peak)
+    return worst
+
+
+def run_backtest(candles, symbol="btcusdt", params=None, step=3600, balance=100.0, warmup_days=0):
+    """
+    Drive evaluate_user_strategy over `candles` with one simulated user, evaluating
+    every `step` seconds of simulated time. Returns a report dict with the daily
+    equity curve, max drawdown and runtime per simulated day.
+    """
+    params = dict(params or {})
+    for name, value in params.items():
+        if name not in PARAMS:
+            raise ValueError(f"unknown parameter {name}")
+        setattr(strategy, name, value)
+
+    started = time.perf_counter()
+    clock = ManualClock(candles[0][0] if candles else 0)
+    market = ReplayMarketData(clock)
+    store = MemoryStore()
+    env = strategy.StrategyEnv(clock, store, SimulatedExchange(), market)
+    user_id = "backtest"
+    store.create_user(user_id, None, balance, strategy.PIRAMIDE_START, clock.now())
+    trading_from = (candles[0][0] + warmup_days * DAY_SECONDS) if candles else 0
+
+    curve = []
+    evaluations = 0
+    next_eval = None
+    day = None
+    price = None
+    for bar in candles:
+        ts = bar[0]
+        market.candles.add(*bar)
+        clock.set(ts)
+        price = bar[4]
+        if ts < trading_from:
+            continue
+        if next_eval is not None and ts < next_eval:
+            continue
+        next_eval = ts - ts % step + step
+        res = strategy.evaluate_user_strategy(env, user_id, symbol)
+        if res["status"] == "error":
+            continue
+        evaluations += 1
+        if ts // DAY_SECONDS != day:
+            day = ts // DAY_SECONDS
+            curve.append((ts, _equity(store, user_id, price)))
+    if candles:
+        curve.append((candles[-1][0], _equity(store, user_id, price)))
+
+    counts = {}
+    for row in store.history:
+        counts[row["action"]] = counts.get(row["action"], 0) + 1
+    runtime = time.perf_counter() - started
+    days = max(1e-9, (candles[-1][0] - candles[0][0]) / DAY_SECONDS) if candles else 0
+    deposits = counts.get("monthly_deposit", 0) * strategy.MONTHLY_DEPOSIT
+    final = curve[-1][1] if curve else balance
+    return {
+        "params": params,
+        "days": round(days, 2),
+        "evaluations": evaluations,
+        "initial_balance": balance,
+        "deposits": deposits,
+        "final_equity": final,
+        "pnl": final - balance - deposits,
+        "max_drawdown": max_drawdown(curve),
+        "actions": counts,
+        "runtime_s": runtime,
+        "runtime_per_day_ms": runtime / days * 1000 if days else None,
+        "equity_curve": curve,
+    }
+
+
+def _equity(store, user_id, price):
+    user = store.get_user(user_id)
+    return user["cash"] + sum(p["qty"] * price for p in store.get_positions(user_id))
+
+
+# -------------------------
+# Sweeps (process pool)
+# -------------------------
+_worker_candles = None
+
+
+def _init_worker(source):
+    global _worker_candles
+    _worker_candles = _load_source(source)
+
+
+def _run_in_worker(job):
+    params, kwargs = job
+    return run_backtest(_worker_candles, params=params, **kwargs)
+
+
+def _load_source(source):
+    kind, value = source
+    return load_candles(value) if kind == "file" else synthetic_candles(value)
+
+
+def sweep_grid(spec):
+    """{"NAME": [v1, v2], ...} -> list of param dicts (cartesian product)."""
+    names = list(spec)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(spec[n] for n in names))]
+
+
+def run_sweep(source, grid, workers=None, **kwargs):
+    """Every param dict of `grid` on a process pool; each worker loads the candles once."""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(source,)) as pool:
+        return list(pool.map(_run_in_worker, [(params, kwargs) for params in grid]))
+
+
+def _parse_sweep(items):
+    spec = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        spec[name.strip()] = [float(v) for v in values.split(",") if v]
+    return spec
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="CSV or Parquet candles")
+    parser.add_argument("--synthetic-days", type=float, default=365, help="random-walk minute bars when --data is not given")
+    parser.add_argument("--symbol", default="btcusdt")
+    parser.add_argument("--step", type=int, default=3600, help="simulated seconds between evaluations")
+    parser.add_argument("--balance", type=float, default=100.0)
+    parser.add_argument("--warmup-days", type=float, default=0, help="feed candles without trading first")
+    parser.add_argument("--sweep", action="append", default=[], help="NAME=v1,v2,... (repeatable)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--json", help="write the full reports (with equity curves) to this file")
+    args = parser.parse_args()
+
+    source = ("file", args.data) if args.data else ("synthetic", args.synthetic_days)
+    kwargs = {"symbol": args.symbol, "step": args.step, "balance": args.balance, "warmup_days": args.warmup_days}
+    spec = _parse_sweep(args.sweep)
+    if spec:
+        reports = run_sweep(source, sweep_grid(spec), workers=args.workers, **kwargs)
+    else:
+        reports = [run_backtest(_load_source(source), **kwargs)]
+
+    print(f"{'params':<48} {'days':>7} {'equity':>11} {'pnl':>11} {'max dd':>7} {'runtime s':>9} {'ms/day':>7}")
+    for r in reports:
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items()) or "defaults"
+        print(f"{params:<48} {r['days']:>7.0f} {r['final_equity']:>11.2f} {r['pnl']:>11.2f} "
+              f"{r['max_drawdown'] * 100:>6.1f}% {r['runtime_s']:>9.2f} {r['runtime_per_day_ms'] or 0:>7.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_history.py
+# Hot user-scoped queries on a large history table, before and after the
+# schema migrations (epoch timestamps + (user_id, id)/(user_id, symbol) indexes).
+# Usage: python benchmarks/bench_history.py [--rows 1000000] [--users 10000] [--queries 200]
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUERIES = {
+    "latest_20_history": "SELECT action, symbol, qty, price, info, timestamp FROM history WHERE user_id=? ORDER BY id DESC LIMIT 20",
+    "full_history": "SELECT action, symbol, qty, price, info, timestamp FROM history WHERE user_id=? ORDER BY id DESC",
+    "positions": "SELECT id, symbol, qty, avg_price, entry_time, trailing_stop FROM positions WHERE user_id=?",
+}
+
+
+def seed_legacy_db(path, n_rows, n_users):
+    """Schema as created by the original init_db (TEXT ISO timestamps, no indexes)."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (user_id TEXT PRIMARY KEY, email TEXT, balance REAL, cash REAL, next_lot REAL, max_equity REAL, last_deposit TEXT)")
+    conn.execute("""CREATE TABLE positions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, symbol TEXT, qty REAL, avg_price REAL,
+                    entry_time TEXT, trailing_stop REAL, last_profit_check_price REAL, last_checked TEXT)""")
+    conn.execute("""CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, action TEXT, symbol TEXT, qty REAL,
+                    price REAL, info TEXT, timestamp TEXT)""")
+    rnd = random.Random(1)
+    ts = "2024-01-01T00:00:00.000000"
+    info = "{'status': 'simulated', 'message': 'Huobi client not configured'}"
+    batch = []
+    for i in range(n_rows):
+        batch.append((f"user{rnd.randrange(n_users)}", rnd.choice(["buy", "partial_sell", "monthly_deposit"]), "btcusdt",
+                      rnd.random(), 50000 + rnd.random() * 1000, info, ts))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) VALUES (?,?,?,?,?,?,?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) VALUES (?,?,?,?,?,?,?)", batch)
+    conn.executemany("INSERT INTO positions (user_id, symbol, qty, avg_price, entry_time, trailing_stop, last_profit_check_price, last_checked) VALUES (?,?,?,?,?,?,?,?)",
+                     [(f"user{u}", "btcusdt", 0.01, 50000, ts, 45000, 50000, ts) for u in range(n_users) for _ in range(3)])
+    conn.executemany("INSERT INTO users VALUES (?,?,?,?,?,?,?)",
+                     [(f"user{u}", None, 100, 100, 40, 100, ts) for u in range(n_users)])
+    conn.commit()
+    conn.close()
+
+
+def time_queries(path, n_users, n_queries):
+    conn = sqlite3.connect(path)
+    rnd = random.Random(2)
+    users = [f"user{rnd.randrange(n_users)}" for _ in range(n_queries)]
+    out = {}
+    for name, sql in QUERIES.items():
+        start = time.perf_counter()
+        for uid in users:
+            conn.execute(sql, (uid,)).fetchall()
+        out[name] = (time.perf_counter() - start) / n_queries * 1000
+    plan = conn.execute("EXPLAIN QUERY PLAN " + QUERIES["latest_20_history"], ("user0",)).fetchall()
+    conn.close()
+    return out, " / ".join(r[-1] for r in plan)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_history_")
+    legacy = os.path.join(tmp, "legacy.db")
+    start = time.perf_counter()
+    seed_legacy_db(legacy, args.rows, args.users)
+    print(f"seeded {args.rows} history rows for {args.users} users in {time.perf_counter() - start:.1f}s")
+
+    before, plan_before = time_queries(legacy, args.users, args.queries)
+
+    # importing app touches no database: point it at the legacy file and migrate
+    import app
+    app.DB_FILE = legacy
+    start = time.perf_counter()
+    app.init_db()
+    migrate_s = time.perf_counter() - start
+    app.close_db()
+
+    after, plan_after = time_queries(legacy, args.users, args.queries)
+
+    print(f"migration to schema v{app.MIGRATIONS[-1][0]}: {migrate_s:.1f}s")
+    print(f"{'query':<20} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for name in QUERIES:
+        print(f"{name:<20} {before[name]:>10.3f} {after[name]:>10.3f} {before[name] / after[name]:>7.1f}x")
+    print("plan before:", plan_before)
+    print("plan after: ", plan_after)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
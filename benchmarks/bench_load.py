@@ -0,0 +1,240 @@
+# benchmarks/bench_load.py
+# Capacity of one instance: seeds N users with positions and history into a
+# temporary DB, then times per-user evaluate_user_strategy, full scheduler
+# cycles (simulated klines, SimulatedExchange instead of Huobi) and the
+# /balance (single and batch), /history and /run_strategy endpoints under concurrent clients
+# (in-process WSGI, no network). Results go to stdout and, with --json, to a
+# file that can be diffed between commits.
+# Usage: python benchmarks/bench_load.py [--users 1000,10000,100000] [--clients 8] [--json out.json]
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# never reach a real exchange from a benchmark
+for _name in ("HUOBI_API_KEY", "HUOBI_API_SECRET"):
+    os.environ.pop(_name, None)
+os.environ["EXCHANGE_CLIENT"] = "sdk"
+os.environ["MARKET_FEED"] = ""
+
+import app
+from backends import SimulatedExchange
+
+SYMBOL = "btcusdt"
+
+
+def percentiles(samples):
+    if not samples:
+        return {"n": 0}
+    s = sorted(samples)
+
+    def pick(q):
+        return s[min(len(s) - 1, int(q * len(s)))] * 1000
+
+    return {"n": len(s), "mean_ms": sum(s) / len(s) * 1000, "p50_ms": pick(0.50), "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99), "max_ms": s[-1] * 1000}
+
+
+def seed_users(n_users, positions_per_user, history_per_user, price, seed=3):
+    """Bulk insert into the (already migrated) app DB; returns the user ids."""
+    rng = random.Random(seed)
+    now = int(time.time())
+    users, positions, history = [], [], []
+    for i in range(n_users):
+        uid = f"user{i}"
+        users.append((uid, None, 100.0, rng.uniform(20, 200), 40.0, 150.0, now - rng.randrange(0, 25 * 86400)))
+        for _ in range(positions_per_user):
+            avg = price * rng.uniform(0.8, 1.2)
+            positions.append((uid, SYMBOL, rng.uniform(0.0001, 0.002), avg, now - rng.randrange(0, 60 * 86400),
+                              avg * app.TRAILING_STOP_FACTOR, avg, now))
+        for _ in range(history_per_user):
+            history.append((uid, rng.choice(["buy", "partial_sell", "monthly_deposit"]), SYMBOL, rng.random() * 0.001,
+                            price * rng.uniform(0.8, 1.2), "{}", now - rng.randrange(0, 90 * 86400)))
+    conn = app.get_db()
+    with conn:
+        conn.executemany("INSERT INTO users (user_id, email, balance, cash, next_lot, max_equity, last_deposit) "
+                         "VALUES (?,?,?,?,?,?,?)", users)
+        conn.executemany("INSERT INTO positions (user_id, symbol, qty, avg_price, entry_time, trailing_stop, "
+                         "last_profit_check_price, last_checked) VALUES (?,?,?,?,?,?,?,?)", positions)
+        conn.executemany("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) "
+                         "VALUES (?,?,?,?,?,?,?)", history)
+    return [u[0] for u in users]
+
+
+def bench_evaluate(user_ids, n_evals, snapshot):
+    rng = random.Random(5)
+    samples = []
+    for uid in rng.sample(user_ids, min(n_evals, len(user_ids))):
+        start = time.perf_counter()
+        app.evaluate_user_strategy(uid, SYMBOL, snapshot=snapshot)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def bench_cycles(n_cycles, workers, interval):
+    scheduler = app.StrategyScheduler(interval=interval, workers=workers)
+    executor = app.OrderExecutor(rate=1e9) if app.ORDER_OUTBOX else None
+    durations, drains = [], []
+    try:
+        for _ in range(n_cycles):
+            start = time.perf_counter()
+            scheduler.run_cycle()
+            durations.append(time.perf_counter() - start)
+            if executor is not None:
+                # the outbox is sent off the cycle, by the executor: timed separately
+                start = time.perf_counter()
+                executor.drain()
+                drains.append(time.perf_counter() - start)
+    finally:
+        scheduler.pool.shutdown(wait=True)
+        if executor is not None:
+            executor.pool.shutdown(wait=True)
+    stats = scheduler.status()
+    worst = max(durations)
+    return {
+        "durations_s": durations,
+        "max_s": worst,
+        "utilization": worst / interval,
+        "overruns": sum(1 for d in durations if d > interval),
+        "users_evaluated": stats["users_evaluated"],
+        "users_conflicted": stats["users_conflicted"],
+        "users_idle": stats.get("users_idle", 0),
+        "order_intents": stats["order_intents"],
+        "orders_sent": stats["orders_sent"] + (executor.stats["orders_sent"] if executor is not None else 0),
+        "outbox_drain_s": drains,
+        "errors": stats["errors"],
+    }
+
+
+def _http_worker(flask_app, endpoint, user_ids, n_requests, seed, batch=50):
+    rng = random.Random(seed)
+    client = flask_app.test_client()
+    samples, errors = [], 0
+    for _ in range(n_requests):
+        uid = rng.choice(user_ids)
+        start = time.perf_counter()
+        if endpoint == "/balance (batch)":
+            resp = client.post("/balance", json={"user_ids": rng.sample(user_ids, min(batch, len(user_ids)))})
+        elif endpoint == "/run_strategy":
+            resp = client.post("/run_strategy", json={"user_id": uid, "symbol": SYMBOL})
+        elif endpoint == "/history":
+            resp = client.get(f"/history?user_id={uid}&limit=20")
+        else:
+            resp = client.get(f"/balance?user_id={uid}")
+        samples.append(time.perf_counter() - start)
+        if resp.status_code not in (200, 409):  # 409: user busy, expected under contention
+            errors += 1
+    return samples, errors
+
+
+HTTP_ENDPOINTS = ("/balance", "/balance (batch)", "/history", "/run_strategy")
+
+
+def bench_http(flask_app, user_ids, clients, requests_per_client, batch):
+    out = {}
+    for endpoint in HTTP_ENDPOINTS:
+        app.user_cache.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(lambda i: _http_worker(flask_app, endpoint, user_ids, requests_per_client, i, batch),
+                                    range(clients)))
+        elapsed = time.perf_counter() - start
+        samples = [s for r, _ in results for s in r]
+        out[endpoint] = dict(percentiles(samples), clients=clients, errors=sum(e for _, e in results),
+                             throughput_rps=len(samples) / elapsed)
+    out["user_cache"] = app.user_cache.stats()
+    return out
+
+
+def run_size(n_users, args, workdir):
+    app.close_db()
+    app.DB_FILE = os.path.join(workdir, f"load_{n_users}.db")
+    app.init_db()
+    app.user_cache.clear()
+    exchange = SimulatedExchange()
+    app.exchange = app.strategy_env.exchange = exchange
+    app.strategy_env.stop_book = app.stop_book
+
+    snapshot = app.compute_signal_snapshot(SYMBOL)
+    start = time.perf_counter()
+    user_ids = seed_users(n_users, args.positions, args.history, snapshot.price)
+    result = {"users": n_users, "positions": n_users * args.positions, "seed_s": time.perf_counter() - start}
+    print(f"[{n_users} users] seeded in {result['seed_s']:.1f}s")
+
+    result["evaluate_user"] = bench_evaluate(user_ids, args.evals, snapshot)
+    print(f"[{n_users} users] evaluate_user_strategy p50 {result['evaluate_user']['p50_ms']:.2f} ms, "
+          f"p95 {result['evaluate_user']['p95_ms']:.2f} ms")
+
+    if args.cycles:
+        cycle = bench_cycles(args.cycles, args.workers, args.interval)
+        cycle["projected_max_users"] = int(n_users * args.interval / cycle["max_s"]) if cycle["max_s"] else None
+        cycle["exchange_orders"] = len(exchange.orders)
+        result["cycle"] = cycle
+        print(f"[{n_users} users] cycle {cycle['max_s']:.2f}s ({cycle['utilization'] * 100:.0f}% of {args.interval}s), "
+              f"~{cycle['projected_max_users']} users fit one interval")
+
+    if args.requests:
+        result["http"] = bench_http(app.create_app(), user_ids, args.clients, args.requests, args.batch)
+        for endpoint in HTTP_ENDPOINTS:
+            r = result["http"][endpoint]
+            print(f"[{n_users} users] {endpoint:<16} {r['throughput_rps']:>8.0f} req/s  p50 {r['p50_ms']:.2f} ms  "
+                  f"p95 {r['p95_ms']:.2f} ms  errors {r['errors']}")
+    app.close_db()
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="1000,10000,100000", help="comma-separated user counts")
+    parser.add_argument("--positions", type=int, default=3, help="open positions per user")
+    parser.add_argument("--history", type=int, default=20, help="history rows per user")
+    parser.add_argument("--evals", type=int, default=500, help="users timed one by one with evaluate_user_strategy")
+    parser.add_argument("--cycles", type=int, default=1, help="full scheduler cycles per size (0 = skip)")
+    parser.add_argument("--workers", type=int, default=app.STRATEGY_WORKERS)
+    parser.add_argument("--interval", type=float, default=app.CHECK_INTERVAL_SECONDS)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent HTTP clients")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client and endpoint (0 = skip)")
+    parser.add_argument("--batch", type=int, default=50, help="user_ids per batch /balance request")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    try:
+        results = [run_size(int(n), args, workdir) for n in args.users.split(",") if n]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": vars(args),
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print("results written to", args.json)
+
+
+if __name__ == "__main__":
+    main()
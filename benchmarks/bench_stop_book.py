@@ -0,0 +1,104 @@
+# benchmarks/bench_stop_book.py
+# Stop detection per price update: the stop book vs scanning every open position.
+# Usage: python benchmarks/bench_stop_book.py [--positions 1000,10000,100000] [--prices 2000]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stop_book import StopBook
+
+FACTOR = 0.90
+
+
+def make_positions(n, seed=7):
+    rng = random.Random(seed)
+    rows = []
+    for pid in range(1, n + 1):
+        avg = 100 * rng.uniform(0.7, 1.3)
+        stop = avg * FACTOR * rng.uniform(0.9, 1.1)
+        rows.append((pid, pid % max(1, n // 3), "btcusdt", avg, stop))
+    return rows
+
+
+def make_prices(n, seed=11):
+    rng = random.Random(seed)
+    price, out = 100.0, []
+    for _ in range(n):
+        price *= 1 + rng.gauss(0, 0.001)
+        out.append(price)
+    return out
+
+
+def scan(rows, price, peak):
+    # what the per-tick loop does: effective stop of every open position against the price
+    hit = []
+    for pid, (uid, avg, stop) in rows.items():
+        eff = max(stop, peak * FACTOR) if peak > avg else stop
+        if price < eff:
+            hit.append((pid, uid))
+    return hit
+
+
+def run_book(book, prices):
+    # crossed positions are sold, as the stop check would do
+    counts = []
+    for p in prices:
+        hits = book.on_price("btcusdt", p)
+        for pid, _ in hits:
+            book.remove(pid)
+        counts.append(len(hits))
+    return counts
+
+
+def run_scan(rows, prices):
+    rows = {pid: (uid, avg, stop) for pid, uid, _, avg, stop in rows}
+    peak, counts = 0.0, []
+    for p in prices:
+        peak = max(peak, p)
+        hits = scan(rows, p, peak)
+        for pid, _ in hits:
+            del rows[pid]
+        counts.append(len(hits))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--positions", default="1000,10000,100000")
+    parser.add_argument("--prices", type=int, default=2000)
+    args = parser.parse_args()
+
+    prices = make_prices(args.prices)
+    print(f"{'positions':>10} {'scan us':>10} {'book us':>10} {'speedup':>8} {'flush ms':>9} {'mismatch':>9}")
+    for n in [int(x) for x in args.positions.split(",")]:
+        rows = make_positions(n)
+        book = StopBook(FACTOR)
+        book.load(rows)
+
+        start = time.perf_counter()
+        book_hits = run_book(book, prices)
+        t_book = (time.perf_counter() - start) / len(prices)
+
+        # the scan is slow at 100k: time a prefix of the prices and compare counts on it
+        sample = prices[:max(1, min(len(prices), 2_000_000 // n))]
+        start = time.perf_counter()
+        scan_hits = run_scan(rows, sample)
+        t_scan = (time.perf_counter() - start) / len(sample)
+        mismatch = sum(a != b for a, b in zip(scan_hits, book_hits))
+
+        # flush cost with every surviving position ratcheted
+        book.on_price("btcusdt", max(prices) * 1.5)
+        start = time.perf_counter()
+        book.flush()
+        t_flush = time.perf_counter() - start
+        print(f"{n:>10} {t_scan * 1e6:>10.1f} {t_book * 1e6:>10.1f} {t_scan / t_book:>7.1f}x "
+              f"{t_flush * 1000:>9.2f} {mismatch:>9}")
+
+
+if __name__ == "__main__":
+    main()
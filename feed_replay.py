@@ -0,0 +1,147 @@
+# feed_replay.py
+# Local WebSocket server that speaks the Huobi market protocol (gzip frames,
+# ping/pong, sub/subbed) and replays a fixed list of messages, for testing
+# market_feed.HuobiMarketFeed without the exchange.
+# Usage: python feed_replay.py [--port 8082] [--prices 100,99,97,...]
+
+import argparse
+import asyncio
+import gzip
+import json
+import threading
+import time
+
+from aiohttp import web
+
+from huobi_stub import PERIOD_SECONDS
+
+
+def synthetic_messages(symbol, prices, periods=("1day", "1week"), start_ts=None, step=1):
+    """One trade message plus one kline update per period for every price (`step` seconds apart)."""
+    start_ts = int(start_ts if start_ts is not None else time.time())
+    opens = {}
+    highs = {}
+    lows = {}
+    out = []
+    for i, price in enumerate(prices):
+        ts = start_ts + i * step
+        out.append({"ch": f"market.{symbol}.trade.detail", "ts": ts * 1000,
+                    "tick": {"id": i, "ts": ts * 1000, "data": [{"price": price, "amount": 0.1, "ts": ts * 1000,
+                                                                  "direction": "buy"}]}})
+        for period in periods:
+            cid = ts - ts % PERIOD_SECONDS[period]
+            if opens.get(period, (None,))[0] != cid:
+                opens[period] = (cid, price)
+                highs[period] = price
+                lows[period] = price
+            highs[period] = max(highs[period], price)
+            lows[period] = min(lows[period], price)
+            out.append({"ch": f"market.{symbol}.kline.{period}", "ts": ts * 1000,
+                        "tick": {"id": cid, "open": opens[period][1], "close": price, "high": highs[period],
+                                 "low": lows[period], "amount": 1.0, "vol": 1.0, "count": 1}})
+    return out
+
+
+class FeedReplayServer:
+    """
+    Replays `messages` to every connection, only for channels it subscribed to.
+    drop_after=N closes the first connection after N messages (reconnect/backfill tests).
+    """
+
+    def __init__(self, messages, interval=0.0, ping_interval=5.0, drop_after=None):
+        self.messages = messages
+        self.interval = interval
+        self.ping_interval = ping_interval
+        self.drop_after = drop_after
+        self.connections = 0
+        self.pongs = 0
+        self.subscriptions = []
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/ws", self.handler)
+        return app
+
+    @staticmethod
+    async def _send(ws, msg):
+        await ws.send_bytes(gzip.compress(json.dumps(msg).encode()))
+
+    async def _pinger(self, ws):
+        while not ws.closed:
+            await self._send(ws, {"ping": int(time.time() * 1000)})
+            await asyncio.sleep(self.ping_interval)
+
+    async def handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        first = self.connections == 1
+        subscribed = set()
+        replay = None
+
+        async def run_replay():
+            # give the client a moment to send all its subs
+            await asyncio.sleep(0.05)
+            sent = 0
+            for msg in self.messages:
+                if msg["ch"] not in subscribed:
+                    continue
+                if first and self.drop_after is not None and sent >= self.drop_after:
+                    await ws.close()
+                    return
+                await self._send(ws, msg)
+                sent += 1
+                if self.interval:
+                    await asyncio.sleep(self.interval)
+
+        pinger = asyncio.ensure_future(self._pinger(ws))
+        try:
+            async for raw in ws:
+                msg = json.loads(raw.data)
+                if "pong" in msg:
+                    self.pongs += 1
+                elif "sub" in msg:
+                    subscribed.add(msg["sub"])
+                    self.subscriptions.append(msg["sub"])
+                    await self._send(ws, {"id": msg.get("id"), "status": "ok", "subbed": msg["sub"],
+                                          "ts": int(time.time() * 1000)})
+                    if replay is None:
+                        replay = asyncio.ensure_future(run_replay())
+        finally:
+            pinger.cancel()
+            if replay is not None:
+                replay.cancel()
+        return ws
+
+
+def start_replay_in_thread(messages, port=0, **kwargs):
+    """Start a replay server on a daemon thread. Returns (ws_url, server)."""
+    server = FeedReplayServer(messages, **kwargs)
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(server.app())
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        loop.run_until_complete(site.start())
+        holder["port"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="feed-replay", daemon=True).start()
+    ready.wait()
+    return f"ws://127.0.0.1:{holder['port']}/ws", server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--symbol", default="btcusdt")
+    parser.add_argument("--prices", default="100,101,99,95,90,92")
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+    msgs = synthetic_messages(args.symbol, [float(p) for p in args.prices.split(",")])
+    web.run_app(FeedReplayServer(msgs, interval=args.interval).app(), host="127.0.0.1", port=args.port)
@@ -0,0 +1,113 @@
+# history_archive.py
+# Cold storage and rollups for the history table. ColdArchive keeps rows past
+# the hot horizon in gzip'd JSON-lines files, one per UTC month; every append
+# is a new gzip member, so a file is never rewritten, and rows read back are
+# de-duplicated by id (a batch appended again after a crash between the write
+# and the DELETE is harmless). rollup_rows() folds history rows into per-user
+# daily totals, with realized PnL at average cost per (user, symbol).
+
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+
+HISTORY_FIELDS = ("id", "user_id", "action", "symbol", "qty", "price", "info", "timestamp")
+SELL_ACTIONS = ("partial_sell", "trailing_stop_sell", "time_stop_partial_sell", "stop_global_sell")
+DEPOSIT_ACTIONS = ("monthly_deposit", "manual_deposit")
+# per (user, day): realized PnL and deposits (USD), trade counts, USD bought / sold
+ROLLUP_COLUMNS = ("realized_pnl", "deposits", "buys", "sells", "bought", "sold")
+
+_PARTITION_FILE = re.compile(r"^history-(\d{4}-\d{2})\.jsonl\.gz$")
+_DEPOSIT_INFO = re.compile(r"^deposit ([0-9.eE+-]+)$")
+
+
+def partition_of(ts):
+    return datetime.utcfromtimestamp(ts).strftime("%Y-%m")
+
+
+def day_of(ts):
+    return datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+class ColdArchive:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, partition):
+        return os.path.join(self.directory, f"history-{partition}.jsonl.gz")
+
+    def partitions(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(m.group(1) for m in map(_PARTITION_FILE.match, os.listdir(self.directory)) if m)
+
+    def append(self, rows):
+        """Append history rows (dicts of HISTORY_FIELDS) to their month files, durably; returns {partition: rows}."""
+        by_partition = {}
+        for row in rows:
+            by_partition.setdefault(partition_of(row["timestamp"]), []).append(row)
+        os.makedirs(self.directory, exist_ok=True)
+        for partition, part_rows in by_partition.items():
+            data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in part_rows).encode()
+            with open(self.path(partition), "ab") as f:
+                f.write(gzip.compress(data))
+                f.flush()
+                os.fsync(f.fileno())
+        return {p: len(r) for p, r in by_partition.items()}
+
+    def read(self, partition, user_id=None):
+        """The rows of one month (of one user), oldest first; [] if the month is not archived."""
+        try:
+            with gzip.open(self.path(partition), "rt") as f:
+                rows = {}
+                for line in f:
+                    row = json.loads(line)
+                    if user_id is None or row["user_id"] == user_id:
+                        rows[row["id"]] = row
+        except FileNotFoundError:
+            return []
+        return [rows[i] for i in sorted(rows)]
+
+
+def deposit_amount(info):
+    """USD of a deposit history row, from its "deposit <amount>" info."""
+    m = _DEPOSIT_INFO.match(info or "")
+    return float(m.group(1)) if m else 0.0
+
+
+def rollup_rows(rows, basis):
+    """
+    Fold history rows (tuples in HISTORY_FIELDS order, by id) into
+    {(user_id, day): {column: value}} deltas. basis is {(user_id, symbol): [qty, cost]},
+    the open quantity bought and its cost, updated in place: a sell realizes
+    (price - cost / qty) per unit sold, so positions of the same symbol are pooled.
+    """
+    out = {}
+    for _, user_id, action, symbol, qty, price, info, ts in rows:
+        is_buy, is_sell, is_deposit = action == "buy", action in SELL_ACTIONS, action in DEPOSIT_ACTIONS
+        if not (is_buy or is_sell or is_deposit):
+            continue
+        day = out.setdefault((user_id, day_of(ts)), dict.fromkeys(ROLLUP_COLUMNS, 0.0))
+        if is_deposit:
+            day["deposits"] += deposit_amount(info)
+            continue
+        qty, price = qty or 0.0, price or 0.0
+        held = basis.setdefault((user_id, symbol), [0.0, 0.0])
+        if is_buy:
+            held[0] += qty
+            held[1] += qty * price
+            day["buys"] += 1
+            day["bought"] += qty * price
+            continue
+        # a sell of more than the basis knows (history older than the rollup) realizes nothing on the excess
+        matched = min(qty, held[0])
+        avg = held[1] / held[0] if held[0] > 0 else price
+        day["realized_pnl"] += matched * (price - avg)
+        held[0] -= matched
+        held[1] -= matched * avg
+        if held[0] <= 1e-12:
+            held[0] = held[1] = 0.0
+        day["sells"] += 1
+        day["sold"] += qty * price
+    return out
@@ -0,0 +1,233 @@
+# huobi_async.py
+# asyncio Huobi REST client (aiohttp): one shared ClientSession with a
+# keep-alive connection pool, token-bucket rate limiting and per-request
+# timeouts, so many klines / orders can be in flight at once.
+# AsyncBridge lets the (threaded) Flask app and strategy loop call it.
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode, urlparse
+
+import aiohttp
+
+HUOBI_REST_URL = "https://api.huobi.pro"
+# err-codes: a place request reusing a client-order-id, an order lookup that found nothing
+DUPLICATE_CLIENT_ORDER_ID = "order-duplicate-client-order-id"
+ORDER_NOT_FOUND = "base-record-invalid"
+# order states after which nothing more fills
+FINAL_ORDER_STATES = ("filled", "partial-canceled", "canceled")
+
+
+class HuobiAPIError(Exception):
+    """err_code: Huobi's "err-code" (None when the response had none); http_status: None for transport errors."""
+
+    def __init__(self, message, err_code=None, http_status=None):
+        super().__init__(message)
+        self.err_code = err_code
+        self.http_status = http_status
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` saved; acquire() waits for a token."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _candle(k):
+    return {
+        "id": k["id"],
+        "open": float(k["open"]),
+        "high": float(k["high"]),
+        "low": float(k["low"]),
+        "close": float(k["close"]),
+        "vol": float(k["vol"]),
+    }
+
+
+def order_fill(order):
+    """(filled qty, average price) of a finished order (dict from get_order), None while it can still fill."""
+    if order.get("state") not in FINAL_ORDER_STATES:
+        return None
+    qty = float(order.get("field-amount", order.get("filled-amount")) or 0)
+    cash = float(order.get("field-cash-amount", order.get("filled-cash-amount")) or 0)
+    return qty, (cash / qty if qty else None)
+
+
+class HuobiAsyncClient:
+    """
+    Usage:
+        async with HuobiAsyncClient(api_key=..., secret_key=...) as client:
+            weekly, daily = await client.get_klines_many([("btcusdt", "1week", 100), ("btcusdt", "1day", 200)])
+    Market data is public; orders and accounts need api_key/secret_key.
+    """
+
+    def __init__(self, base_url=HUOBI_REST_URL, api_key=None, secret_key=None, max_connections=20,
+                 rate=10.0, burst=20, timeout=10.0, order_rate=5.0, order_burst=10):
+        self.base_url = base_url.rstrip("/")
+        self.host = urlparse(self.base_url).netloc.lower()
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.market_bucket = TokenBucket(rate, burst)
+        self.order_bucket = TokenBucket(order_rate, order_burst)
+        self.session = None
+        self.account_id = None
+
+    async def start(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _signed_params(self, method, path, params):
+        if not (self.api_key and self.secret_key):
+            raise HuobiAPIError("api_key/secret_key required for signed endpoints")
+        params = dict(params or {})
+        params.update({
+            "AccessKeyId": self.api_key,
+            "SignatureMethod": "HmacSHA256",
+            "SignatureVersion": "2",
+            "Timestamp": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+        query = urlencode(sorted(params.items()))
+        payload = "\n".join([method, self.host, path, query])
+        digest = hmac.new(self.secret_key.encode(), payload.encode(), hashlib.sha256).digest()
+        params["Signature"] = base64.b64encode(digest).decode()
+        return params
+
+    async def _request(self, method, path, params=None, body=None, signed=False, bucket=None, timeout=None):
+        await self.start()
+        await (bucket or self.market_bucket).acquire()
+        if signed:
+            params = self._signed_params(method, path, params)
+        kwargs = {"params": params, "json": body}
+        if timeout:
+            # otherwise the session default applies (passing None would disable it)
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        async with self.session.request(method, self.base_url + path, **kwargs) as resp:
+            data = await resp.json(content_type=None)
+        if resp.status != 200 or data.get("status") not in ("ok", None):
+            raise HuobiAPIError(f"{method} {path}: HTTP {resp.status} {data.get('err-code')} {data.get('err-msg')}",
+                                err_code=data.get("err-code"), http_status=resp.status)
+        return data
+
+    # market data
+    async def get_klines(self, symbol, period="1day", size=200, timeout=None):
+        """Candles oldest first, same dicts as app.fetch_klines."""
+        data = await self._request("GET", "/market/history/kline",
+                                   params={"symbol": symbol, "period": period, "size": size}, timeout=timeout)
+        # Huobi returns the newest candle first
+        return sorted((_candle(k) for k in data.get("data") or []), key=lambda c: c["id"])
+
+    async def get_klines_many(self, requests, timeout=None):
+        """requests: [(symbol, period, size)] -> list of candle lists ([] for a failed request)."""
+        results = await asyncio.gather(*(self.get_klines(s, p, n, timeout=timeout) for s, p, n in requests),
+                                       return_exceptions=True)
+        out = []
+        for r in results:
+            if isinstance(r, Exception):
+                print("Error fetching klines:", r)
+                out.append([])
+            else:
+                out.append(r)
+        return out
+
+    async def get_tickers(self, timeout=None):
+        """Latest close for every symbol: {symbol: close}."""
+        data = await self._request("GET", "/market/tickers", timeout=timeout)
+        return {t["symbol"]: float(t["close"]) for t in data.get("data") or []}
+
+    # account / orders
+    async def get_account_id(self):
+        if self.account_id is None:
+            data = await self._request("GET", "/v1/account/accounts", signed=True, bucket=self.order_bucket)
+            accounts = [a for a in data.get("data") or [] if a.get("type") == "spot"] or data.get("data") or []
+            if not accounts:
+                raise HuobiAPIError("no Huobi account")
+            self.account_id = accounts[0]["id"]
+        return self.account_id
+
+    async def place_market_order(self, symbol, side, amount, client_order_id=None, timeout=None):
+        """
+        Market buy/sell; returns the exchange order id. Reusing a client_order_id
+        raises HuobiAPIError with err_code DUPLICATE_CLIENT_ORDER_ID.
+        """
+        body = {
+            "account-id": str(await self.get_account_id()),
+            "symbol": symbol,
+            "type": "buy-market" if side.lower() == "buy" else "sell-market",
+            "amount": str(amount),
+            "source": "spot-api",
+        }
+        if client_order_id:
+            body["client-order-id"] = client_order_id
+        data = await self._request("POST", "/v1/order/orders/place", body=body, signed=True,
+                                   bucket=self.order_bucket, timeout=timeout)
+        return data["data"]
+
+    async def get_order(self, order_id, timeout=None):
+        """The order as Huobi reports it ("state", "field-amount", "field-cash-amount", ...)."""
+        data = await self._request("GET", f"/v1/order/orders/{order_id}", signed=True,
+                                   bucket=self.order_bucket, timeout=timeout)
+        return data["data"]
+
+    async def get_order_by_client_id(self, client_order_id, timeout=None):
+        """The order placed with this client-order-id, or None if Huobi has none."""
+        try:
+            data = await self._request("GET", "/v1/order/orders/getClientOrder", params={"clientOrderId": client_order_id},
+                                       signed=True, bucket=self.order_bucket, timeout=timeout)
+        except HuobiAPIError as e:
+            if e.err_code == ORDER_NOT_FOUND:
+                return None
+            raise
+        return data["data"]
+
+    async def place_market_orders(self, orders, timeout=None):
+        """orders: [(symbol, side, amount)] -> list of order ids or exceptions."""
+        return await asyncio.gather(*(self.place_market_order(s, side, a, timeout=timeout) for s, side, a in orders),
+                                    return_exceptions=True)
+
+
+class AsyncBridge:
+    """Runs an event loop on a daemon thread; run() executes a coroutine on it from any thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="huobi-async", daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
@@ -0,0 +1,172 @@
+# huobi_stub.py
+# Local aiohttp server that mimics the Huobi REST endpoints used by
+# huobi_async.HuobiAsyncClient, for tests, benchmarks and offline runs.
+# Usage: python huobi_stub.py [--port 8081] [--latency-ms 20]
+#        then HUOBI_REST_URL=http://127.0.0.1:8081 EXCHANGE_CLIENT=async
+
+import argparse
+import asyncio
+import math
+import threading
+import time
+
+from aiohttp import web
+
+from huobi_async import DUPLICATE_CLIENT_ORDER_ID, ORDER_NOT_FOUND
+
+PERIOD_SECONDS = {
+    "1min": 60, "5min": 300, "15min": 900, "30min": 1800,
+    "60min": 3600, "4hour": 14400, "1day": 86400, "1week": 604800,
+}
+
+
+def synthetic_klines(symbol, period, size, now=None):
+    """Deterministic candles aligned to the period, newest first (like Huobi)."""
+    step = PERIOD_SECONDS[period]
+    now = int(now if now is not None else time.time())
+    last_open = now - now % step
+    base = 100 + sum(ord(c) for c in symbol) * 10
+    out = []
+    for i in range(size):
+        ts = last_open - i * step
+        n = ts // step
+        close = base * (1 + 0.2 * math.sin(n / 10)) + (n % 5)
+        openp = close - base * 0.002 * math.cos(n / 8)
+        out.append({"id": ts, "open": openp, "close": close, "high": max(openp, close) * 1.002,
+                    "low": min(openp, close) * 0.998, "amount": 1.0, "vol": 10.0 + n % 7, "count": 10})
+    return out
+
+
+class HuobiStub:
+    """
+    State kept for inspection: `requests` (method, path) log, `orders` by id.
+    latency/fail_every let tests exercise timeouts and retries. Market orders
+    fill at once at the synthetic 1min close; fill_ratio < 1 leaves them
+    partial-canceled with that share filled.
+    """
+
+    def __init__(self, latency=0.0, fail_every=0, symbols=("btcusdt", "ethusdt"), fill_ratio=1.0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fill_ratio = fill_ratio
+        self.symbols = list(symbols)
+        self.requests = []
+        self.orders = {}
+        self._client_ids = {}
+        self._next_order_id = 1
+
+    def app(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/market/history/kline", self.kline)
+        app.router.add_get("/market/tickers", self.tickers)
+        app.router.add_get("/v1/account/accounts", self.accounts)
+        app.router.add_post("/v1/order/orders/place", self.place_order)
+        app.router.add_get("/v1/order/orders/getClientOrder", self.get_client_order)
+        app.router.add_get("/v1/order/orders/{order_id}", self.get_order)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests.append((request.method, request.path))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_every and len(self.requests) % self.fail_every == 0:
+            return web.json_response({"status": "error", "err-code": "stub-failure", "err-msg": "injected"}, status=500)
+        return await handler(request)
+
+    @staticmethod
+    def _error(code, msg):
+        return web.json_response({"status": "error", "err-code": code, "err-msg": msg})
+
+    async def kline(self, request):
+        q = request.query
+        period = q.get("period", "1day")
+        if period not in PERIOD_SECONDS:
+            return self._error("invalid-parameter", "invalid period")
+        size = min(int(q.get("size", 150)), 2000)
+        symbol = q.get("symbol", "btcusdt")
+        return web.json_response({"status": "ok", "ch": f"market.{symbol}.kline.{period}", "ts": int(time.time() * 1000),
+                                  "data": synthetic_klines(symbol, period, size)})
+
+    async def tickers(self, request):
+        data = []
+        for s in self.symbols:
+            k = synthetic_klines(s, "1min", 1)[0]
+            data.append({"symbol": s, "open": k["open"], "high": k["high"], "low": k["low"],
+                         "close": k["close"], "amount": k["amount"], "vol": k["vol"], "count": k["count"]})
+        return web.json_response({"status": "ok", "ts": int(time.time() * 1000), "data": data})
+
+    @staticmethod
+    def _signed(request):
+        return all(k in request.query for k in ("AccessKeyId", "Signature", "Timestamp"))
+
+    async def accounts(self, request):
+        if not self._signed(request):
+            return self._error("api-signature-not-valid", "missing signature")
+        return web.json_response({"status": "ok", "data": [{"id": 1001, "type": "spot", "subtype": "", "state": "working"}]})
+
+    async def place_order(self, request):
+        if not self._signed(request):
+            return self._error("api-signature-not-valid", "missing signature")
+        body = await request.json()
+        client_id = body.get("client-order-id")
+        if client_id and client_id in self._client_ids:
+            # Huobi rejects a client-order-id it has already seen; nothing is placed
+            return self._error(DUPLICATE_CLIENT_ORDER_ID, "Duplicate client-order-id")
+        order_id = str(self._next_order_id)
+        self._next_order_id += 1
+        price = synthetic_klines(body["symbol"], "1min", 1)[0]["close"]
+        filled = float(body["amount"]) * self.fill_ratio
+        self.orders[order_id] = dict(body, **{
+            "id": int(order_id), "state": "filled" if self.fill_ratio >= 1 else "partial-canceled",
+            "field-amount": str(filled), "field-cash-amount": str(filled * price), "created-at": int(time.time() * 1000),
+        })
+        if client_id:
+            self._client_ids[client_id] = order_id
+        return web.json_response({"status": "ok", "data": order_id})
+
+    async def get_order(self, request):
+        if not self._signed(request):
+            return self._error("api-signature-not-valid", "missing signature")
+        order = self.orders.get(request.match_info["order_id"])
+        if order is None:
+            return self._error(ORDER_NOT_FOUND, "record invalid")
+        return web.json_response({"status": "ok", "data": order})
+
+    async def get_client_order(self, request):
+        if not self._signed(request):
+            return self._error("api-signature-not-valid", "missing signature")
+        order_id = self._client_ids.get(request.query.get("clientOrderId"))
+        if order_id is None:
+            return self._error(ORDER_NOT_FOUND, "record invalid")
+        return web.json_response({"status": "ok", "data": self.orders[order_id]})
+
+
+def start_stub_in_thread(port=0, **kwargs):
+    """Start a stub on a daemon thread. Returns (base_url, stub)."""
+    stub = HuobiStub(**kwargs)
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(stub.app())
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        loop.run_until_complete(site.start())
+        holder["port"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="huobi-stub", daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{holder['port']}", stub
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    web.run_app(HuobiStub(latency=args.latency_ms / 1000).app(), host="127.0.0.1", port=args.port)
@@ -0,0 +1,381 @@
+# indicators.py
+# Technical indicators: full-history helpers used by the strategy plus
+# incremental (streaming) versions that are seeded once and then updated per candle.
+
+import threading
+
+
+# -------------------------
+# Technical indicators helpers
+# -------------------------
+# candles: list of dicts with keys: timestamp, open, high, low, close, volume
+def sma(values, period):
+    if len(values) < period:
+        return None
+    return sum(values[-period:]) / period
+
+def ema(values, period):
+    if len(values) < period:
+        return None
+    k = 2 / (period + 1)
+    ema_prev = values[0]
+    for v in values[1:]:
+        ema_prev = v * k + ema_prev * (1 - k)
+    return ema_prev
+
+def compute_sma_list(values, period):
+    # rolling sum: O(n) instead of re-summing a slice per element
+    out = []
+    window = 0.0
+    for i, v in enumerate(values):
+        window += v
+        if i >= period:
+            window -= values[i - period]
+        out.append(window / period if i + 1 >= period else None)
+    return out
+
+def macd_line(values, fast=12, slow=26, signal=9):
+    # compute EMA fast and slow, then macd and signal
+    if len(values) < slow + signal:
+        return None, None
+    # compute EMA arrays
+    ema_fast = []
+    ema_slow = []
+    k_fast = 2/(fast+1)
+    k_slow = 2/(slow+1)
+    # seed with first value
+    ema_f = values[0]
+    ema_s = values[0]
+    for v in values:
+        ema_f = v*k_fast + ema_f*(1-k_fast)
+        ema_s = v*k_slow + ema_s*(1-k_slow)
+        ema_fast.append(ema_f)
+        ema_slow.append(ema_s)
+    macd = [f - s for f,s in zip(ema_fast, ema_slow)]
+    # signal as EMA of macd
+    sig = macd[0]
+    for m in macd:
+        sig = m*(2/(signal+1)) + sig*(1-2/(signal+1))
+    hist = macd[-1] - sig
+    return macd[-1], sig  # return macd last and signal
+
+def rsi(values, period=14):
+    if len(values) < period+1:
+        return None
+    gains = []
+    losses = []
+    for i in range(1, period+1):
+        delta = values[-i] - values[-i-1]
+        if delta > 0:
+            gains.append(delta)
+        else:
+            losses.append(abs(delta))
+    avg_gain = sum(gains)/period if gains else 0.0
+    avg_loss = sum(losses)/period if losses else 0.0
+    if avg_loss == 0:
+        return 100
+    rs = avg_gain/avg_loss
+    return 100 - (100/(1+rs))
+
+def atr(candles, period=14):
+    # candles list with high, low, close
+    if len(candles) < period+1:
+        return None
+    trs = []
+    for i in range(1, len(candles)):
+        high = candles[i]["high"]
+        low = candles[i]["low"]
+        prev_close = candles[i-1]["close"]
+        tr = max(high-low, abs(high-prev_close), abs(low-prev_close))
+        trs.append(tr)
+    # ATR is SMA of TRs last 'period'
+    return sum(trs[-period:]) / period
+
+# -------------------------
+# Streaming indicators
+# -------------------------
+# Each state is fed candles/closes in order with update() (O(1) per call).
+# peek() returns what the value would be if one more value were appended,
+# without changing the state: used for the still-open last candle.
+# Values match the helpers above over the same window (sma, rsi, atr up to
+# float rounding). macd_line seeds its EMAs with the first value of the window,
+# so a MACDState only matches it while fed from that same first candle: its
+# CandleSeries is anchored (reseeded whenever the window start moves).
+
+class SMAState:
+    """Rolling mean over the last `period` values (ring buffer + running sum)."""
+
+    def __init__(self, period):
+        self.period = period
+        self.buf = [0.0] * period
+        self.idx = 0
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, v):
+        if self.count >= self.period:
+            self.total -= self.buf[self.idx]
+        self.buf[self.idx] = v
+        self.total += v
+        self.idx = (self.idx + 1) % self.period
+        self.count += 1
+        if self.idx == 0:
+            # resync once per wrap so add/subtract rounding never accumulates
+            self.total = sum(self.buf)
+
+    def peek(self, v):
+        if self.count + 1 < self.period:
+            return None
+        total = self.total + v
+        if self.count >= self.period:
+            total -= self.buf[self.idx]
+        return total / self.period
+
+    @property
+    def value(self):
+        if self.count < self.period:
+            return None
+        return self.total / self.period
+
+
+class EMAState:
+    """Same recurrence as ema(): seeded with the first value, None until `period` values."""
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2 / (period + 1)
+        self.count = 0
+        self.ema = None
+
+    def update(self, v):
+        self.ema = v if self.ema is None else v * self.k + self.ema * (1 - self.k)
+        self.count += 1
+
+    def peek(self, v):
+        if self.count + 1 < self.period:
+            return None
+        return v if self.ema is None else v * self.k + self.ema * (1 - self.k)
+
+    @property
+    def value(self):
+        return self.ema if self.count >= self.period else None
+
+
+class MACDState:
+    """Same recurrence as macd_line(); value is (macd, signal) or (None, None)."""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.k_fast = 2 / (fast + 1)
+        self.k_slow = 2 / (slow + 1)
+        self.k_sig = 2 / (signal + 1)
+        self.min_count = slow + signal
+        self.count = 0
+        self.ema_f = None
+        self.ema_s = None
+        self.sig = None
+        self.macd = None
+
+    def _step(self, v):
+        ema_f = v if self.ema_f is None else self.ema_f
+        ema_s = v if self.ema_s is None else self.ema_s
+        # macd_line seeds with the first value and then also runs it through the recurrence
+        ema_f = v * self.k_fast + ema_f * (1 - self.k_fast)
+        ema_s = v * self.k_slow + ema_s * (1 - self.k_slow)
+        macd = ema_f - ema_s
+        sig = macd if self.sig is None else self.sig
+        sig = macd * self.k_sig + sig * (1 - self.k_sig)
+        return ema_f, ema_s, macd, sig
+
+    def update(self, v):
+        self.ema_f, self.ema_s, self.macd, self.sig = self._step(v)
+        self.count += 1
+
+    def peek(self, v):
+        if self.count + 1 < self.min_count:
+            return None, None
+        _, _, macd, sig = self._step(v)
+        return macd, sig
+
+    @property
+    def value(self):
+        if self.count < self.min_count:
+            return None, None
+        return self.macd, self.sig
+
+
+class RSIState:
+    """
+    RSI over closes.
+    - default: mean gain/loss of the last `period` deltas, same as rsi()
+    - wilder=True: Wilder smoothing (seeded with the simple mean of the first `period` deltas)
+    """
+
+    def __init__(self, period=14, wilder=False):
+        self.period = period
+        self.wilder = wilder
+        self.prev = None
+        self.gains = SMAState(period)
+        self.losses = SMAState(period)
+        self.avg_gain = None
+        self.avg_loss = None
+
+    def _split(self, v):
+        delta = v - self.prev
+        return (delta, 0.0) if delta > 0 else (0.0, -delta)
+
+    def _smoothed(self, gain, loss):
+        if self.avg_gain is None:
+            return self.gains.peek(gain), self.losses.peek(loss)
+        p = self.period
+        return (self.avg_gain * (p - 1) + gain) / p, (self.avg_loss * (p - 1) + loss) / p
+
+    def update(self, v):
+        if self.prev is not None:
+            gain, loss = self._split(v)
+            if self.wilder:
+                self.avg_gain, self.avg_loss = self._smoothed(gain, loss)
+            self.gains.update(gain)
+            self.losses.update(loss)
+        self.prev = v
+
+    def peek(self, v):
+        if self.prev is None:
+            return None
+        gain, loss = self._split(v)
+        if self.wilder:
+            avg_gain, avg_loss = self._smoothed(gain, loss)
+        else:
+            avg_gain, avg_loss = self.gains.peek(gain), self.losses.peek(loss)
+        return _rsi_from_averages(avg_gain, avg_loss)
+
+    @property
+    def value(self):
+        if self.wilder:
+            return _rsi_from_averages(self.avg_gain, self.avg_loss)
+        return _rsi_from_averages(self.gains.value, self.losses.value)
+
+
+def _rsi_from_averages(avg_gain, avg_loss):
+    if avg_gain is None or avg_loss is None:
+        return None
+    if avg_loss == 0:
+        return 100
+    rs = avg_gain / avg_loss
+    return 100 - (100 / (1 + rs))
+
+
+class ATRState:
+    """Mean true range of the last `period` candles, same as atr()."""
+
+    def __init__(self, period=14):
+        self.prev_close = None
+        self.trs = SMAState(period)
+
+    def _tr(self, high, low):
+        prev_close = self.prev_close
+        return max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+    def update(self, high, low, close):
+        if self.prev_close is not None:
+            self.trs.update(self._tr(high, low))
+        self.prev_close = close
+
+    def peek(self, high, low, close):
+        if self.prev_close is None:
+            return None
+        return self.trs.peek(self._tr(high, low))
+
+    @property
+    def value(self):
+        return self.trs.value
+
+
+class CandleSeries:
+    """
+    Feeds a candle list (ascending "id") into streaming states, committing only
+    closed candles that were not seen yet. The last candle is treated as still open.
+    If the new window no longer overlaps what was committed, the states are reseeded;
+    anchored=True also reseeds them whenever the first candle of the window changes,
+    for states that depend on where the window starts.
+    """
+
+    def __init__(self, make_states, anchored=False):
+        self.make_states = make_states
+        self.anchored = anchored
+        self.states = make_states()
+        self.last_id = None
+        self.first_id = None
+
+    def sync(self, candles, commit):
+        if not candles:
+            return False
+        closed = candles[:-1]
+        moved = self.anchored and candles[0]["id"] != self.first_id
+        self.first_id = candles[0]["id"]
+        if self.last_id is None or not closed or closed[0]["id"] > self.last_id or moved:
+            # first sync, a gap since the last one or a moved anchor: seed from the whole window
+            self.states = self.make_states()
+            new = closed
+        else:
+            start = len(closed)
+            while start > 0 and closed[start - 1]["id"] > self.last_id:
+                start -= 1
+            new = closed[start:]
+        for c in new:
+            commit(self.states, c)
+        if new:
+            self.last_id = new[-1]["id"]
+        return True
+
+
+class SymbolIndicators:
+    """
+    Streaming version of the strategy indicators for one symbol:
+    weekly MACD/RSI and daily MM200/MM50/MM10 and ATR.
+    sync() costs O(new candles); the open candle is only peeked. The weekly MACD
+    is reseeded from the window when it slides (once per closed week), to match
+    macd_line over the same window.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()  # callers hold it around sync()
+        self.weekly = CandleSeries(lambda: {"rsi": RSIState(14)})
+        self.weekly_macd = CandleSeries(lambda: {"macd": MACDState()}, anchored=True)
+        self.daily = CandleSeries(lambda: {"sma200": SMAState(200), "sma50": SMAState(50),
+                                           "sma10": SMAState(10), "atr": ATRState(14)})
+
+    @staticmethod
+    def _commit_weekly(states, c):
+        states["rsi"].update(c["close"])
+
+    @staticmethod
+    def _commit_macd(states, c):
+        states["macd"].update(c["close"])
+
+    @staticmethod
+    def _commit_daily(states, c):
+        for key in ("sma200", "sma50", "sma10"):
+            states[key].update(c["close"])
+        states["atr"].update(c["high"], c["low"], c["close"])
+
+    def sync(self, weekly, daily):
+        """Returns a dict with price, mm50, mm200, macd, macd_signal, rsi_week, atr (None where unavailable)."""
+        out = {"price": None, "mm50": None, "mm200": None, "macd": None, "macd_signal": None,
+               "rsi_week": None, "atr": None}
+        if self.weekly.sync(weekly, self._commit_weekly):
+            self.weekly_macd.sync(weekly, self._commit_macd)
+            last = weekly[-1]
+            out["macd"], out["macd_signal"] = self.weekly_macd.states["macd"].peek(last["close"])
+            out["rsi_week"] = self.weekly.states["rsi"].peek(last["close"])
+            out["price"] = last["close"]
+        if self.daily.sync(daily, self._commit_daily):
+            last = daily[-1]
+            d = self.daily.states
+            sma200 = d["sma200"].peek(last["close"])
+            sma50 = d["sma50"].peek(last["close"])
+            # same fallbacks as the full-history path: MM200 -> MM50, MM50 -> MM10
+            out["mm200"] = sma200 if sma200 is not None else sma50
+            out["mm50"] = sma50 if sma50 is not None else d["sma10"].peek(last["close"])
+            out["atr"] = d["atr"].peek(last["high"], last["low"], last["close"])
+            out["price"] = last["close"]
+        return out
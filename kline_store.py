@@ -0,0 +1,109 @@
+# kline_store.py
+# Candles kept on disk (one SQLite table, one row per candle, clustered by
+# (symbol, period, id)) so each tick asks the exchange only for the candles
+# opened since the last stored one: usually just the still-open candle. A
+# restarted process starts warm; a cold or stale series is fetched in full.
+
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS klines (
+    symbol TEXT NOT NULL,
+    period TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    open REAL, high REAL, low REAL, close REAL, vol REAL,
+    PRIMARY KEY (symbol, period, id)
+) WITHOUT ROWID
+"""
+
+
+class KlineStore:
+    def __init__(self, path, keep=2000, busy_timeout_ms=5000):
+        """keep: candles kept per (symbol, period); older ones are pruned when a new candle opens."""
+        self.path = path
+        self.keep = keep
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.fetches = 0
+        self.full_fetches = 0
+        self.candles_fetched = 0
+        self._conn().execute(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def read(self, symbol, period, size):
+        """The latest `size` stored candles, oldest first."""
+        rows = self._conn().execute(
+            "SELECT id, open, high, low, close, vol FROM klines WHERE symbol=? AND period=? ORDER BY id DESC LIMIT ?",
+            (symbol, period, size)).fetchall()
+        return [{"id": r[0], "open": r[1], "high": r[2], "low": r[3], "close": r[4], "vol": r[5]} for r in reversed(rows)]
+
+    def write(self, symbol, period, candles, prune=False):
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO klines (symbol, period, id, open, high, low, close, vol) VALUES (?,?,?,?,?,?,?,?)",
+                             [(symbol, period, c["id"], c["open"], c["high"], c["low"], c["close"], c["vol"]) for c in candles])
+            if prune:
+                conn.execute("""DELETE FROM klines WHERE symbol=? AND period=? AND id < (
+                                    SELECT id FROM klines WHERE symbol=? AND period=? ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+                             (symbol, period, symbol, period, self.keep - 1))
+
+    def plan(self, symbol, period, size, step, now):
+        """(stored window, n): how many of the latest candles to fetch to bring the window up to date."""
+        stored = self.read(symbol, period, size)
+        n = size
+        if len(stored) == size:
+            n = max(1, min(size, (now - stored[-1]["id"]) // step + 1))
+        return stored, n
+
+    def merge(self, symbol, period, size, step, stored, n, fresh):
+        """
+        Store the `fresh` candles fetched for plan()'s n and return the updated
+        window; [] if the fetch failed, None if `fresh` does not join the stored
+        series (clock skew, missing candles) and a full fetch is needed.
+        """
+        if fresh and n < size and fresh[0]["id"] > stored[-1]["id"] + step:
+            return None
+        with self._stats_lock:
+            self.fetches += 1
+            self.full_fetches += n == size
+            self.candles_fetched += len(fresh)
+        if not fresh:
+            return []
+        self.write(symbol, period, fresh, prune=n > 1)
+        if n == size:
+            return fresh[-size:]
+        first = fresh[0]["id"]
+        return ([c for c in stored if c["id"] < first] + fresh)[-size:]
+
+    def window(self, symbol, period, size, step, fetch, now):
+        """
+        The latest `size` candles of a `step`-seconds period, oldest first.
+        fetch(n) returns the latest n candles from the exchange (oldest first, []
+        on error). Only the candles opened since the last stored one are asked
+        for, that one included since it may still have been open. Returns [] when
+        the fetch fails, like a direct fetch would.
+        """
+        stored, n = self.plan(symbol, period, size, step, now)
+        candles = self.merge(symbol, period, size, step, stored, n, fetch(n))
+        if candles is None:
+            candles = self.merge(symbol, period, size, step, [], size, fetch(size))
+        return candles
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "fetches": self.fetches,
+                "full_fetches": self.full_fetches,
+                "candles_fetched": self.candles_fetched,
+                "candles_per_fetch": (self.candles_fetched / self.fetches) if self.fetches else 0.0,
+            }
@@ -0,0 +1,258 @@
+# market_feed.py
+# Streaming market data: Huobi WebSocket kline/trade subscriptions feeding
+# bounded, array-backed per-symbol/per-period candle buffers, with REST
+# backfill after every (re)connect. Price listeners are called on every
+# trade/kline update so the app can react to stops without waiting for a tick.
+
+import asyncio
+import gzip
+import json
+import threading
+import time
+from array import array
+
+import aiohttp
+
+HUOBI_WS_URL = "wss://api.huobi.pro/ws"
+
+
+class CandleBuffer:
+    """
+    Ring buffer of the last `capacity` candles, one typed array per field.
+    upsert() replaces the candle with the same id (the still-open one), appends
+    newer ones and drops the oldest when full.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ids = array("q", [0] * capacity)
+        self.open = array("d", [0.0] * capacity)
+        self.high = array("d", [0.0] * capacity)
+        self.low = array("d", [0.0] * capacity)
+        self.close = array("d", [0.0] * capacity)
+        self.vol = array("d", [0.0] * capacity)
+        self.start = 0  # slot of the oldest candle
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _slot(self, i):
+        return (self.start + i) % self.capacity
+
+    def _write(self, slot, c):
+        self.ids[slot] = int(c["id"])
+        self.open[slot] = float(c["open"])
+        self.high[slot] = float(c["high"])
+        self.low[slot] = float(c["low"])
+        self.close[slot] = float(c["close"])
+        self.vol[slot] = float(c.get("vol", 0.0))
+
+    @property
+    def last_id(self):
+        return self.ids[self._slot(self.count - 1)] if self.count else None
+
+    def upsert(self, c):
+        cid = int(c["id"])
+        if not self.count or cid > self.last_id:
+            if self.count < self.capacity:
+                self._write(self._slot(self.count), c)
+                self.count += 1
+            else:
+                self._write(self.start, c)
+                self.start = (self.start + 1) % self.capacity
+            return
+        # same or older candle: patch it in place if still buffered (binary search, ids ascending)
+        lo, hi = 0, self.count - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            mid_id = self.ids[self._slot(mid)]
+            if mid_id == cid:
+                self._write(self._slot(mid), c)
+                return
+            if mid_id < cid:
+                lo = mid + 1
+            else:
+                hi = mid - 1
+
+    def window(self, size):
+        """Last `size` candles, oldest first, as the dicts fetch_klines returns."""
+        n = min(size, self.count)
+        out = []
+        for i in range(self.count - n, self.count):
+            s = self._slot(i)
+            out.append({"id": self.ids[s], "open": self.open[s], "high": self.high[s],
+                        "low": self.low[s], "close": self.close[s], "vol": self.vol[s]})
+        return out
+
+    def last_close(self):
+        return self.close[self._slot(self.count - 1)] if self.count else None
+
+
+class CandleStore:
+    """Thread-safe map (symbol, period) -> CandleBuffer, plus the last traded price per symbol."""
+
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._last_price = {}
+        self._ready = set()  # keys backfilled since the last (re)connect
+
+    def _buffer(self, symbol, period):
+        key = (symbol, period)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = CandleBuffer(self.capacity)
+        return buf
+
+    def update(self, symbol, period, candle):
+        with self._lock:
+            self._buffer(symbol, period).upsert(candle)
+            self._last_price[symbol] = float(candle["close"])
+
+    def backfill(self, symbol, period, candles):
+        with self._lock:
+            buf = self._buffer(symbol, period)
+            for c in candles:
+                buf.upsert(c)
+            self._ready.add((symbol, period))
+
+    def set_price(self, symbol, price):
+        with self._lock:
+            self._last_price[symbol] = price
+
+    def mark_stale(self):
+        with self._lock:
+            self._ready.clear()
+
+    def window(self, symbol, period, size):
+        """Candles from the stream, or None if the buffer is not backfilled / too short."""
+        with self._lock:
+            buf = self._buffers.get((symbol, period))
+            if (symbol, period) not in self._ready or buf is None or len(buf) < min(size, self.capacity):
+                return None
+            return buf.window(size)
+
+    def last_price(self, symbol):
+        with self._lock:
+            return self._last_price.get(symbol)
+
+
+class HuobiMarketFeed:
+    """
+    Subscribes to market.<symbol>.kline.<period> and market.<symbol>.trade.detail.
+    On every (re)connect the kline buffers are backfilled over REST with
+    `backfill(symbol, period, size)` (a coroutine returning candles oldest
+    first, e.g. HuobiAsyncClient.get_klines) so gaps during a disconnect are filled.
+    Listeners: fn(symbol, price) called from the feed's event loop thread.
+    """
+
+    def __init__(self, store, symbols, periods=("1day", "1week"), url=HUOBI_WS_URL,
+                 backfill=None, backfill_size=200, trades=True):
+        self.store = store
+        self.symbols = list(symbols)
+        self.periods = list(periods)
+        self.url = url
+        self.backfill = backfill
+        self.backfill_size = backfill_size
+        self.trades = trades
+        self.listeners = []
+        self.connected = False
+        self.reconnects = 0
+        self.messages = 0
+        self._stopping = False
+
+    def add_price_listener(self, fn):
+        self.listeners.append(fn)
+
+    def _channels(self):
+        for s in self.symbols:
+            for p in self.periods:
+                yield f"market.{s}.kline.{p}"
+            if self.trades:
+                yield f"market.{s}.trade.detail"
+
+    def _notify(self, symbol, price):
+        for fn in self.listeners:
+            try:
+                fn(symbol, price)
+            except Exception as e:
+                print("Error in price listener:", e)
+
+    def handle_message(self, msg):
+        """Returns a reply to send (pong) or None."""
+        if "ping" in msg:
+            return {"pong": msg["ping"]}
+        ch = msg.get("ch")
+        tick = msg.get("tick")
+        if not ch or tick is None:
+            return None
+        self.messages += 1
+        parts = ch.split(".")
+        symbol = parts[1]
+        if parts[2] == "kline":
+            self.store.update(symbol, parts[3], tick)
+            self._notify(symbol, float(tick["close"]))
+        elif parts[2] == "trade":
+            trades = tick.get("data") or []
+            if trades:
+                price = float(trades[-1]["price"])
+                self.store.set_price(symbol, price)
+                self._notify(symbol, price)
+        return None
+
+    async def _backfill_all(self):
+        if self.backfill is None:
+            return
+        jobs = [(s, p) for s in self.symbols for p in self.periods]
+        results = await asyncio.gather(*(self.backfill(s, p, self.backfill_size) for s, p in jobs),
+                                       return_exceptions=True)
+        for (s, p), candles in zip(jobs, results):
+            if isinstance(candles, Exception):
+                print(f"Error backfilling {s} {p}:", candles)
+                continue
+            self.store.backfill(s, p, candles)
+
+    async def _session(self, session):
+        async with session.ws_connect(self.url, heartbeat=None, autoping=True) as ws:
+            for i, ch in enumerate(self._channels()):
+                await ws.send_str(json.dumps({"sub": ch, "id": str(i)}))
+            self.connected = True
+            # subscribe first, then backfill: updates arriving meanwhile are upserted into the same buffers
+            await self._backfill_all()
+            async for raw in ws:
+                if raw.type == aiohttp.WSMsgType.BINARY:
+                    msg = json.loads(gzip.decompress(raw.data))
+                elif raw.type == aiohttp.WSMsgType.TEXT:
+                    msg = json.loads(raw.data)
+                else:
+                    break
+                reply = self.handle_message(msg)
+                if reply is not None:
+                    await ws.send_str(json.dumps(reply))
+
+    async def run(self):
+        """Connect forever with exponential backoff (1s .. 60s)."""
+        delay = 1.0
+        async with aiohttp.ClientSession() as session:
+            while not self._stopping:
+                started = time.monotonic()
+                try:
+                    await self._session(session)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("Market feed disconnected:", e)
+                self.connected = False
+                self.store.mark_stale()
+                if self._stopping:
+                    break
+                self.reconnects += 1
+                if time.monotonic() - started > 60:
+                    delay = 1.0
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+
+    def stop(self):
+        self._stopping = True
@@ -0,0 +1,111 @@
+# order_netting.py
+# Nets the market orders of one strategy cycle per symbol, so N users trading
+# the same symbol on the same tick become one exchange order (or a few slices).
+#
+# Buys and sells of the same symbol cross internally; only the net quantity
+# goes to the exchange. Every intent then gets its share back: intents on the
+# net side are filled pro rata from the exchange orders, the rest internally.
+# An exchange response may report its fill ("filled_qty", "avg_price"); a
+# "simulated" one is taken as filled in full, one with status "error" as not at
+# all, and any other one as not known yet: its fill is (None, None).
+
+import math
+import threading
+
+
+class OrderIntent:
+    __slots__ = ("user_id", "symbol", "side", "qty", "history_id", "result")
+
+    def __init__(self, user_id, symbol, side, qty):
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side.lower()
+        self.qty = qty
+        self.history_id = None  # history row recording this order, set when the user's changes commit
+        self.result = None      # allocated fill, set by OrderBatch.execute
+
+
+class OrderBatch:
+    """
+    Order intents collected during one cycle (thread-safe: workers add, the cycle executes).
+    max_slice_qty splits a large net order into several exchange orders (None: never split).
+    """
+
+    def __init__(self, max_slice_qty=None):
+        self.max_slice_qty = max_slice_qty
+        self._lock = threading.Lock()
+        self.intents = []
+
+    def __len__(self):
+        return len(self.intents)
+
+    def extend(self, intents):
+        with self._lock:
+            self.intents.extend(intents)
+
+    def net(self):
+        """{symbol: (buy_qty, sell_qty)} summed over every intent."""
+        totals = {}
+        with self._lock:
+            for it in self.intents:
+                buy, sell = totals.get(it.symbol, (0.0, 0.0))
+                totals[it.symbol] = (buy + it.qty, sell) if it.side == "buy" else (buy, sell + it.qty)
+        return totals
+
+    def _slices(self, qty):
+        if not self.max_slice_qty or qty <= self.max_slice_qty:
+            return [qty]
+        n = math.ceil(qty / self.max_slice_qty)
+        return [qty / n] * n
+
+    def execute(self, place_order):
+        """
+        Send one net order (or slices) per symbol with place_order(symbol, side, qty)
+        and allocate the result to every intent: its "fills" are its share of each
+        exchange order's fill, (qty, avg price or None if not reported), or (None, None)
+        while that fill is unknown. Returns the number of exchange orders sent.
+        """
+        with self._lock:
+            intents, self.intents = self.intents, []
+        by_symbol = {}
+        for it in intents:
+            by_symbol.setdefault(it.symbol, []).append(it)
+
+        sent = 0
+        for symbol, group in by_symbol.items():
+            buy = sum(it.qty for it in group if it.side == "buy")
+            sell = sum(it.qty for it in group if it.side == "sell")
+            net_side = "buy" if buy > sell else "sell"
+            net_qty = abs(buy - sell)
+            side_total = buy if net_side == "buy" else sell
+
+            slices = self._slices(net_qty) if net_qty > 0 else []
+            responses = [place_order(symbol, net_side, q) for q in slices]
+            sent += len(responses)
+            filled = [(0.0, None) if r.get("status") == "error" else
+                      (r["filled_qty"], r.get("avg_price")) if "filled_qty" in r else
+                      (q, None) if r.get("status") == "simulated" else (None, None)
+                      for q, r in zip(slices, responses)]
+            errors = [r.get("message") for r in responses if r.get("status") == "error"]
+            if errors:
+                status = "error"
+            elif responses:
+                status = responses[0].get("status", "ok")
+            else:
+                status = "internal"
+            order_ids = [r["order_id"] for r in responses if r.get("order_id") is not None]
+
+            for it in group:
+                exchange_qty = it.qty * net_qty / side_total if it.side == net_side and side_total else 0.0
+                it.result = {
+                    "status": status,
+                    "side": net_side if responses else None,
+                    "order_ids": order_ids,
+                    "exchange_qty": exchange_qty,
+                    "internal_qty": it.qty - exchange_qty,
+                    "fills": [(q * exchange_qty / net_qty if q is not None else None, price) for q, price in filled],
+                    "batch_intents": len(group),
+                }
+                if errors:
+                    it.result["errors"] = errors
+        return sent
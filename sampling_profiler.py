@@ -0,0 +1,67 @@
+# sampling_profiler.py
+# Low-overhead sampling profiler: a daemon thread reads every other thread's
+# stack (sys._current_frames) every `interval` seconds and counts them as
+# folded stacks ("thread;outer;...;inner count" lines), the input format of
+# flamegraph.pl, speedscope and inferno. Nothing is traced between samples, so
+# it can be switched on in production for a single strategy cycle.
+
+import os
+import sys
+import threading
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, include_thread=None):
+        """include_thread(thread name) -> bool picks the threads to sample (default: all)."""
+        self.interval = interval
+        self.include_thread = include_thread
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.stacks = {}
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.stacks
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == me or (self.include_thread is not None and not self.include_thread(name)):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(name)
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            f.write(self.folded())
+        return path
+
@@ -0,0 +1,160 @@
+# stop_book.py
+# In-memory index of trailing stops across every user's open positions, per
+# symbol, so a new price only touches the positions whose stop it crosses.
+#
+# Ratchets are lazy: instead of rewriting every stop on every price, the book
+# remembers the highest price seen per symbol since the last flush. A
+# position's effective stop is max(stored stop, factor * peak) when the peak
+# is above its entry price (the same rule evaluate_user_strategy applies), and
+# flush() materializes those ratchets in one batch. Peaks survive load() and
+# replace_users(), so reloading positions never drops a ratchet the feed saw.
+
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+_INF = float("inf")
+
+
+class _SymbolStops:
+    def __init__(self):
+        self.stops = []      # sorted (stop, pos_id)
+        self.avgs = []       # sorted (avg_price, pos_id)
+        self.positions = {}  # pos_id -> (user_id, avg_price, stop)
+        self.peak = None     # highest price since the last flush
+
+
+class StopBook:
+    def __init__(self, factor):
+        self.factor = factor
+        self._lock = threading.Lock()
+        self._symbols = {}
+        self._symbol_of = {}  # pos_id -> symbol
+        self._of_user = {}    # user_id -> {pos_id}
+
+    def __len__(self):
+        return len(self._symbol_of)
+
+    def _book(self, symbol):
+        book = self._symbols.get(symbol)
+        if book is None:
+            book = self._symbols[symbol] = _SymbolStops()
+        return book
+
+    @staticmethod
+    def _remove_sorted(items, item):
+        i = bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    def load(self, rows):
+        """Replace the contents with rows of (pos_id, user_id, symbol, avg_price, stop)."""
+        with self._lock:
+            peaks = {sym: book.peak for sym, book in self._symbols.items() if book.peak is not None}
+            self._symbols = {}
+            self._symbol_of = {}
+            self._of_user = {}
+            for pos_id, user_id, symbol, avg_price, stop in rows:
+                book = self._book(symbol)
+                book.positions[pos_id] = (user_id, avg_price, stop)
+                self._symbol_of[pos_id] = symbol
+                self._of_user.setdefault(user_id, set()).add(pos_id)
+            for sym, peak in peaks.items():
+                self._book(sym).peak = peak
+            for book in self._symbols.values():
+                book.stops = sorted((p[2], pid) for pid, p in book.positions.items())
+                book.avgs = sorted((p[1], pid) for pid, p in book.positions.items())
+
+    def upsert(self, pos_id, user_id, symbol, avg_price, stop):
+        with self._lock:
+            self._upsert(pos_id, user_id, symbol, avg_price, stop)
+
+    def replace_users(self, user_ids, rows):
+        """
+        Replace the positions of `user_ids` (those without rows are removed)
+        with rows of (pos_id, user_id, symbol, avg_price, stop).
+        O((k + r) log n) for k old and r new positions.
+        """
+        with self._lock:
+            for user_id in user_ids:
+                for pos_id in list(self._of_user.get(user_id, ())):
+                    self._discard(pos_id)
+            for row in rows:
+                self._upsert(*row)
+
+    def _upsert(self, pos_id, user_id, symbol, avg_price, stop):
+        self._discard(pos_id)
+        book = self._book(symbol)
+        book.positions[pos_id] = (user_id, avg_price, stop)
+        insort(book.stops, (stop, pos_id))
+        insort(book.avgs, (avg_price, pos_id))
+        self._symbol_of[pos_id] = symbol
+        self._of_user.setdefault(user_id, set()).add(pos_id)
+
+    def remove(self, pos_id):
+        with self._lock:
+            self._discard(pos_id)
+
+    def _discard(self, pos_id):
+        symbol = self._symbol_of.pop(pos_id, None)
+        if symbol is None:
+            return
+        book = self._symbols[symbol]
+        user_id, avg_price, stop = book.positions.pop(pos_id)
+        owned = self._of_user[user_id]
+        owned.discard(pos_id)
+        if not owned:
+            del self._of_user[user_id]
+        self._remove_sorted(book.stops, (stop, pos_id))
+        self._remove_sorted(book.avgs, (avg_price, pos_id))
+
+    def on_price(self, symbol, price):
+        """
+        Record a price and return the (pos_id, user_id) whose effective stop is above it.
+        O(log n + triggered).
+        """
+        with self._lock:
+            book = self._symbols.get(symbol)
+            if book is None:
+                return []
+            if book.peak is None or price > book.peak:
+                book.peak = price
+            # stored stops above the price
+            hit = {pid for _, pid in book.stops[bisect_right(book.stops, (price, _INF)):]}
+            # ratcheted stops: factor * peak, for positions bought below the peak
+            if book.peak * self.factor > price:
+                hit.update(pid for _, pid in book.avgs[:bisect_left(book.avgs, (book.peak, -_INF))])
+            return [(pid, book.positions[pid][0]) for pid in hit]
+
+    def flush(self, symbol=None):
+        """
+        Materialize pending ratchets (one symbol or all) and return them as
+        [(new_stop, pos_id)] for the caller to persist in one batch.
+        """
+        changes = []
+        with self._lock:
+            symbols = [symbol] if symbol is not None else list(self._symbols)
+            for sym in symbols:
+                book = self._symbols.get(sym)
+                if book is None or book.peak is None:
+                    continue
+                candidate = book.peak * self.factor
+                before = len(changes)
+                for _, pid in book.avgs[:bisect_left(book.avgs, (book.peak, -_INF))]:
+                    user_id, avg_price, stop = book.positions[pid]
+                    if candidate > stop:
+                        book.positions[pid] = (user_id, avg_price, candidate)
+                        changes.append((candidate, pid))
+                if len(changes) > before:
+                    book.stops = sorted((p[2], pid) for pid, p in book.positions.items())
+                book.peak = None
+        return changes
+
+    def user_of(self, pos_id):
+        with self._lock:
+            symbol = self._symbol_of.get(pos_id)
+            return self._symbols[symbol].positions[pos_id][0] if symbol is not None else None
+
+    def stop_of(self, pos_id):
+        with self._lock:
+            symbol = self._symbol_of.get(pos_id)
+            return self._symbols[symbol].positions[pos_id][2] if symbol is not None else None
@@ -0,0 +1,479 @@
+# strategy.py
+# Strategy core, independent of Flask and SQLite: the signal snapshot, the
+# per-user unit of work and the evaluator. Everything external (time, storage,
+# order execution, market data) comes in through a StrategyEnv of the
+# interfaces in backends.py, so the same code runs live (app.py), in memory
+# (backends.MemoryStore) and in backtests (backtest.py).
+
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from order_netting import OrderIntent
+
+# pyramid starting lot for altcoins vs btc-like can be configured per user if wanted
+PIRAMIDE_MULT = 1.3
+PIRAMIDE_START = 40.0  # USD
+
+# trailing stop base factor
+TRAILING_STOP_FACTOR = 0.90  # 10% below peak by default (adaptive via ATR later)
+
+# stop time (days) to liquidate half if no +5%
+STOP_TIME_DAYS = 60
+
+# stop global percent from equity top
+STOP_GLOBAL_PCT = 0.25  # 25%
+
+# Monthly deposit
+MONTHLY_DEPOSIT = 500.0
+
+# profit thresholds (pct above the last partial sell, or entry) -> portion of the position to sell
+PROFIT_TAKE_LEVELS = [(100.0, 0.30), (50.0, 0.25), (20.0, 0.20)]
+
+# symbols a user trades when they have not picked their own (users.symbols is NULL)
+DEFAULT_SYMBOLS = ("btcusdt",)
+
+def next_pyramid_lot(lot):
+    return lot * PIRAMIDE_MULT
+
+def sell_portion(profit_pct):
+    for threshold, portion in PROFIT_TAKE_LEVELS:
+        if profit_pct >= threshold:
+            return portion
+    return 0.0
+
+def buy_lot(next_lot, snapshot):
+    """USD to spend on one buy: the pyramid lot adapted to the weekly RSI and the volatility."""
+    adj_lot = next_lot
+    # adapt lot if RSI>75 reduce or RSI<40 increase
+    if snapshot.rsi_week is not None:
+        if snapshot.rsi_week > 75:
+            adj_lot = next_lot * 0.7
+        elif snapshot.rsi_week < 40:
+            adj_lot = next_lot * 1.2
+    # also adapt by volatility: if ATR high relative to price, increase trailing and possibly reduce lot size
+    if snapshot.atr_ratio is not None and snapshot.atr_ratio > 0.03:  # arbitrary threshold
+        # high volatility => reduce lot by 20%
+        adj_lot = adj_lot * 0.8
+    return round(adj_lot, 2)
+
+def min_buy_cash(next_lot):
+    """Cash below which no buy_lot() is affordable (smallest lot, and the 1 USD minimum)."""
+    return max(1.0, round(next_lot * 0.7 * 0.8, 2))
+
+def parse_symbols(value):
+    """"btcusdt, ETHUSDT" or a list -> ("btcusdt", "ethusdt"): lower case, no duplicates, order kept."""
+    if not value:
+        return ()
+    items = value.split(",") if isinstance(value, str) else value
+    out = []
+    for s in items:
+        s = str(s).strip().lower()
+        if s and s not in out:
+            out.append(s)
+    return tuple(out)
+
+def user_symbols(user):
+    """The symbols a user trades (their universe): their own list, or DEFAULT_SYMBOLS."""
+    return parse_symbols(user.get("symbols")) or tuple(DEFAULT_SYMBOLS)
+
+# everything the strategy needs to know about a symbol on one tick (user independent)
+SignalSnapshot = namedtuple("SignalSnapshot", [
+    "symbol", "price", "mm50", "mm200", "macd", "macd_signal", "rsi_week",
+    "atr", "atr_ratio", "can_buy", "computed_at",
+])
+
+def build_signal_snapshot(symbol, weekly, daily, engine, now):
+    """
+    Snapshot from candle windows (oldest first, last one still open) and a
+    SymbolIndicators engine; `now` (epoch seconds) is recorded as computed_at.
+    Returns None when there is no price data.
+    """
+    # streaming indicators: only candles closed since the last tick are folded in
+    with engine.lock:
+        ind = engine.sync(weekly, daily)
+    price = ind["price"]
+    if price is None:
+        return None
+    mm50, mm200 = ind["mm50"], ind["mm200"]
+    macd_val, rsi_week, atr_val = ind["macd"], ind["rsi_week"], ind["atr"]
+
+    # conditions
+    cond_price_above_mm200 = (mm200 is not None and price > mm200)
+    cond_mm50_gt_mm200 = (mm50 is not None and mm200 is not None and mm50 > mm200)
+    cond_macd_pos = (macd_val is not None and macd_val > 0)
+    cond_rsi_week = (rsi_week is not None and 50 <= rsi_week <= 70)
+
+    return SignalSnapshot(
+        symbol=symbol,
+        price=price,
+        mm50=mm50,
+        mm200=mm200,
+        macd=macd_val,
+        macd_signal=ind["macd_signal"],
+        rsi_week=rsi_week,
+        atr=atr_val,
+        atr_ratio=(atr_val / price) if atr_val else None,
+        can_buy=all([cond_price_above_mm200, cond_mm50_gt_mm200, cond_macd_pos, cond_rsi_week]),
+        computed_at=datetime.utcfromtimestamp(now).isoformat(),
+    )
+
+
+class StrategyEnv:
+    """
+    The backends a strategy instance runs against (see backends.py). stop_book
+    is optional: when set, committed position changes are mirrored into it.
+    """
+
+    def __init__(self, clock, store, exchange, market_data=None, stop_book=None):
+        self.clock = clock
+        self.store = store
+        self.exchange = exchange
+        self.market_data = market_data
+        self.stop_book = stop_book
+
+
+# -------------------------
+# Unit of work (one per user evaluation)
+# -------------------------
+class UserUnitOfWork:
+    """
+    Loads a user and their positions once; the strategy mutates them in memory
+    and flush() writes every change (user row, positions, history) in one
+    store commit, so a crash mid-evaluation never leaves cash and positions out of sync.
+    With an OrderBatch, orders are queued as intents and handed to the batch only
+    once the changes they belong to are committed. The commit is refused
+    (backends.StaleUser) if the user was written by anyone else since the load:
+    the caller starts over with a new unit of work.
+    """
+
+    def __init__(self, env, user_id, orders=None):
+        self.env = env
+        self.user_id = user_id
+        self.orders = orders
+        self.user = env.store.get_user(user_id)
+        self.positions = env.store.get_positions(user_id) if self.user else []
+        self.version = self.user["version"] if self.user else None
+        self.user_dirty = False
+        self._new_positions = []
+        self._updated_positions = {}  # id -> position dict
+        self._deleted_positions = set()
+        self._history = []
+        self._intents = []  # (history row, OrderIntent, position) waiting for flush
+        self._last_deposit_set = False
+
+    def set_user(self, **fields):
+        for k, v in fields.items():
+            if self.user[k] != v:
+                self.user[k] = v
+                self.user_dirty = True
+
+    def add_cash(self, amount):
+        self.set_user(cash=self.user["cash"] + amount)
+
+    def set_last_deposit(self, when):
+        self.user["last_deposit"] = when
+        self._last_deposit_set = True
+
+    def add_position(self, symbol, qty, avg_price, trailing_stop):
+        now = self.env.clock.now()
+        p = {"id": None, "symbol": symbol, "qty": qty, "avg_price": avg_price, "entry_time": now,
+             "trailing_stop": trailing_stop, "last_profit_check_price": avg_price}
+        self.positions.append(p)
+        self._new_positions.append(p)
+        return p
+
+    def update_position(self, p, **fields):
+        """Update fields of a position; qty <= 0 closes it. No-op (no write) if nothing changed."""
+        if fields.get("qty") is not None and fields["qty"] <= 0:
+            self.delete_position(p)
+            return
+        changed = False
+        for k, v in fields.items():
+            if p[k] != v:
+                p[k] = v
+                changed = True
+        if changed and p["id"] is not None:
+            self._updated_positions[p["id"]] = p
+
+    def delete_position(self, p):
+        self.positions = [x for x in self.positions if x is not p]
+        if p["id"] is None:
+            self._new_positions = [x for x in self._new_positions if x is not p]
+        else:
+            self._updated_positions.pop(p["id"], None)
+            self._deleted_positions.add(p["id"])
+
+    def place_order(self, symbol, side, qty):
+        """Market order now (returns the exchange response), or an OrderIntent when batching."""
+        if self.orders is None:
+            return self.env.exchange.place_market_order(symbol, side, qty)
+        return OrderIntent(self.user_id, symbol, side, qty)
+
+    def add_history(self, action, symbol, qty, price, info="", order=None, position=None):
+        """
+        order: what place_order returned; its response (or later its allocated fill) becomes the info.
+        position: the position the order opened or reduced, where the store can book its actual fill.
+        """
+        now = self.env.clock.now()
+        if isinstance(order, OrderIntent):
+            row = (self.user_id, action, symbol, qty, price, json.dumps({"status": "pending"}), now)
+            self._intents.append((row, order, position))
+            return
+        if order is not None:
+            info = json.dumps(order, default=str)
+        self._history.append((self.user_id, action, symbol, qty, price, info, now))
+
+    def flush(self):
+        if not self.user:
+            return
+        if not (self.user_dirty or self._last_deposit_set or self._new_positions or self._updated_positions
+                or self._deleted_positions or self._history or self._intents):
+            return
+        history_ids, self.version = self.env.store.commit(
+            self.user_id,
+            user=self.user if (self.user_dirty or self._last_deposit_set) else None,
+            deleted=self._deleted_positions,
+            updated=list(self._updated_positions.values()),
+            new=self._new_positions,
+            history=self._history,
+            order_history=[row for row, _, _ in self._intents],
+            orders=[(it.symbol, it.side, it.qty, p) for _, it, p in self._intents],
+            now=self.env.clock.now(),
+            version=self.version,
+        )
+        if self._intents:
+            # the batch fills in these rows once the orders are sent
+            for (_, intent, _), hid in zip(self._intents, history_ids):
+                intent.history_id = hid
+            self.orders.extend([intent for _, intent, _ in self._intents])
+        # committed: mirror the position changes into the in-memory stop index
+        stop_book = self.env.stop_book
+        if stop_book is not None:
+            for pid in self._deleted_positions:
+                stop_book.remove(pid)
+            for p in list(self._updated_positions.values()) + self._new_positions:
+                stop_book.upsert(p["id"], self.user_id, p["symbol"], p["avg_price"], p["trailing_stop"])
+        self.user_dirty = False
+        self._last_deposit_set = False
+        self._new_positions = []
+        self._updated_positions = {}
+        self._deleted_positions = set()
+        self._history = []
+        self._intents = []
+
+
+# -------------------------
+# Strategy Core
+# -------------------------
+def evaluate_user_strategy(env, user_id, symbol=None, snapshot=None, orders=None, snapshots=None, prices=None):
+    """
+    Main strategy evaluator for a single user. Buys are considered for every
+    symbol of the user's universe (or just `symbol`), each against its
+    SignalSnapshot: from `snapshots` ({symbol: snapshot}, shared by all users of
+    a cycle), `snapshot`, or env.market_data. Every position is valued and sold
+    at its own symbol's price: the snapshot's, else `prices` ({symbol: price}),
+    else one env.market_data.prices() lookup for whatever is still missing.
+    Orders are placed right away, or queued in `orders` (an OrderBatch) to be
+    netted with other users'.
+    - place buys according to pyramid if conditions ok
+    - check partial sells based on profit thresholds
+    - trailing stop checks
+    - stop-time (60 days) check: if position older than STOP_TIME_DAYS and no +5% -> sell 50%
+    - stop-global (via max_equity), only when every position has a price
+    """
+    uow = UserUnitOfWork(env, user_id, orders=orders)
+    user = uow.user
+    if not user:
+        return {"status": "error", "message": "user not found"}
+
+    universe = parse_symbols([symbol]) if symbol else user_symbols(user)
+    snapshots = dict(snapshots or {})
+    if snapshot is not None:
+        snapshots[snapshot.symbol] = snapshot
+    for s in universe:
+        if s not in snapshots:
+            snapshots[s] = env.market_data.snapshot(s)
+    signals = [snapshots[s] for s in universe if snapshots[s] is not None]
+    if not signals:
+        return {"status": "error", "message": "no price data"}
+
+    prices = dict(prices or {})
+    prices.update((s, snap.price) for s, snap in snapshots.items() if snap is not None)
+    missing = sorted({p["symbol"] for p in uow.positions if prices.get(p["symbol"]) is None})
+    if missing:
+        prices.update(env.market_data.prices(missing))
+    unpriced = sorted({p["symbol"] for p in uow.positions if prices.get(p["symbol"]) is None})
+
+    now = env.clock.now()
+    actions = []
+
+    # update equity and max_equity for stop global
+    equity = user["cash"]  # cash is free usd for new buys
+    for p in uow.positions:
+        if p["symbol"] not in unpriced:
+            equity += p["qty"] * prices[p["symbol"]]
+    # an equity missing positions would look like a drawdown: no stop global on partial prices
+    if not unpriced:
+        if equity > user["max_equity"]:
+            # update max equity
+            uow.set_user(max_equity=equity)
+        # STOP GLOBAL
+        if user["max_equity"] and equity < user["max_equity"] * (1 - STOP_GLOBAL_PCT):
+            # liquidate all positions, each at its own price
+            for p in list(uow.positions):
+                # sell all via huobi (or simulate)
+                price = prices[p["symbol"]]
+                sell_qty = p["qty"]
+                order = uow.place_order(p["symbol"], "sell", sell_qty)
+                uow.add_cash(sell_qty * price)
+                uow.set_user(next_lot=PIRAMIDE_START)
+                uow.add_history("stop_global_sell", p["symbol"], sell_qty, price, order=order, position=p)
+                uow.delete_position(p)
+                actions.append("stop_global_liquidated")
+            uow.flush()
+            return {"status": "stop_global", "actions": actions}
+
+    # BUY logic: for each symbol whose conditions are met, try to buy next_lot USD (pirâmide);
+    # the lot grows with every buy, across symbols
+    for snap in signals:
+        if not snap.can_buy:
+            continue
+        price = snap.price
+        # fetch current user next_lot and cash
+        next_lot = user["next_lot"]
+        cash = user["cash"]
+        adj_lot = buy_lot(next_lot, snap)
+        if cash >= adj_lot and adj_lot >= 1:  # minimum 1 USD guard
+            qty = adj_lot / price
+            # place market buy in huobi with amount = qty or cost param depending on API (we use qty)
+            order = uow.place_order(snap.symbol, "buy", qty)
+            # save position
+            trailing_stop = price * TRAILING_STOP_FACTOR
+            position = uow.add_position(snap.symbol, qty, price, trailing_stop)
+            # deduct cash and update next_lot
+            uow.set_user(cash=cash - adj_lot, next_lot=round(next_pyramid_lot(next_lot), 2))
+            uow.add_history("buy", snap.symbol, qty, price, order=order, position=position)
+            actions.append(f"buy:{adj_lot}" if len(signals) == 1 else f"buy:{snap.symbol}:{adj_lot}")
+        else:
+            actions.append("not_enough_cash_or_lot_too_small")
+
+    # SELL logic: iterate positions and check profit thresholds and trailing stops
+    for p in list(uow.positions):
+        price = prices.get(p["symbol"])
+        if price is None:
+            continue
+        buy_price = p["avg_price"]
+        qty = p["qty"]
+        profit_pct = (price - buy_price) / buy_price * 100
+        # profit levels are measured from the last partial sell so one level is not re-sold every tick
+        check_price = p["last_profit_check_price"] or buy_price
+        sell_pct = sell_portion((price - check_price) / check_price * 100)
+        if sell_pct > 0:
+            sell_qty = qty * sell_pct
+            order = uow.place_order(p["symbol"], "sell", sell_qty)
+            # credit cash, shrink the position
+            uow.add_cash(sell_qty * price)
+            uow.update_position(p, qty=qty - sell_qty, last_profit_check_price=price)
+            uow.add_history("partial_sell", p["symbol"], sell_qty, price, order=order, position=p)
+            actions.append(f"partial_sell:{sell_qty}")
+
+        else:
+            # trailing stop update
+            new_stop = p["trailing_stop"]
+            if price > buy_price:
+                candidate_stop = price * TRAILING_STOP_FACTOR
+                if candidate_stop > new_stop:
+                    new_stop = candidate_stop
+            # if price below stop => sell all
+            if price < new_stop:
+                order = uow.place_order(p["symbol"], "sell", qty)
+                uow.add_cash(qty * price)
+                uow.add_history("trailing_stop_sell", p["symbol"], qty, price, order=order, position=p)
+                uow.delete_position(p)
+                actions.append("trailing_stop_executed")
+                continue
+            # update trailing stop if increased (only written when it changed)
+            uow.update_position(p, trailing_stop=new_stop)
+
+        # stop time: if position older than STOP_TIME_DAYS and never reached +5% then sell 50%
+        age_days = (now - p["entry_time"]) // 86400
+        if age_days >= STOP_TIME_DAYS:
+            # check if max profit achieved since entry - for simplicity use current profit_pct
+            if profit_pct < 5:
+                sell_qty = p["qty"] * 0.5
+                order = uow.place_order(p["symbol"], "sell", sell_qty)
+                uow.add_cash(sell_qty * price)
+                # restart the clock so the next time stop is STOP_TIME_DAYS later, not next tick
+                uow.update_position(p, qty=p["qty"] - sell_qty, entry_time=now)
+                uow.add_history("time_stop_partial_sell", p["symbol"], sell_qty, price, order=order, position=p)
+                actions.append("time_stop_partial")
+
+    # monthly deposit: if last_deposit more than 30 days ago, add monthly deposit to cash
+    last_dep = user["last_deposit"]
+    if last_dep:
+        if now - last_dep >= 30 * 86400:
+            # add deposit
+            uow.add_cash(MONTHLY_DEPOSIT)
+            uow.set_last_deposit(now)
+            uow.add_history("monthly_deposit", universe[0], 0, 0, f"deposit {MONTHLY_DEPOSIT}")
+            actions.append("monthly_deposit")
+
+    uow.flush()
+    result = {"status": "ok", "actions": actions, "equity": equity, "cash": user["cash"]}
+    if unpriced:
+        result["unpriced"] = unpriced
+    return result
+
+
+# -------------------------
+# Wake-up plan (when evaluating a user can next change anything)
+# -------------------------
+WakePlan = namedtuple("WakePlan", ["at", "bands", "buy_symbols", "always"])
+
+def wake_plan(user, positions, now):
+    """
+    The conditions under which evaluate_user_strategy can next do anything for
+    this user, as long as nothing else writes to them:
+    - at: epoch seconds of the next time rule (monthly deposit, time stop), or None
+    - bands: {symbol: (low, high)}: evaluate when the price is below low or at/above high
+      (trailing stop, its ratchet, profit levels, time stop past its deadline, new
+      max equity and stop global)
+    - buy_symbols: symbols whose buy signal should wake the user (none if no lot is affordable)
+    - always: evaluate on every tick (positions in several symbols: equity, hence
+      stop global, depends on more than one price)
+    """
+    times = []
+    if user["last_deposit"]:
+        times.append(user["last_deposit"] + 30 * 86400)
+    cash = user["cash"]
+    buy_symbols = user_symbols(user) if cash >= min_buy_cash(user["next_lot"]) else ()
+    if not positions:
+        if user["max_equity"] is not None and cash > user["max_equity"]:
+            times.append(now)  # max_equity is raised on the next evaluation
+        return WakePlan(min(times, default=None), {}, buy_symbols, False)
+    symbols = {p["symbol"] for p in positions}
+    if len(symbols) > 1:
+        return WakePlan(min(times, default=None), {}, buy_symbols, True)
+
+    low, high = 0.0, float("inf")
+    qty = sum(p["qty"] for p in positions)
+    if qty > 0:
+        # equity = cash + qty * price: a new max above, stop global below
+        high = min(high, (user["max_equity"] - cash) / qty)
+        if user["max_equity"]:
+            low = max(low, (user["max_equity"] * (1 - STOP_GLOBAL_PCT) - cash) / qty)
+    first_level = min(threshold for threshold, _ in PROFIT_TAKE_LEVELS)
+    for p in positions:
+        buy_price = p["avg_price"]
+        check_price = p["last_profit_check_price"] or buy_price
+        high = min(high, check_price * (1 + first_level / 100))
+        # trailing stop: sold below it, raised once price * factor passes it (in profit)
+        low = max(low, p["trailing_stop"])
+        high = min(high, max(buy_price, p["trailing_stop"] / TRAILING_STOP_FACTOR))
+        deadline = p["entry_time"] + STOP_TIME_DAYS * 86400
+        if deadline > now:
+            times.append(deadline)
+        else:
+            low = max(low, buy_price * 1.05)  # past the deadline: sold while under +5%
+    return WakePlan(min(times, default=None), {symbols.pop(): (low, high)}, buy_symbols, False)
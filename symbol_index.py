@@ -0,0 +1,59 @@
+# symbol_index.py
+# The symbols one tick needs snapshots and prices for: the union of every
+# user's universe and the symbols with open positions. Kept as per-symbol
+# counts of the users referencing them, updated per user as users change, so
+# a tick reads them in O(symbols) instead of scanning every user and position.
+
+import threading
+from collections import Counter
+
+
+class SymbolIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}            # user_id -> (universe, held) as frozensets
+        self._universes = Counter()  # symbol -> users trading it
+        self._held = Counter()       # symbol -> users holding it
+
+    def __len__(self):
+        return len(self._users)
+
+    @staticmethod
+    def _drop(counter, symbols):
+        for symbol in symbols:
+            counter[symbol] -= 1
+            if counter[symbol] <= 0:
+                del counter[symbol]
+
+    def _unlink(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self._drop(self._universes, entry[0])
+            self._drop(self._held, entry[1])
+
+    def update(self, user_id, universe, held):
+        """Set a user's universe and held symbols. O(symbols of the user)."""
+        universe, held = frozenset(universe), frozenset(held)
+        with self._lock:
+            self._unlink(user_id)
+            self._users[user_id] = (universe, held)
+            self._universes.update(universe)
+            self._held.update(held)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._unlink(user_id)
+
+    def load(self, users):
+        """Replace the contents with {user_id: (universe, held)}."""
+        with self._lock:
+            self._users = {}
+            self._universes = Counter()
+            self._held = Counter()
+        for user_id, (universe, held) in users.items():
+            self.update(user_id, universe, held)
+
+    def symbols(self):
+        """(symbols of every user's universe, symbols with open positions)."""
+        with self._lock:
+            return set(self._universes), set(self._held)
@@ -0,0 +1,77 @@
+# Batch endpoints: POST /register_users inserts many users at once (all or
+# nothing on invalid entries, existing ones left alone) and /balance answers
+# many user_ids with the same payload as the single-user call.
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_FILE", str(tmp_path / "users.db"))
+    app.init_db()
+    app.user_cache.clear()
+    return app.create_app().test_client()
+
+
+def register(client, *entries):
+    return client.post("/register_users", json={"users": list(entries)})
+
+
+def test_register_many_and_report_existing(client):
+    app.store.create_user("old", "old@example.com", 50.0, 40.0, app.now_ts())
+    res = register(client, {"user_id": "a", "balance": 200, "symbols": "BTCUSDT, ethusdt"},
+                   {"user_id": "b", "email": "b@example.com"}, {"user_id": "old", "balance": 999})
+    assert res.status_code == 200
+    assert res.get_json() == {"status": "ok", "created": 2, "existing": ["old"]}
+    a, b, old = (app.get_user(uid) for uid in ("a", "b", "old"))
+    assert a["cash"] == 200.0 and a["symbols"] == "btcusdt,ethusdt"
+    assert b["cash"] == app.DEFAULT_INITIAL_BALANCE and b["email"] == "b@example.com"
+    assert old["cash"] == 50.0
+
+
+def test_one_invalid_entry_rejects_the_batch(client):
+    res = register(client, {"user_id": "a"}, {"email": "no-id@example.com"}, {"user_id": "a"},
+                   {"user_id": "c", "balance": "lots"}, "not-an-object")
+    assert res.status_code == 400
+    assert [e["index"] for e in res.get_json()["errors"]] == [1, 2, 3, 4]
+    assert app.get_user("a") is None
+
+
+@pytest.mark.parametrize("payload", [{}, {"users": []}, {"users": {"user_id": "a"}}])
+def test_register_needs_a_list(client, payload):
+    assert client.post("/register_users", json=payload).status_code == 400
+
+
+def test_register_batch_limit(client, monkeypatch):
+    monkeypatch.setattr(app, "REGISTER_BATCH_MAX", 2)
+    assert register(client, {"user_id": "a"}, {"user_id": "b"}, {"user_id": "c"}).status_code == 400
+    assert app.get_user("a") is None
+
+
+def test_batch_balance_matches_single_calls(client):
+    register(client, {"user_id": "a", "balance": 100}, {"user_id": "b", "balance": 300})
+    app.add_position("a", "btcusdt", 0.5, 100.0, 90.0)
+    app.save_history("a", "buy", "btcusdt", 0.5, 100.0)
+
+    res = client.post("/balance", json={"user_ids": ["a", "zz", "b", "a"]})
+    body = res.get_json()
+    assert res.status_code == 200
+    assert sorted(body["users"]) == ["a", "b"] and body["missing"] == ["zz"]
+    for uid in ("a", "b"):
+        single = client.get("/balance", query_string={"user_id": uid}).get_json()
+        assert body["users"][uid] == {k: single[k] for k in ("user", "positions", "history")}
+    assert len(body["users"]["a"]["positions"]) == 1 and len(body["users"]["a"]["history"]) == 1
+
+    by_query = client.get("/balance", query_string={"user_ids": "b,zz"}).get_json()
+    assert sorted(by_query["users"]) == ["b"] and by_query["missing"] == ["zz"]
+
+
+def test_batch_balance_rejects_bad_ids_and_big_batches(client, monkeypatch):
+    assert client.post("/balance", json={"user_ids": "a,b"}).status_code == 400
+    assert client.post("/balance", json={"user_ids": ["a", 3]}).status_code == 400
+    monkeypatch.setattr(app, "BALANCE_BATCH_MAX", 2)
+    assert client.post("/balance", json={"user_ids": ["a", "b", "c"]}).status_code == 400
+    # duplicates count once
+    assert client.post("/balance", json={"user_ids": ["a", "b", "a"]}).status_code == 200
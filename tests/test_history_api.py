@@ -0,0 +1,76 @@
+# GET /history: keyset pagination (cursor, limit) and time filters given as
+# epoch seconds or ISO 8601, naive (UTC) or with an offset.
+
+import pytest
+
+import app
+
+T0 = 1_704_067_200  # 2024-01-01T00:00:00Z
+HOUR = 3600
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_FILE", str(tmp_path / "users.db"))
+    app.init_db()
+    app.user_cache.clear()
+    app.store.create_user("u1", None, 100.0, 40.0, T0)
+    for i in range(5):
+        app.db_execute("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) VALUES (?,?,?,?,?,?,?)",
+                       ("u1", "buy", "btcusdt", 1.0, 100.0 + i, "{}", T0 + i * HOUR))
+    return app.create_app().test_client()
+
+
+def times(res):
+    assert res.status_code == 200, res.get_json()
+    return [row["time"] for row in res.get_json()["history"]]
+
+
+def iso(*hours):
+    return [app.ts_to_iso(T0 + h * HOUR) for h in hours]
+
+
+@pytest.mark.parametrize("since", [str(T0 + 2 * HOUR), "2024-01-01T02:00:00", "2024-01-01T02:00:00+00:00",
+                                   "2024-01-01T02:00:00Z", "2024-01-01T04:00:00+02:00", "2023-12-31T21:00:00-05:00"])
+def test_since_in_every_format(client, since):
+    assert times(client.get("/history", query_string={"user_id": "u1", "since": since})) == iso(4, 3, 2)
+
+
+def test_until_with_offset_is_exclusive(client):
+    res = client.get("/history", query_string={"user_id": "u1", "until": "2024-01-01T03:00:00+02:00"})
+    assert times(res) == iso(0)
+
+
+def test_pages_follow_the_cursor(client):
+    seen, cursor = [], None
+    while True:
+        query = {"user_id": "u1", "limit": 2}
+        if cursor is not None:
+            query["cursor"] = cursor
+        body = client.get("/history", query_string=query).get_json()
+        seen += [row["time"] for row in body["history"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == iso(4, 3, 2, 1, 0)
+
+
+def test_full_last_page_then_empty_one(client):
+    body = client.get("/history", query_string={"user_id": "u1", "limit": 5}).get_json()
+    assert len(body["history"]) == 5 and body["next_cursor"] is not None
+    body = client.get("/history", query_string={"user_id": "u1", "limit": 5, "cursor": body["next_cursor"]}).get_json()
+    assert body["history"] == [] and body["next_cursor"] is None
+
+
+def test_limit_is_capped(client, monkeypatch):
+    monkeypatch.setattr(app, "HISTORY_MAX_PAGE_SIZE", 3)
+    body = client.get("/history", query_string={"user_id": "u1", "limit": 1000}).get_json()
+    assert len(body["history"]) == 3 and body["next_cursor"] is not None
+
+
+@pytest.mark.parametrize("query", [{"since": "yesterday"}, {"until": "2024-13-01"}, {"limit": 0}, {"limit": -1},
+                                   {"limit": "ten"}, {"cursor": "abc"}, {"cursor": 0}, {"cursor": "1.5"}])
+def test_bad_arguments_are_rejected(client, query):
+    res = client.get("/history", query_string=dict(query, user_id="u1"))
+    assert res.status_code == 400
+    assert res.get_json()["status"] == "error"
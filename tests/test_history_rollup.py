@@ -0,0 +1,114 @@
+# History upkeep: rollup_rows() folds trades into daily PnL at average cost,
+# rollup_history() does it incrementally in the database, and archive_history()
+# moves rolled-up rows to ColdArchive month files that read back unchanged.
+
+import pytest
+
+import app
+from history_archive import ColdArchive, rollup_rows
+
+DAY = 86400
+T0 = 1_704_067_200  # 2024-01-01T00:00:00Z
+
+
+def row(i, action, qty=0.0, price=0.0, ts=T0, info="{}", user_id="u1", symbol="btcusdt"):
+    return (i, user_id, action, symbol, qty, price, info, ts)
+
+
+def test_rollup_rows_realizes_at_average_cost():
+    basis = {}
+    days = rollup_rows([
+        row(1, "buy", 1.0, 100.0),
+        row(2, "buy", 1.0, 200.0),
+        row(3, "monthly_deposit", info="deposit 500"),
+        row(4, "partial_sell", 1.0, 180.0, ts=T0 + DAY),
+        row(5, "note", 1.0, 1.0, ts=T0 + DAY),  # not a trade: skipped
+        row(6, "trailing_stop_sell", 2.0, 120.0, ts=T0 + DAY),
+    ], basis)
+    first, second = days[("u1", "2024-01-01")], days[("u1", "2024-01-02")]
+    assert (first["buys"], first["bought"], first["deposits"]) == (2, 300.0, 500.0)
+    # 1 at 180 against 150, then 1 at 120 against 150; the second unit of that sell has no basis
+    assert second["realized_pnl"] == pytest.approx(30.0 - 30.0)
+    assert (second["sells"], second["sold"]) == (2, pytest.approx(420.0))
+    assert basis == {("u1", "btcusdt"): [0.0, 0.0]}
+
+
+def test_rollup_rows_continues_from_a_basis():
+    basis = {("u1", "btcusdt"): [2.0, 300.0]}
+    days = rollup_rows([row(1, "partial_sell", 1.0, 160.0)], basis)
+    assert days[("u1", "2024-01-01")]["realized_pnl"] == pytest.approx(10.0)
+    assert basis[("u1", "btcusdt")] == [1.0, pytest.approx(150.0)]
+
+
+def test_cold_archive_round_trip(tmp_path):
+    archive = ColdArchive(str(tmp_path / "archive"))
+    assert archive.partitions() == [] and archive.read("2024-01") == []
+    rows = [dict(zip(app.HISTORY_FIELDS, row(i, "buy", 1.0, 100.0 + i, ts=T0 + i * 10 * DAY, user_id=f"u{i % 2}")))
+            for i in range(1, 6)]
+    assert archive.append(rows) == {"2024-01": 3, "2024-02": 2}
+    # a batch appended again (crash between the write and the delete) reads back once
+    archive.append(rows[:2])
+    assert archive.partitions() == ["2024-01", "2024-02"]
+    assert archive.read("2024-01") == rows[:3]
+    assert archive.read("2024-02", user_id="u0") == [rows[3]]
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_FILE", str(tmp_path / "users.db"))
+    monkeypatch.setattr(app, "cold_archive", ColdArchive(str(tmp_path / "archive")))
+    app.init_db()
+    app.user_cache.clear()
+    app.store.create_user("u1", None, 1000.0, 40.0, T0)
+
+
+def add_history(action, qty, price, ts, info="{}"):
+    app.db_execute("INSERT INTO history (user_id, action, symbol, qty, price, info, timestamp) VALUES (?,?,?,?,?,?,?)",
+                   ("u1", action, "btcusdt", qty, price, info, ts))
+
+
+def trades():
+    # in time order, like the app writes them
+    for d in range(10):
+        add_history("buy", 1.0, 100.0 + d, T0 + d * DAY)
+        add_history("partial_sell", 0.5, 110.0 + d, T0 + d * DAY + 3600)
+        if d == 3:
+            add_history("manual_deposit", 0, 0, T0 + d * DAY + 7200, "deposit 250")
+
+
+def test_rollup_in_batches_matches_one_pass(db):
+    trades()
+    assert app.rollup_history(batch=3) == 21
+    assert app.rollup_history(batch=3) == 0
+    batched = app.pnl_report("u1")
+
+    app.db_execute("DELETE FROM pnl_daily")
+    app.db_execute("DELETE FROM pnl_totals")
+    app.db_execute("DELETE FROM pnl_cost_basis")
+    app.db_execute("DELETE FROM maintenance_state")
+    assert app.rollup_history(batch=1000) == 21
+    assert app.pnl_report("u1") == batched
+    totals = batched["totals"]
+    assert (totals["buys"], totals["sells"], totals["deposits"]) == (10, 10, 250.0)
+    assert (totals["first_day"], totals["last_day"]) == ("2024-01-01", "2024-01-10")
+    assert len(app.pnl_report("u1", "2024-01-03", "2024-01-05")["days"]) == 2
+
+
+def test_archive_moves_only_rolled_up_old_rows(db, monkeypatch):
+    trades()
+    monkeypatch.setattr(app, "now_ts", lambda: T0 + 40 * DAY)
+    # nothing is rolled up yet: nothing moves
+    assert app.archive_history(hot_days=35) == 0
+    app.rollup_history()
+    before = app.pnl_report("u1")
+    assert app.archive_history(hot_days=35, batch=4) == 11  # the first five days
+    assert app.db_execute("SELECT COUNT(*) FROM history", fetch=True)[0][0] == 10
+    assert app.db_execute("SELECT partition, rows FROM history_partitions", fetch=True) == [("2024-01", 11)]
+    assert app.pnl_report("u1") == before
+
+    client = app.create_app().test_client()
+    body = client.get("/history_archive", query_string={"user_id": "u1", "month": "2024-01"}).get_json()
+    # newest first, like /history
+    assert [r["action"] for r in body["history"]][:3] == ["partial_sell", "buy", "manual_deposit"]
+    assert len(body["history"]) == 11
+    assert client.get("/history_archive", query_string={"user_id": "u1"}).get_json()["months"] == ["2024-01"]
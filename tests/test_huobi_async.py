@@ -0,0 +1,86 @@
+# huobi_async.HuobiAsyncClient against the local Huobi stub (huobi_stub.py).
+
+import asyncio
+
+import pytest
+
+from huobi_async import DUPLICATE_CLIENT_ORDER_ID, HuobiAPIError, HuobiAsyncClient, order_fill
+from huobi_stub import start_stub_in_thread
+
+
+def run(stub_url, body, **kwargs):
+    async def main():
+        async with HuobiAsyncClient(stub_url, api_key="key", secret_key="secret", **kwargs) as client:
+            return await body(client)
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def stub():
+    return start_stub_in_thread()
+
+
+def test_klines_oldest_first(stub):
+    url, _ = stub
+    candles = run(url, lambda c: c.get_klines("btcusdt", "1day", 30))
+    assert len(candles) == 30
+    assert [c["id"] for c in candles] == sorted(c["id"] for c in candles)
+
+
+def test_resent_client_order_id_is_a_duplicate(stub):
+    url, server = stub
+
+    async def body(client):
+        order_id = await client.place_market_order("btcusdt", "buy", 0.5, client_order_id="claim-0")
+        with pytest.raises(HuobiAPIError) as err:
+            await client.place_market_order("btcusdt", "buy", 0.5, client_order_id="claim-0")
+        found = await client.get_order_by_client_id("claim-0")
+        missing = await client.get_order_by_client_id("claim-1")
+        return order_id, err.value, found, missing
+
+    order_id, err, found, missing = run(url, body)
+    assert err.err_code == DUPLICATE_CLIENT_ORDER_ID
+    assert len(server.orders) == 1
+    assert str(found["id"]) == order_id
+    assert missing is None
+
+
+def test_order_fill(stub):
+    url, server = stub
+    server.fill_ratio = 0.25
+
+    async def body(client):
+        order_id = await client.place_market_order("ethusdt", "sell", 2.0)
+        return await client.get_order(order_id)
+
+    qty, price = order_fill(run(url, body))
+    assert qty == pytest.approx(0.5)
+    assert price > 0
+    assert order_fill({"state": "submitted"}) is None
+
+
+def test_server_errors_carry_status_and_code():
+    url, _ = start_stub_in_thread(fail_every=1)
+    with pytest.raises(HuobiAPIError) as err:
+        run(url, lambda c: c.get_tickers())
+    assert err.value.http_status == 500
+    assert err.value.err_code == "stub-failure"
+
+
+def test_signed_endpoints_need_keys(stub):
+    url, _ = stub
+
+    async def body(client):
+        client.api_key = client.secret_key = None
+        await client.place_market_order("btcusdt", "buy", 1.0)
+
+    with pytest.raises(HuobiAPIError):
+        run(url, body)
+
+
+def test_many_requests_share_one_session(stub):
+    url, server = stub
+    results = run(url, lambda c: c.get_klines_many([(s, "1day", 10) for s in ("btcusdt", "ethusdt")] * 10),
+                  rate=1000, burst=1000)
+    assert [len(r) for r in results] == [10] * 20
+    assert len(server.requests) == 20
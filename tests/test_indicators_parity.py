@@ -0,0 +1,160 @@
+# Streaming indicators (indicators.SymbolIndicators and the *State classes)
+# against the full-window helpers the signal stage used before them, on
+# sliding windows whose last candle is still open.
+
+import random
+
+import pytest
+
+from indicators import (ATRState, EMAState, MACDState, RSIState, SMAState, SymbolIndicators, atr, ema,
+                        macd_line, rsi, sma)
+
+DAY = 86400
+WEEK = 7 * DAY
+
+
+def random_walk(n, seed, start=30000.0, vol=0.03):
+    rng = random.Random(seed)
+    price, out = start, []
+    for _ in range(n):
+        price *= 1 + rng.gauss(0.0005, vol)
+        out.append(price)
+    return out
+
+
+def candle(cid, o, h, l, c):
+    return {"id": cid, "open": o, "high": h, "low": l, "close": c, "vol": 1.0}
+
+
+def reference(weekly, daily):
+    """The full-window computation of the signal stage (before streaming)."""
+    closes_week = [c["close"] for c in weekly]
+    closes_daily = [c["close"] for c in daily]
+    mm200 = sma(closes_daily, 200) if len(closes_daily) >= 200 else sma(closes_daily, 50)
+    mm50 = sma(closes_daily, 50) if len(closes_daily) >= 50 else sma(closes_daily, 10)
+    macd_val, macd_signal = macd_line(closes_week) if len(closes_week) >= 35 else (None, None)
+    rsi_week = rsi(closes_week, period=14) if len(closes_week) >= 15 else None
+    atr_val = atr(daily, period=14) if len(daily) >= 15 else None
+    return {"price": closes_daily[-1], "mm50": mm50, "mm200": mm200, "macd": macd_val,
+            "macd_signal": macd_signal, "rsi_week": rsi_week, "atr": atr_val}
+
+
+def can_buy(ind):
+    return (ind["mm200"] is not None and ind["price"] > ind["mm200"]
+            and ind["mm50"] is not None and ind["mm50"] > ind["mm200"]
+            and ind["macd"] is not None and ind["macd"] > 0
+            and ind["rsi_week"] is not None and 50 <= ind["rsi_week"] <= 70)
+
+
+def ticks(days, seed, per_day=3):
+    """
+    (weekly window, daily window) as the exchange would return them over time:
+    the latest 100 weekly / 200 daily candles, the last one still open and
+    updated `per_day` times a day.
+    """
+    rng = random.Random(seed)
+    closes = random_walk(days * per_day, seed)
+    daily, weekly = [], []
+    for i, price in enumerate(closes):
+        t = i // per_day * DAY + (i % per_day) * (DAY // per_day)
+        day_id, week_id = t - t % DAY, t - t % WEEK
+        for series, cid in ((daily, day_id), (weekly, week_id)):
+            if series and series[-1]["id"] == cid:
+                last = series[-1]
+                series[-1] = candle(cid, last["open"], max(last["high"], price), min(last["low"], price), price)
+            else:
+                o = series[-1]["close"] if series else price
+                series.append(candle(cid, o, max(o, price) * (1 + rng.random() * 0.01),
+                                     min(o, price) * (1 - rng.random() * 0.01), price))
+        yield list(weekly[-100:]), list(daily[-200:])
+
+
+def assert_close(got, want, key):
+    if want is None:
+        assert got is None, key
+    else:
+        assert got == pytest.approx(want, rel=1e-9, abs=1e-9), key
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_symbol_indicators_match_full_window_helpers(seed):
+    engine = SymbolIndicators()
+    checked = 0
+    for weekly, daily in ticks(1200, seed):
+        got = engine.sync(weekly, daily)
+        want = reference(weekly, daily)
+        for key, value in want.items():
+            assert_close(got[key], value, key)
+        assert can_buy(got) == can_buy(want)
+        checked += 1
+    assert checked == 3600
+
+
+def test_macd_matches_after_the_weekly_window_slides():
+    # 100-candle window, 300 weeks: the window start moves every week
+    engine = SymbolIndicators()
+    slid = 0
+    for weekly, daily in ticks(300 * 7, seed=9, per_day=1):
+        got = engine.sync(weekly, daily)
+        want_macd, want_signal = macd_line([c["close"] for c in weekly]) if len(weekly) >= 35 else (None, None)
+        assert_close(got["macd"], want_macd, "macd")
+        assert_close(got["macd_signal"], want_signal, "macd_signal")
+        slid += len(weekly) == 100
+    assert slid > 1000
+
+
+def test_reseeds_after_a_gap():
+    engine = SymbolIndicators()
+    windows = list(ticks(900, seed=4, per_day=1))
+    for weekly, daily in windows[:300] + windows[700:]:  # 400 days without a tick
+        got = engine.sync(weekly, daily)
+        want = reference(weekly, daily)
+        for key, value in want.items():
+            assert_close(got[key], value, key)
+
+
+@pytest.mark.parametrize("period", [10, 50, 200])
+def test_sma_state(period):
+    values = random_walk(600, seed=period)
+    state = SMAState(period)
+    for i, v in enumerate(values):
+        assert_close(state.peek(v), sma(values[:i + 1], period), "peek")
+        state.update(v)
+        assert_close(state.value, sma(values[:i + 1], period), "value")
+
+
+def test_ema_state():
+    values = random_walk(300, seed=5)
+    state = EMAState(20)
+    for i, v in enumerate(values):
+        state.update(v)
+        assert_close(state.value, ema(values[:i + 1], 20), "value")
+
+
+def test_macd_state_from_the_same_first_value():
+    values = random_walk(300, seed=6)
+    state = MACDState()
+    for i, v in enumerate(values):
+        want = macd_line(values[:i + 1])
+        got = state.peek(v)
+        assert_close(got[0], want[0], "macd")
+        assert_close(got[1], want[1], "signal")
+        state.update(v)
+
+
+def test_rsi_state():
+    values = random_walk(300, seed=7)
+    state = RSIState(14)
+    for i, v in enumerate(values):
+        state.update(v)
+        window = values[:i + 1]
+        assert_close(state.value, rsi(window, 14) if len(window) >= 15 else None, "rsi")
+
+
+def test_atr_state():
+    closes = random_walk(300, seed=8)
+    candles = [candle(i, c, c * 1.01, c * 0.99, c) for i, c in enumerate(closes)]
+    state = ATRState(14)
+    for i, c in enumerate(candles):
+        assert_close(state.peek(c["high"], c["low"], c["close"]), atr(candles[:i + 1], 14), "peek")
+        state.update(c["high"], c["low"], c["close"])
@@ -0,0 +1,153 @@
+# app.MarketDataCache: concurrent requests for one key share a single fetch,
+# entries expire with their last candle, and failures are never cached.
+
+import threading
+import time
+
+import app
+
+
+class BlockingFetcher:
+    """Fetches block until `gate` is set; records every call."""
+
+    def __init__(self, result=None, error=None):
+        self.result = result if result is not None else [{"id": 0, "close": 1.0}]
+        self.error = error
+        self.calls = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, symbol, period, size):
+        self.calls.append((symbol, period, size))
+        self.started.set()
+        self.gate.wait(5)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return self.result
+
+
+def run_threads(target, n):
+    results = [None] * n
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, target())) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def wait_for_waiters(cache, n):
+    deadline = time.time() + 5
+    while cache.stats()["coalesced"] < n and time.time() < deadline:
+        time.sleep(0.001)
+
+
+def test_concurrent_gets_share_one_fetch():
+    fetcher = BlockingFetcher()
+    cache = app.MarketDataCache(fetcher, ttl=60)
+    threads, results = run_threads(lambda: cache.get("btcusdt", "1day", 200), 8)
+    fetcher.started.wait(5)
+    wait_for_waiters(cache, 7)
+    fetcher.gate.set()
+    for t in threads:
+        t.join(5)
+
+    assert fetcher.calls == [("btcusdt", "1day", 200)]
+    assert all(r is fetcher.result for r in results)
+    assert cache.stats()["misses"] == 1 and cache.stats()["coalesced"] == 7
+    assert cache.get("btcusdt", "1day", 200) is fetcher.result
+    assert cache.stats()["hits"] == 1
+
+
+def test_waiters_refetch_after_a_failed_fetch():
+    fetcher = BlockingFetcher(error=RuntimeError("timeout"))
+    cache = app.MarketDataCache(fetcher, ttl=60)
+    errors = []
+
+    def first():
+        try:
+            cache.get("btcusdt")
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=first)
+    leader.start()
+    fetcher.started.wait(5)
+    threads, results = run_threads(lambda: cache.get("btcusdt"), 3)
+    wait_for_waiters(cache, 3)
+    fetcher.gate.set()
+    for t in [leader] + threads:
+        t.join(5)
+
+    assert len(errors) == 1
+    assert all(r is fetcher.result for r in results)
+    # the leader's failed fetch, then one by whichever waiter woke first
+    assert len(fetcher.calls) == 2
+
+
+def test_empty_results_are_not_cached():
+    calls = []
+    cache = app.MarketDataCache(lambda *key: calls.append(key) or [], ttl=60)
+    assert cache.get("btcusdt") == []
+    assert cache.get("btcusdt") == []
+    assert len(calls) == 2 and cache.stats()["entries"] == 0
+
+
+def test_entry_expires_when_its_last_candle_closes():
+    cache = app.MarketDataCache(lambda *key: [], ttl=600)
+    now = 1_700_000_000
+    assert cache._expiry("1min", [{"id": now - 30}], now) == now + 30
+    assert cache._expiry("1day", [{"id": now - 30}], now) == now + 600
+    # already closed: the ttl applies
+    assert cache._expiry("1min", [{"id": now - 120}], now) == now + 600
+
+
+def test_expired_entry_is_fetched_again(monkeypatch):
+    clock = [1_700_000_000.0]
+    monkeypatch.setattr(app.time, "time", lambda: clock[0])
+    calls = []
+    cache = app.MarketDataCache(lambda *key: calls.append(key) or [{"id": 0}], ttl=60)
+    cache.get("btcusdt", "1day", 200)
+    clock[0] += 59
+    cache.get("btcusdt", "1day", 200)
+    clock[0] += 1
+    cache.get("btcusdt", "1day", 200)
+    assert len(calls) == 2
+
+
+def test_get_many_fetches_only_misses_together_and_joins_inflight():
+    fetcher = BlockingFetcher()
+    batches = []
+    cache = app.MarketDataCache(fetcher, ttl=60, many_fetcher=lambda keys: batches.append(list(keys)) or [[{"id": 1}] for _ in keys])
+    fetcher.gate.set()
+    cache.get("btcusdt", "1day", 200)  # cached
+
+    fetcher.gate.clear()
+    fetcher.started.clear()
+    threads, _ = run_threads(lambda: cache.get("ethusdt", "1day", 200), 1)  # in flight
+    fetcher.started.wait(5)
+    many = []
+    t = threading.Thread(target=lambda: many.append(cache.get_many(
+        [("btcusdt", "1day", 200), ("ethusdt", "1day", 200), ("solusdt", "1day", 200), ("solusdt", "1week", 100)])))
+    t.start()
+    wait_for_waiters(cache, 1)
+    fetcher.gate.set()
+    for th in threads + [t]:
+        th.join(5)
+
+    assert batches == [[("solusdt", "1day", 200), ("solusdt", "1week", 100)]]
+    [(btc, eth, sol_day, sol_week)] = many
+    assert btc is fetcher.result and eth is fetcher.result
+    assert sol_day == [{"id": 1}] and sol_week == [{"id": 1}]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["coalesced"]) == (1, 4, 1)
+
+
+def test_invalidate_one_symbol():
+    calls = []
+    cache = app.MarketDataCache(lambda *key: calls.append(key) or [{"id": 0}], ttl=60)
+    cache.get("btcusdt")
+    cache.get("ethusdt")
+    cache.invalidate("btcusdt")
+    cache.get("btcusdt")
+    cache.get("ethusdt")
+    assert [k[0] for k in calls] == ["btcusdt", "ethusdt", "btcusdt"]
@@ -0,0 +1,110 @@
+# kline_store.KlineStore: a warm series only asks the exchange for the candles
+# opened since the last stored one and merges them in; a cold one, or one the
+# fresh candles do not join, is fetched in full.
+
+import pytest
+
+from kline_store import KlineStore
+
+DAY = 86400
+T0 = 1_700_006_400  # a day boundary
+
+
+def candle(t, close=None):
+    close = float(t // DAY) if close is None else close
+    return {"id": t, "open": close, "high": close, "low": close, "close": close, "vol": 1.0}
+
+
+class Exchange:
+    """The latest n daily candles up to `now`, the last one still open."""
+
+    def __init__(self, now):
+        self.now = now
+        self.requests = []
+        self.fail = False
+
+    def fetch(self, n):
+        self.requests.append(n)
+        if self.fail:
+            return []
+        last = self.now - self.now % DAY
+        return [candle(last - i * DAY) for i in reversed(range(n))]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return KlineStore(str(tmp_path / "klines.db"), keep=50)
+
+
+def window(store, exchange, size=10):
+    return store.window("btcusdt", "1day", size, DAY, exchange.fetch, exchange.now)
+
+
+def test_cold_then_only_the_gap(store):
+    exchange = Exchange(T0 + 3600)
+    first = window(store, exchange)
+    assert exchange.requests == [10]
+    assert [c["id"] for c in first] == [T0 - i * DAY for i in reversed(range(10))]
+
+    # same day: only the still-open candle
+    exchange.now += 3600
+    assert window(store, exchange) == first
+    # three days later: the stored last candle (it may have closed since) and the three opened after it
+    exchange.now += 3 * DAY
+    later = window(store, exchange)
+    assert exchange.requests == [10, 1, 4]
+    assert [c["id"] for c in later] == [T0 + 3 * DAY - i * DAY for i in reversed(range(10))]
+    assert store.stats()["full_fetches"] == 1
+
+
+def test_fresh_candles_replace_the_open_one(store):
+    exchange = Exchange(T0 + 3600)
+    window(store, exchange)
+    updated = dict(candle(T0), close=123.0)
+    merged = store.window("btcusdt", "1day", 10, DAY, lambda n: [updated], T0 + 7200)
+    assert merged[-1] == updated and len(merged) == 10
+    assert store.read("btcusdt", "1day", 1) == [updated]
+
+
+def test_gap_that_does_not_join_refetches_in_full(store):
+    exchange = Exchange(T0 + 3600)
+    window(store, exchange)
+    # the exchange skips a day: the fresh candles start two periods after the stored last one
+    calls = []
+
+    def fetch(n):
+        calls.append(n)
+        if n < 10:
+            return [candle(T0 + 2 * DAY)]
+        return Exchange(T0 + 2 * DAY).fetch(n)
+
+    got = store.window("btcusdt", "1day", 10, DAY, fetch, T0 + DAY)
+    assert calls == [2, 10]
+    assert got[-1]["id"] == T0 + 2 * DAY and len(got) == 10
+
+
+def test_failed_fetch_returns_nothing_and_keeps_the_store(store):
+    exchange = Exchange(T0 + 3600)
+    stored = window(store, exchange)
+    exchange.fail = True
+    exchange.now += DAY
+    assert window(store, exchange) == []
+    assert store.read("btcusdt", "1day", 10) == stored
+
+
+def test_short_store_is_fetched_in_full(store):
+    exchange = Exchange(T0 + 3600)
+    window(store, exchange, size=5)
+    window(store, exchange, size=10)
+    assert exchange.requests == [5, 10]
+
+
+def test_old_candles_are_pruned(store):
+    exchange = Exchange(T0 + 3600)
+    window(store, exchange, size=10)
+    for _ in range(60):
+        exchange.now += DAY
+        window(store, exchange, size=10)
+    rows = store.read("btcusdt", "1day", 1000)
+    assert len(rows) == store.keep
+    assert rows[-1]["id"] == exchange.now - exchange.now % DAY
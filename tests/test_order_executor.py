@@ -0,0 +1,250 @@
+# OrderExecutor (order outbox) against a scripted exchange: what a claim
+# actually filled is booked into the user's cash, position and history row.
+
+import json
+
+import pytest
+
+import app
+from backends import Exchange
+from huobi_stub import start_stub_in_thread
+from strategy import UserUnitOfWork
+
+
+class ScriptedExchange(Exchange):
+    """Answers every order with respond(symbol, side, qty, client_order_id)."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.orders = []
+
+    def place_market_order(self, symbol, side, qty, client_order_id=None):
+        self.orders.append((symbol, side, qty, client_order_id))
+        return self.respond(symbol, side, qty, client_order_id)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_FILE", str(tmp_path / "users.db"))
+    monkeypatch.setattr(app, "ORDER_OUTBOX", True)
+    monkeypatch.setattr(app, "ORDER_NETTING", True)
+    app.init_db()
+    app.store.create_user("u1", None, 1000.0, 40.0, app.now_ts())
+
+
+def trade(side, qty, price, position=None):
+    """One outboxed order as the strategy books it: the whole qty at `price`."""
+    uow = UserUnitOfWork(app.strategy_env, "u1", orders=app.OutboxBatch())
+    order = uow.place_order("btcusdt", side, qty)
+    if side == "buy":
+        position = uow.add_position("btcusdt", qty, price, price * 0.9)
+        uow.add_cash(-qty * price)
+        uow.add_history("buy", "btcusdt", qty, price, order=order, position=position)
+    else:
+        position = next(p for p in uow.positions if p["id"] == position["id"])
+        uow.add_cash(qty * price)
+        uow.add_history("partial_sell", "btcusdt", qty, price, order=order, position=position)
+        uow.update_position(position, qty=position["qty"] - qty)
+    uow.flush()
+    return position
+
+
+def run_executor(monkeypatch, respond, max_attempts=1):
+    monkeypatch.setattr(app, "exchange", ScriptedExchange(respond))
+    app.OrderExecutor(workers=1, retry_seconds=0, max_attempts=max_attempts).drain()
+    return app.exchange
+
+
+def filled(symbol, side, qty, client_order_id):
+    return {"status": "ok", "order_id": "1", "filled_qty": qty, "avg_price": None}
+
+
+def last_history():
+    row = app.db_execute("SELECT qty, price, info FROM history ORDER BY id DESC LIMIT 1", fetch=True)[0]
+    return row[0], row[1], json.loads(row[2])
+
+
+def test_failed_buy_is_reversed(db, monkeypatch):
+    trade("buy", 2.0, 100.0)
+    run_executor(monkeypatch, lambda *a: {"status": "error", "message": "insufficient balance"})
+
+    assert app.get_user("u1")["cash"] == pytest.approx(1000.0)
+    assert app.get_positions("u1") == []
+    qty, _, info = last_history()
+    assert qty == 0
+    assert info["status"] == "error" and info["filled_qty"] == 0
+
+
+def test_partial_fill_is_booked(db, monkeypatch):
+    position = trade("buy", 2.0, 100.0)
+    run_executor(monkeypatch, lambda s, side, q, cid: {"status": "ok", "order_id": "1", "filled_qty": q / 2, "avg_price": 101.0})
+
+    assert app.get_user("u1")["cash"] == pytest.approx(1000.0 - 101.0)
+    [p] = app.get_positions("u1")
+    assert p["id"] == position["id"]
+    assert p["qty"] == pytest.approx(1.0) and p["avg_price"] == pytest.approx(101.0)
+    qty, price, _ = last_history()
+    assert (qty, price) == (pytest.approx(1.0), pytest.approx(101.0))
+    assert app.stop_book.user_of(p["id"]) == "u1"
+
+
+def test_failed_sell_goes_back_into_the_position(db, monkeypatch):
+    position = trade("buy", 2.0, 100.0)
+    run_executor(monkeypatch, filled)
+    trade("sell", 1.5, 120.0, position)
+    run_executor(monkeypatch, lambda *a: {"status": "error", "message": "timeout"})
+
+    assert app.get_user("u1")["cash"] == pytest.approx(800.0)
+    [p] = app.get_positions("u1")
+    assert p["qty"] == pytest.approx(2.0)
+
+
+def test_closed_position_is_reopened(db, monkeypatch):
+    position = trade("buy", 2.0, 100.0)
+    run_executor(monkeypatch, filled)
+    trade("sell", 2.0, 120.0, position)
+    assert app.get_positions("u1") == []
+    run_executor(monkeypatch, lambda *a: {"status": "error", "message": "timeout"})
+
+    [p] = app.get_positions("u1")
+    assert p["qty"] == pytest.approx(2.0) and p["avg_price"] == pytest.approx(100.0)
+    assert app.get_user("u1")["cash"] == pytest.approx(800.0)
+
+
+def test_retry_after_duplicate_is_not_reversed(db, monkeypatch):
+    trade("buy", 2.0, 100.0)
+    seen = set()
+
+    def respond(symbol, side, qty, client_order_id):
+        # the first attempt reaches the exchange but its answer is lost
+        if client_order_id not in seen:
+            seen.add(client_order_id)
+            return {"status": "error", "message": "timeout"}
+        return dict(filled(symbol, side, qty, client_order_id), duplicate=True)
+
+    exchange = run_executor(monkeypatch, respond, max_attempts=2)
+    assert len({cid for *_, cid in exchange.orders}) == 1
+    assert app.get_user("u1")["cash"] == pytest.approx(800.0)
+    assert app.get_positions("u1")[0]["qty"] == pytest.approx(2.0)
+
+
+def test_unknown_fill_is_read_again(db, monkeypatch):
+    trade("buy", 2.0, 100.0)
+    seen = set()
+
+    def respond(symbol, side, qty, client_order_id):
+        # not final when read back: the retry's duplicate lookup finds it filled
+        if client_order_id not in seen:
+            seen.add(client_order_id)
+            return {"status": "ok", "order_id": "1"}
+        return {"status": "ok", "order_id": "1", "duplicate": True, "filled_qty": qty / 4, "avg_price": 102.0}
+
+    exchange = run_executor(monkeypatch, respond, max_attempts=3)
+    assert len(exchange.orders) == 2
+    assert app.get_user("u1")["cash"] == pytest.approx(1000.0 - 0.5 * 102.0)
+    assert app.get_positions("u1")[0]["qty"] == pytest.approx(0.5)
+    assert app.outbox_counts() == {"done": 1}
+
+
+def test_fill_still_unknown_is_left_unsettled(db, monkeypatch):
+    trade("buy", 2.0, 100.0)
+    exchange = run_executor(monkeypatch, lambda *a: {"status": "ok", "order_id": "1"}, max_attempts=2)
+    assert len(exchange.orders) == 2
+    # nothing to reconcile against: booked as the strategy did
+    assert app.get_user("u1")["cash"] == pytest.approx(800.0)
+    assert app.get_positions("u1")[0]["qty"] == pytest.approx(2.0)
+    _, _, info = last_history()
+    assert info["status"] == "unsettled" and info["fills"] == [[None, None]]
+    assert app.outbox_counts() == {"unsettled": 1}
+    assert app.rollup_history() == 1
+
+
+def test_rollup_waits_for_orders_in_flight(db, monkeypatch):
+    trade("buy", 2.0, 100.0)
+    assert app.rollup_history() == 0
+    run_executor(monkeypatch, lambda *a: {"status": "error", "message": "rejected"})
+    assert app.rollup_history() == 1
+
+
+def test_async_client_fills_and_duplicates(db, monkeypatch):
+    url, stub = start_stub_in_thread(fill_ratio=0.5)
+    for name, value in {"EXCHANGE_CLIENT": "async", "HUOBI_REST_URL": url, "HUOBI_API_KEY": "key",
+                        "HUOBI_API_SECRET": "secret", "_clients_ready": False, "async_client": None,
+                        "async_bridge": None}.items():
+        monkeypatch.setattr(app, name, value)
+    trade("buy", 2.0, 100.0)
+    app.OrderExecutor(workers=1, max_attempts=1).drain()
+
+    [order] = stub.orders.values()
+    qty, price, info = last_history()
+    assert qty == pytest.approx(1.0) and price == pytest.approx(float(order["field-cash-amount"]) / float(order["field-amount"]))
+    [p] = app.get_positions("u1")
+    assert p["qty"] == pytest.approx(1.0) and p["avg_price"] == pytest.approx(price)
+    assert app.get_user("u1")["cash"] == pytest.approx(1000.0 - price)
+
+    # a resend of the same client order id reports the order already placed
+    resp = app.place_market_order_huobi("btcusdt", "buy", 2.0, client_order_id=order["client-order-id"])
+    assert resp["duplicate"] and resp["order_id"] == str(order["id"]) and resp["filled_qty"] == pytest.approx(1.0)
+    assert len(stub.orders) == 1
+
+
+class SDKOrder:
+    def __init__(self, id, state, filled_amount, filled_cash_amount):
+        self.id, self.state = id, state
+        self.filled_amount, self.filled_cash_amount = filled_amount, filled_cash_amount
+
+
+class SDKError(Exception):
+    def __init__(self, error_message):
+        super().__init__(error_message)
+        self.error_message = error_message
+
+
+class SDKTradeClient:
+    """huobi.client.trade.TradeClient as _place_market_order_huobi uses it."""
+
+    def __init__(self, create_error=None, state="filled"):
+        self.create_error = create_error
+        self.order = SDKOrder(7, state, "1.5", "150.0")
+
+    def create_order(self, **kwargs):
+        if self.create_error is not None:
+            raise SDKError(self.create_error)
+        return 7
+
+    def get_order(self, order_id):
+        return self.order
+
+    def get_order_by_client_order_id(self, client_order_id):
+        return self.order
+
+
+@pytest.fixture
+def sdk(monkeypatch):
+    monkeypatch.setattr(app, "_clients_ready", True)
+    monkeypatch.setattr(app, "async_client", None)
+    monkeypatch.setattr(app, "get_huobi_account_id", lambda: 1)
+    monkeypatch.setattr(app, "OrderType", type("OrderType", (), {"BUY_MARKET": "buy-market", "SELL_MARKET": "sell-market"}))
+
+    def use(client):
+        monkeypatch.setattr(app, "trade_client", client)
+        return client
+    return use
+
+
+def test_sdk_reports_fills_and_duplicates_by_err_code(sdk):
+    sdk(SDKTradeClient())
+    resp = app.place_market_order_huobi("btcusdt", "buy", 1.5, client_order_id="c-0")
+    assert (resp["order_id"], resp["filled_qty"], resp["avg_price"]) == (7, 1.5, 100.0)
+
+    sdk(SDKTradeClient(state="submitted"))
+    assert "filled_qty" not in app.place_market_order_huobi("btcusdt", "buy", 1.5, client_order_id="c-0")
+
+    sdk(SDKTradeClient("[Executing] order-duplicate-client-order-id: Duplicate clientOrderId"))
+    resp = app.place_market_order_huobi("btcusdt", "buy", 1.5, client_order_id="c-0")
+    assert resp["duplicate"] and resp["order_id"] == "7" and resp["filled_qty"] == 1.5
+
+    # the code, not a message that happens to mention it
+    sdk(SDKTradeClient("[Executing] order-value-min-error: order-duplicate-client-order-id check skipped"))
+    resp = app.place_market_order_huobi("btcusdt", "buy", 1.5, client_order_id="c-0")
+    assert resp["status"] == "error" and resp["err_code"] == "order-value-min-error"
@@ -0,0 +1,76 @@
+# order_netting.OrderBatch: one net exchange order (or a few slices) per
+# symbol, and every intent gets back its share of what was filled.
+
+import pytest
+
+from order_netting import OrderBatch, OrderIntent
+
+
+class Exchange:
+    def __init__(self, respond=None):
+        self.orders = []
+        self.respond = respond or (lambda symbol, side, qty: {"status": "simulated", "order_id": f"o{len(self.orders)}"})
+
+    def __call__(self, symbol, side, qty):
+        self.orders.append((symbol, side, qty))
+        return self.respond(symbol, side, qty)
+
+
+def batch_of(*intents, **kwargs):
+    batch = OrderBatch(**kwargs)
+    batch.extend([OrderIntent(*it) for it in intents])
+    return batch
+
+
+def test_buys_and_sells_cross_and_only_the_net_is_sent():
+    batch = batch_of(("u1", "btcusdt", "buy", 3.0), ("u2", "btcusdt", "sell", 1.0), ("u3", "btcusdt", "BUY", 1.0),
+                     ("u4", "ethusdt", "sell", 2.0))
+    assert batch.net() == {"btcusdt": (4.0, 1.0), "ethusdt": (0.0, 2.0)}
+    intents = list(batch.intents)
+    exchange = Exchange()
+    assert batch.execute(exchange) == 2
+    assert sorted(exchange.orders) == [("btcusdt", "buy", 3.0), ("ethusdt", "sell", 2.0)]
+    assert len(batch) == 0
+
+    u1, u2, u3, u4 = (it.result for it in intents)
+    # the buyers share the exchange order pro rata and the crossed qty internally
+    assert u1["exchange_qty"] == pytest.approx(2.25) and u1["internal_qty"] == pytest.approx(0.75)
+    assert u3["exchange_qty"] == pytest.approx(0.75) and u3["internal_qty"] == pytest.approx(0.25)
+    assert u2["exchange_qty"] == 0.0 and u2["internal_qty"] == 1.0
+    assert u1["side"] == u2["side"] == "buy" and u1["batch_intents"] == 3
+    assert u1["fills"] == [(pytest.approx(2.25), None)] and u2["fills"] == [(0.0, None)]
+    assert u4["status"] == "simulated" and u4["fills"] == [(2.0, None)]
+
+
+def test_fully_crossed_symbol_sends_nothing():
+    batch = batch_of(("u1", "btcusdt", "buy", 1.0), ("u2", "btcusdt", "sell", 1.0))
+    intents = list(batch.intents)
+    exchange = Exchange()
+    assert batch.execute(exchange) == 0
+    assert exchange.orders == []
+    for it in intents:
+        assert it.result["status"] == "internal" and it.result["side"] is None
+        assert it.result["internal_qty"] == 1.0 and it.result["fills"] == []
+
+
+def test_large_net_is_sliced():
+    batch = batch_of(("u1", "btcusdt", "buy", 5.0), ("u2", "btcusdt", "buy", 5.0), max_slice_qty=4.0)
+    intents = list(batch.intents)
+    exchange = Exchange()
+    assert batch.execute(exchange) == 3
+    assert [q for *_, q in exchange.orders] == [pytest.approx(10 / 3)] * 3
+    assert intents[0].result["order_ids"] == ["o1", "o2", "o3"]
+    assert intents[0].result["fills"] == [(pytest.approx(5 / 3), None)] * 3
+
+
+def test_reported_fills_are_shared_and_unknown_ones_stay_unknown():
+    responses = iter([{"status": "ok", "order_id": "a", "filled_qty": 1.0, "avg_price": 101.0},
+                      {"status": "error", "message": "rejected"},
+                      {"status": "ok", "order_id": "c"}])
+    batch = batch_of(("u1", "btcusdt", "buy", 3.0), ("u2", "btcusdt", "buy", 3.0), max_slice_qty=2.0)
+    intents = list(batch.intents)
+    batch.execute(Exchange(lambda *a: next(responses)))
+    result = intents[0].result
+    assert result["status"] == "error" and result["errors"] == ["rejected"]
+    assert result["order_ids"] == ["a", "c"]
+    assert result["fills"] == [(0.5, 101.0), (0.0, None), (None, None)]
@@ -0,0 +1,156 @@
+# StrategyScheduler ticks against a SQLite store: only the users written since
+# the last tick are re-read into the stop book (everything on the first tick
+# and after leadership is gained), without losing the ratchets the feed saw.
+
+import pytest
+
+import app
+from stop_book import StopBook
+
+
+class Lease:
+    owner = "test"
+
+    def __init__(self):
+        self.held = True
+
+    def acquire(self):
+        return self.held
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_FILE", str(tmp_path / "users.db"))
+    monkeypatch.setattr(app, "stop_book", StopBook(app.TRAILING_STOP_FACTOR))
+    monkeypatch.setattr(app, "compute_signal_snapshots", lambda symbols: {s: None for s in symbols})
+    app.init_db()
+    for uid in ("u1", "u2"):
+        app.store.create_user(uid, None, 1000.0, 40.0, app.now_ts())
+    app.add_position("u1", "btcusdt", 1.0, 100.0, 90.0)
+    app.add_position("u2", "btcusdt", 1.0, 200.0, 180.0)
+
+
+def full_loads(monkeypatch):
+    loads = []
+    load = app.stop_book.load
+    monkeypatch.setattr(app.stop_book, "load", lambda rows: loads.append(rows) or load(rows))
+    return loads
+
+
+def test_only_written_users_are_reread(db, monkeypatch):
+    loads = full_loads(monkeypatch)
+    scheduler = app.StrategyScheduler(workers=1)
+    scheduler.run_cycle()
+    assert len(loads) == 1 and len(app.stop_book) == 2
+
+    scanned = []
+    monkeypatch.setattr(app, "load_users_with_positions", lambda ids=None: scanned.append(ids) or {})
+    app.db_execute("UPDATE users SET updated_at=0 WHERE user_id='u1'")
+    scheduler.run_cycle()
+    assert len(loads) == 1
+    assert scanned == [["u2"]]
+
+
+def test_positions_written_elsewhere_reach_the_book(db, monkeypatch):
+    loads = full_loads(monkeypatch)
+    scheduler = app.StrategyScheduler(workers=1)
+    scheduler.run_cycle()
+    # another process opens a position and closes one
+    app.add_position("u1", "ethusdt", 2.0, 10.0, 9.0)
+    app.db_execute("DELETE FROM positions WHERE user_id='u2'")
+    scheduler.run_cycle()
+    assert len(loads) == 1
+    assert sorted(uid for _, uid in app.stop_book.on_price("ethusdt", 8.0)) == ["u1"]
+    assert app.stop_book.on_price("btcusdt", 150.0) == []
+
+
+def test_feed_peaks_survive_the_reread(db, monkeypatch):
+    scheduler = app.StrategyScheduler(workers=1)
+    scheduler.run_cycle()
+    pid = app.db_execute("SELECT id FROM positions WHERE user_id='u1'", fetch=True)[0][0]
+    app.stop_book.on_price("btcusdt", 150.0)
+    scheduler.run_cycle()
+    # flushed to the row, and the book re-read from it
+    ratchet = 150.0 * app.TRAILING_STOP_FACTOR
+    assert app.db_execute("SELECT trailing_stop FROM positions WHERE id=?", (pid,), fetch=True)[0][0] == pytest.approx(ratchet)
+    assert app.stop_book.stop_of(pid) == pytest.approx(ratchet)
+
+    # a peak the feed records while the tick re-reads u1 is kept
+    replace = app.stop_book.replace_users
+
+    def racing_replace(user_ids, rows):
+        app.stop_book.on_price("btcusdt", 160.0)
+        replace(user_ids, rows)
+
+    monkeypatch.setattr(app.stop_book, "replace_users", racing_replace)
+    below = 160.0 * app.TRAILING_STOP_FACTOR - 1
+    assert pid not in dict(app.stop_book.on_price("btcusdt", below))
+    scheduler.run_cycle()
+    assert pid in dict(app.stop_book.on_price("btcusdt", below))
+
+
+def test_leadership_gain_reloads_everything(db, monkeypatch):
+    loads = full_loads(monkeypatch)
+    lease = Lease()
+    scheduler = app.StrategyScheduler(workers=1, lease=lease)
+    assert scheduler._check_leader()
+    scheduler.run_cycle()
+    lease.held = False
+    assert not scheduler._check_leader()
+    lease.held = True
+    assert scheduler._check_leader()
+    scheduler.run_cycle()
+    assert len(loads) == 2
+
+
+def test_symbols_follow_written_users(db, monkeypatch):
+    requested, priced = [], []
+    monkeypatch.setattr(app, "compute_signal_snapshots", lambda symbols: requested.append(symbols) or {s: None for s in symbols})
+    monkeypatch.setattr(app, "get_prices", lambda symbols: priced.append(symbols) or {})
+    scheduler = app.StrategyScheduler(workers=1)
+    scheduler.run_cycle()
+    assert requested[-1] == ["btcusdt"]
+
+    app.set_user_symbols("u1", "ethusdt")
+    app.add_position("u2", "solusdt", 1.0, 10.0, 9.0)
+    scans = []
+    monkeypatch.setattr(app, "db_execute", lambda query, *a, db_execute=app.db_execute, **kw:
+                        scans.append(query) or db_execute(query, *a, **kw))
+    scheduler.run_cycle()
+    assert requested[-1] == ["btcusdt", "ethusdt"]
+    assert not any("DISTINCT" in q for q in scans)
+
+    app.set_user_symbols("u2", "ethusdt")
+    app.db_execute("DELETE FROM positions WHERE user_id='u2' AND symbol='btcusdt'")
+    snapshot = app.strategy.SignalSnapshot("ethusdt", 10.0, 10.0, 10.0, 0.0, 0.0, 50.0, 0.1, 0.01, False, 0)
+    monkeypatch.setattr(app, "compute_signal_snapshots", lambda symbols: requested.append(symbols) or {s: snapshot for s in symbols})
+    monkeypatch.setattr(app, "evaluate_user_strategy", lambda *a, **kw: {})
+    scheduler.run_cycle()
+    # u1's btcusdt position and u2's solusdt one are outside every universe now
+    assert requested[-1] == ["ethusdt"]
+    assert priced[-1] == ["btcusdt", "solusdt"]
+
+
+class NoExchange(app.Exchange):
+    def place_market_order(self, symbol, side, qty, client_order_id=None):
+        raise AssertionError("the scheduler sent an order with the outbox on")
+
+
+def test_outbox_is_the_only_send_path(db, monkeypatch):
+    monkeypatch.setattr(app, "ORDER_OUTBOX", True)
+    monkeypatch.setattr(app, "exchange", NoExchange())
+    monkeypatch.setattr(app.strategy_env, "exchange", app.exchange)
+    monkeypatch.setattr(app.strategy_env, "stop_book", app.stop_book)
+    snapshot = app.strategy.SignalSnapshot("btcusdt", 150.0, 140.0, 130.0, 1.0, 0.5, 60.0, 3.0, 0.02, True, 0)
+    monkeypatch.setattr(app, "compute_signal_snapshots", lambda symbols: {s: snapshot for s in symbols})
+    scheduler = app.StrategyScheduler(workers=2)
+
+    scheduler.run_cycle()
+    # u1 takes profit and both buy; u2 is stopped out
+    orders = app.db_execute("SELECT COUNT(*) FROM history WHERE info LIKE '%pending%'", fetch=True)[0][0]
+    assert orders == 4
+    assert app.outbox_counts() == {"pending": orders}
+
+    app.add_position("u1", "btcusdt", 1.0, 150.0, 140.0)
+    scheduler.run_stop_check("btcusdt", 120.0, ["u1"])
+    assert app.outbox_counts() == {"pending": orders + 2}
@@ -0,0 +1,105 @@
+# stop_book.StopBook: a price returns exactly the positions whose effective
+# stop (stored, or ratcheted lazily to factor * peak) is above it, and flush()
+# materializes the ratchets as one batch of raised stops.
+
+import random
+
+import pytest
+
+from stop_book import StopBook
+
+FACTOR = 0.9
+
+
+def hit_ids(book, symbol, price):
+    return sorted(pid for pid, _ in book.on_price(symbol, price))
+
+
+def test_stored_stops_trigger():
+    book = StopBook(FACTOR)
+    book.load([(1, "u1", "btcusdt", 100.0, 90.0), (2, "u2", "btcusdt", 100.0, 80.0), (3, "u3", "ethusdt", 10.0, 9.5)])
+    assert book.on_price("btcusdt", 95.0) == []
+    assert hit_ids(book, "btcusdt", 85.0) == [1]
+    assert sorted(book.on_price("btcusdt", 79.0)) == [(1, "u1"), (2, "u2")]
+    assert book.on_price("solusdt", 1.0) == []
+
+
+def test_ratchets_are_lazy_until_flushed():
+    book = StopBook(FACTOR)
+    book.load([(1, "u1", "btcusdt", 100.0, 90.0), (2, "u2", "btcusdt", 150.0, 135.0)])
+    # peak 140: position 1 (bought below it) has an effective stop of 126, position 2 is not in profit
+    assert book.on_price("btcusdt", 140.0) == []
+    assert book.stop_of(1) == 90.0
+    assert hit_ids(book, "btcusdt", 125.0) == [1, 2]
+    assert hit_ids(book, "btcusdt", 130.0) == [2]
+
+    assert book.flush() == [(pytest.approx(126.0), 1)]
+    assert book.stop_of(1) == pytest.approx(126.0)
+    # the peak was consumed: the stored stops alone decide now
+    assert book.flush() == []
+    assert hit_ids(book, "btcusdt", 125.5) == [1, 2]
+
+
+def test_flush_never_lowers_a_stop_and_can_target_one_symbol():
+    book = StopBook(FACTOR)
+    book.load([(1, "u1", "btcusdt", 100.0, 120.0), (2, "u1", "ethusdt", 10.0, 9.0)])
+    book.on_price("btcusdt", 125.0)
+    book.on_price("ethusdt", 20.0)
+    assert book.flush("btcusdt") == []
+    assert book.stop_of(1) == 120.0
+    assert book.flush("ethusdt") == [(pytest.approx(18.0), 2)]
+
+
+def test_upsert_remove_and_replace_users():
+    book = StopBook(FACTOR)
+    book.load([(1, "u1", "btcusdt", 100.0, 90.0), (2, "u1", "btcusdt", 100.0, 95.0), (3, "u2", "btcusdt", 100.0, 92.0)])
+    book.upsert(1, "u1", "btcusdt", 100.0, 80.0)
+    book.remove(3)
+    assert hit_ids(book, "btcusdt", 91.0) == [2]
+    assert len(book) == 2
+
+    book.replace_users(["u1", "u3"], [(4, "u1", "ethusdt", 10.0, 9.0), (5, "u3", "btcusdt", 50.0, 45.0)])
+    assert len(book) == 2
+    assert book.user_of(1) is None and book.user_of(4) == "u1"
+    assert hit_ids(book, "btcusdt", 40.0) == [5]
+    assert hit_ids(book, "ethusdt", 8.0) == [4]
+
+
+def test_reloads_keep_the_peaks():
+    book = StopBook(FACTOR)
+    book.load([(1, "u1", "btcusdt", 100.0, 90.0)])
+    book.on_price("btcusdt", 200.0)
+    book.load([(1, "u1", "btcusdt", 100.0, 90.0)])
+    book.replace_users(["u1"], [(1, "u1", "btcusdt", 100.0, 90.0)])
+    assert book.flush() == [(pytest.approx(180.0), 1)]
+
+
+def test_matches_a_full_scan():
+    rng = random.Random(5)
+    book = StopBook(FACTOR)
+    positions = {}  # pid -> [avg, stop]
+    for pid in range(300):
+        avg = rng.uniform(50, 150)
+        positions[pid] = [avg, avg * rng.uniform(0.7, 1.0)]
+    book.load([(pid, f"u{pid % 40}", "btcusdt", avg, stop) for pid, (avg, stop) in positions.items()])
+
+    price, peak = 100.0, None
+    for step in range(2000):
+        price *= rng.uniform(0.97, 1.03)
+        peak = price if peak is None else max(peak, price)
+        expected = sorted(pid for pid, (avg, stop) in positions.items()
+                          if max(stop, FACTOR * peak if avg < peak else stop) > price)
+        assert hit_ids(book, "btcusdt", price) == expected
+        if step % 50 == 0:
+            changes = dict((pid, stop) for stop, pid in book.flush())
+            for pid, (avg, stop) in positions.items():
+                if avg < peak and FACTOR * peak > stop:
+                    assert changes.pop(pid) == pytest.approx(FACTOR * peak)
+                    positions[pid][1] = FACTOR * peak
+            assert changes == {}
+            peak = None
+        if step % 7 == 0:
+            pid = rng.randrange(300)
+            avg = rng.uniform(50, 150)
+            positions[pid] = [avg, avg * rng.uniform(0.7, 1.0)]
+            book.upsert(pid, f"u{pid % 40}", "btcusdt", *positions[pid])
@@ -0,0 +1,138 @@
+# Optimistic user commits: a unit of work whose user was written by someone
+# else after it loaded them is refused (backends.StaleUser) instead of
+# overwriting that write with its stale cash / positions.
+
+import pytest
+
+import app
+from backends import Exchange, ManualClock, MarketData, MemoryStore, SimulatedExchange, StaleUser
+from strategy import SignalSnapshot, StrategyEnv, UserUnitOfWork
+
+
+@pytest.fixture
+def sqlite_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_FILE", str(tmp_path / "users.db"))
+    app.init_db()
+    app.store.create_user("u1", None, 100.0, 40.0, app.now_ts())
+    return app.strategy_env
+
+
+@pytest.fixture
+def memory_env():
+    env = StrategyEnv(ManualClock(1_700_000_000), MemoryStore(), SimulatedExchange())
+    env.store.create_user("u1", None, 100.0, 40.0, env.clock.now())
+    return env
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def env(request):
+    return request.getfixturevalue(f"{request.param}_env")
+
+
+def test_stale_unit_of_work_is_refused(env):
+    slow = UserUnitOfWork(env, "u1")
+    fast = UserUnitOfWork(env, "u1")
+    fast.add_cash(-10)
+    fast.flush()
+
+    slow.add_cash(1000)
+    slow.add_history("manual_deposit", "", 0, 0, "deposit 1000")
+    with pytest.raises(StaleUser):
+        slow.flush()
+    assert env.store.get_user("u1")["cash"] == 90.0
+
+    retry = UserUnitOfWork(env, "u1")
+    retry.add_cash(1000)
+    retry.flush()
+    assert env.store.get_user("u1")["cash"] == 1090.0
+
+
+def test_position_writes_bump_the_version(env):
+    uow = UserUnitOfWork(env, "u1")
+    uow.add_position("btcusdt", 1.0, 50.0, 45.0)
+    uow.flush()
+    stale = UserUnitOfWork(env, "u1")
+    pos = stale.positions[0]
+
+    env.store.raise_stops([(47.0, pos["id"])])
+    stale.update_position(pos, qty=0.5)
+    with pytest.raises(StaleUser):
+        stale.flush()
+
+
+def test_consecutive_flushes_of_one_unit_of_work(env):
+    uow = UserUnitOfWork(env, "u1")
+    uow.add_cash(-10)
+    uow.flush()
+    uow.add_cash(-10)
+    uow.flush()
+    assert env.store.get_user("u1")["cash"] == 80.0
+
+
+def test_deposit_endpoint_applies_on_fresh_row(sqlite_env, monkeypatch):
+    client = app.create_app().test_client()
+    flush = UserUnitOfWork.flush
+    raced = []
+
+    def racing_flush(self):
+        # another writer commits between the deposit's load and its commit, once
+        if not raced:
+            raced.append(True)
+            other = UserUnitOfWork(sqlite_env, "u1")
+            other.add_cash(-10)
+            flush(other)
+        flush(self)
+
+    monkeypatch.setattr(UserUnitOfWork, "flush", racing_flush)
+    res = client.post("/deposit", json={"user_id": "u1", "amount": 1000})
+    assert res.status_code == 200
+    assert res.get_json()["new_cash"] == 1090.0
+    assert app.get_user("u1")["cash"] == 1090.0
+
+
+def test_run_strategy_reevaluates_on_conflict(sqlite_env, monkeypatch):
+    client = app.create_app().test_client()
+    calls = []
+
+    def evaluate(env, user_id, symbol=None, **kwargs):
+        calls.append(kwargs["orders"])
+        if len(calls) < 3:
+            raise StaleUser(user_id)
+        return {"status": "ok", "actions": []}
+
+    monkeypatch.setattr(app.strategy, "evaluate_user_strategy", evaluate)
+    res = client.post("/run_strategy", json={"user_id": "u1"})
+    assert res.status_code == 200
+    assert len(calls) == 3
+    # every attempt queues its orders, so a refused one never sent any
+    assert all(batch is not None for batch in calls)
+
+    calls.clear()
+    monkeypatch.setattr(app, "USER_COMMIT_ATTEMPTS", 2)
+    res = client.post("/run_strategy", json={"user_id": "u1"})
+    assert res.status_code == 409
+    assert len(calls) == 2
+
+
+class NoExchange(Exchange):
+    def place_market_order(self, symbol, side, qty, client_order_id=None):
+        raise AssertionError("evaluation sent an order to the exchange")
+
+
+class BuySignal(MarketData):
+    def snapshot(self, symbol):
+        return SignalSnapshot(symbol, 100.0, 90.0, 80.0, 1.0, 0.5, 60.0, 2.0, 0.02, True, "2024-01-01T00:00:00")
+
+
+def test_run_strategy_with_outbox_only_records_orders(sqlite_env, monkeypatch):
+    monkeypatch.setattr(app, "ORDER_OUTBOX", True)
+    monkeypatch.setattr(app, "exchange", NoExchange())
+    monkeypatch.setattr(sqlite_env, "exchange", app.exchange)
+    monkeypatch.setattr(sqlite_env, "market_data", BuySignal())
+    client = app.create_app().test_client()
+
+    res = client.post("/run_strategy", json={"user_id": "u1", "symbol": "btcusdt"})
+    assert res.status_code == 200
+    assert res.get_json()["actions"] == ["buy:40.0"]
+    rows = app.db_execute("SELECT status, side, qty FROM order_outbox", fetch=True)
+    assert rows == [("pending", "buy", pytest.approx(0.4))]
@@ -0,0 +1,117 @@
+# wake_index.WakeIndex: who is due, and a heap that stays proportional to the
+# live wake-ups however often users are re-planned; and evaluating only the due
+# users (strategy.wake_plan) ends in the same state as evaluating everyone.
+
+import random
+
+import strategy
+from backends import ManualClock, MemoryStore, SimulatedExchange
+from strategy import SignalSnapshot, StrategyEnv, WakePlan
+from wake_index import WakeIndex
+
+
+def timer(at):
+    return WakePlan(at, {}, (), False)
+
+
+def test_due_by_time_band_buy_and_always():
+    index = WakeIndex()
+    index.update("t", timer(100))
+    index.update("b", WakePlan(None, {"btcusdt": (90.0, 110.0)}, (), False))
+    index.update("s", WakePlan(None, {}, ("ethusdt",), False))
+    index.update("a", WakePlan(None, {}, (), True))
+
+    assert index.due(50, {"btcusdt": 100.0}) == {"a"}
+    assert index.due(100, {"btcusdt": 110.0}, ["ethusdt"]) == {"t", "b", "s", "a"}
+    # the time wake-up was consumed
+    assert index.due(200, {"btcusdt": 100.0}) == {"a"}
+
+
+def test_unchanged_wake_up_keeps_its_entry():
+    index = WakeIndex()
+    for _ in range(1000):
+        index.update("u", timer(100))
+    assert index.stats()["heap"] == 1
+    assert index.due(100, {}) == {"u"}
+    # consumed: the same time queued again is a new entry
+    index.update("u", timer(100))
+    assert index.due(100, {}) == {"u"}
+
+
+def test_heap_stays_bounded_under_replans():
+    rng = random.Random(7)
+    index = WakeIndex()
+    users = [f"u{i}" for i in range(100)]
+    for step in range(20000):
+        uid = rng.choice(users)
+        if rng.random() < 0.05:
+            index.remove(uid)
+        else:
+            index.update(uid, timer(rng.randrange(1000, 2000) if rng.random() < 0.9 else None))
+        stats = index.stats()
+        assert stats["heap"] <= 2 * stats["timers"] + 1
+    expected = {uid for uid in users if uid in index and index._plans[uid][0].at is not None}
+    assert index.due(2000, {}) == expected
+    assert index.stats()["timers"] == 0
+
+
+SYMBOLS = ("btcusdt", "ethusdt")
+DAY = 86400
+
+
+def random_env(seed, n_users, start):
+    rng = random.Random(seed)
+    env = StrategyEnv(ManualClock(start), MemoryStore(), SimulatedExchange())
+    store = env.store
+    for i in range(n_users):
+        uid = f"u{i}"
+        cash = rng.choice([0.5, 20.0, 100.0, 5000.0])
+        store.create_user(uid, None, cash, rng.choice([40.0, 52.0, 300.0]), start - rng.randrange(0, 40 * DAY),
+                          symbols=rng.choice([None, "btcusdt", "ethusdt", "btcusdt,ethusdt"]))
+        store.users[uid]["max_equity"] = cash * rng.uniform(0.5, 3.0)
+        for _ in range(rng.choice([0, 0, 1, 1, 2])):
+            avg = rng.uniform(50, 150)
+            pid = store._next_pos_id
+            store._next_pos_id += 1
+            store.positions[pid] = {
+                "id": pid, "user_id": uid, "symbol": rng.choice(SYMBOLS), "qty": rng.uniform(0.1, 5.0),
+                "avg_price": avg, "entry_time": start - rng.randrange(0, 90 * DAY),
+                "trailing_stop": avg * rng.uniform(0.7, 1.0),
+                "last_profit_check_price": rng.choice([None, avg * rng.uniform(1.0, 1.5)]),
+            }
+    return env
+
+
+def state(store):
+    users = {uid: {k: v for k, v in u.items() if k != "version"} for uid, u in store.users.items()}
+    return users, store.positions, store.history
+
+
+def test_wake_plans_match_evaluating_everyone():
+    start = 1_700_000_000
+    rng = random.Random(11)
+    everyone = random_env(3, 200, start)
+    woken = random_env(3, 200, start)
+    index = WakeIndex()
+    for uid in woken.store.user_ids():
+        index.update(uid, strategy.wake_plan(woken.store.get_user(uid), woken.store.get_positions(uid), start))
+
+    prices = {s: 100.0 for s in SYMBOLS}
+    now = start
+    for _ in range(150):
+        now += rng.choice([60, 3600, DAY, 7 * DAY])
+        prices = {s: p * rng.uniform(0.85, 1.15) for s, p in prices.items()}
+        snapshots = {s: SignalSnapshot(s, p, p, p, 0.0, 0.0, rng.uniform(30, 80), p * 0.02, rng.uniform(0.01, 0.05),
+                                       rng.random() < 0.2, now)
+                     for s, p in prices.items()}
+        for env in (everyone, woken):
+            env.clock.set(now)
+
+        for uid in sorted(everyone.store.user_ids()):
+            strategy.evaluate_user_strategy(everyone, uid, snapshots=snapshots, prices=prices)
+        due = index.due(now, prices, [s for s, snap in snapshots.items() if snap.can_buy])
+        for uid in sorted(due):
+            strategy.evaluate_user_strategy(woken, uid, snapshots=snapshots, prices=prices)
+            index.update(uid, strategy.wake_plan(woken.store.get_user(uid), woken.store.get_positions(uid), now))
+
+        assert state(woken.store) == state(everyone.store)
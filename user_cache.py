@@ -0,0 +1,94 @@
+# user_cache.py
+# Read-through cache of per-user responses (balance snapshot, history pages)
+# for the HTTP endpoints: LRU over users, TTL per value, dropped on every write
+# to the user.
+#
+# Writers call invalidate(user_id) after committing. A reader that missed takes
+# a generation token from get() and hands it back to put(); if the user was
+# invalidated in between, the (possibly stale) value is not stored.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _UserEntry:
+    __slots__ = ("gen", "values")
+
+    def __init__(self):
+        self.gen = 0
+        self.values = {}  # key -> (expires_at, value)
+
+
+class UserStateCache:
+    def __init__(self, maxsize=10000, ttl=5.0, max_keys_per_user=32):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_keys_per_user = max_keys_per_user
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # user_id -> _UserEntry, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, user_id, key):
+        """(value, gen): value is None on a miss; pass gen to put() with the freshly loaded value."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = _UserEntry()
+                self._evict()
+            else:
+                self._users.move_to_end(user_id)
+            cached = entry.values.get(key)
+            if cached is not None and cached[0] > now:
+                self.hits += 1
+                return cached[1], entry.gen
+            self.misses += 1
+            return None, entry.gen
+
+    def put(self, user_id, key, value, gen):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry.gen != gen:
+                return  # evicted or written since the read: don't cache what may be stale
+            if key not in entry.values and len(entry.values) >= self.max_keys_per_user:
+                entry.values.pop(next(iter(entry.values)))
+            entry.values[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                entry.gen += 1
+                entry.values.clear()
+                self.invalidations += 1
+
+    def invalidate_many(self, user_ids):
+        for user_id in set(user_ids):
+            self.invalidate(user_id)
+
+    def clear(self):
+        with self._lock:
+            for entry in self._users.values():
+                entry.gen += 1
+                entry.values.clear()
+
+    def _evict(self):
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "users": len(self._users),
+            }
@@ -0,0 +1,137 @@
+# wake_index.py
+# Which users can have anything to do on this tick, from the wake plans
+# strategy.wake_plan() computes after each change to a user: a heap of time
+# wake-ups, sorted price bands per symbol and buy-signal subscribers. due()
+# costs O(log n + woken users), so idle users cost nothing per tick. A re-plan
+# with an unchanged wake-up time keeps its heap entry, and the entries other
+# re-plans leave stale are dropped (heapify) once they outnumber the live ones.
+
+import heapq
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+# bands are widened by this (relative) margin so float rounding never hides a crossing
+_EPS = 1e-9
+_MAX_ID = "\U0010ffff"
+
+
+class _SymbolBands:
+    def __init__(self):
+        self.lows = []   # sorted (low, user_id): woken when price < low
+        self.highs = []  # sorted (high, user_id): woken when price >= high
+
+
+class WakeIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans = {}      # user_id -> (plan, version, queued): queued while its heap entry is live
+        self._heap = []       # (at, version, user_id); stale entries are skipped
+        self._timers = 0      # live heap entries
+        self._bands = {}      # symbol -> _SymbolBands
+        self._buyers = {}     # symbol -> set of user ids
+        self._always = set()
+        self._version = 0
+
+    def __len__(self):
+        return len(self._plans)
+
+    def __contains__(self, user_id):
+        return user_id in self._plans
+
+    @staticmethod
+    def _remove_sorted(items, item):
+        i = bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    def _unlink(self, user_id):
+        """Take the user's plan out of the bands and sets; returns its (plan, version, queued) entry."""
+        entry = self._plans.pop(user_id, None)
+        if entry is None:
+            return None
+        plan = entry[0]
+        for symbol, (low, high) in plan.bands.items():
+            book = self._bands[symbol]
+            self._remove_sorted(book.lows, (low * (1 + _EPS), user_id))
+            self._remove_sorted(book.highs, (high * (1 - _EPS), user_id))
+        for symbol in plan.buy_symbols:
+            self._buyers[symbol].discard(user_id)
+        self._always.discard(user_id)
+        if entry[2]:
+            self._timers -= 1  # its heap entry is stale from now on
+        return entry
+
+    def _compact(self):
+        if len(self._heap) > 2 * self._timers:
+            self._heap = [e for e in self._heap if self._plans.get(e[2], (None, None, False))[1:] == (e[1], True)]
+            heapq.heapify(self._heap)
+
+    def update(self, user_id, plan):
+        """Replace the user's plan (a strategy.WakePlan)."""
+        with self._lock:
+            old = self._unlink(user_id)
+            if old is not None and old[2] and old[0].at == plan.at:
+                # same wake-up, still queued: the heap entry stays valid under the old version
+                self._plans[user_id] = (plan, old[1], True)
+                self._timers += 1
+            else:
+                self._version += 1
+                queued = plan.at is not None
+                self._plans[user_id] = (plan, self._version, queued)
+                if queued:
+                    heapq.heappush(self._heap, (plan.at, self._version, user_id))
+                    self._timers += 1
+                self._compact()
+            for symbol, (low, high) in plan.bands.items():
+                book = self._bands.get(symbol)
+                if book is None:
+                    book = self._bands[symbol] = _SymbolBands()
+                insort(book.lows, (low * (1 + _EPS), user_id))
+                insort(book.highs, (high * (1 - _EPS), user_id))
+            for symbol in plan.buy_symbols:
+                self._buyers.setdefault(symbol, set()).add(user_id)
+            if plan.always:
+                self._always.add(user_id)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._unlink(user_id)
+            self._compact()
+
+    def due(self, now, prices, buy_symbols=()):
+        """
+        User ids to evaluate at `now` with these {symbol: price}: time wake-ups
+        that passed (taken off the heap: the caller re-plans them), bands the
+        price left, buyers of `buy_symbols` (symbols with a buy signal) and the
+        always set.
+        """
+        with self._lock:
+            out = set(self._always)
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, version, user_id = heapq.heappop(heap)
+                entry = self._plans.get(user_id)
+                if entry is not None and entry[1] == version and entry[2]:
+                    self._plans[user_id] = (entry[0], version, False)
+                    self._timers -= 1
+                    out.add(user_id)
+            for symbol, price in prices.items():
+                book = self._bands.get(symbol)
+                if book is None or price is None:
+                    continue
+                out.update(uid for _, uid in book.lows[bisect_right(book.lows, (price, _MAX_ID)):])
+                out.update(uid for _, uid in book.highs[:bisect_right(book.highs, (price, _MAX_ID))])
+            for symbol in buy_symbols:
+                out.update(self._buyers.get(symbol, ()))
+            return out
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._plans),
+                "timers": self._timers,
+                "heap": len(self._heap),
+                "banded": sum(len(b.lows) for b in self._bands.values()),
+                "buyers": sum(len(b) for b in self._buyers.values()),
+                "always": len(self._always),
+            }